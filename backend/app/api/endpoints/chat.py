@@ -1,14 +1,15 @@
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import json
 import logging
 
 from app.models.api import ChatRequest, ChatResponse
-from app.services.session_manager import session_manager
-from app.services.rag_service import RagService
+from app.services.container import services
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
-rag_service = RagService()
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
@@ -19,33 +20,36 @@ async def chat(
     """
     Chat with the RAG system
     """
-    # Get session
-    session = session_manager.get_session(request)
+    # Get session; the store may read from disk, so keep it off the event loop
+    session = await run_in_threadpool(services.session_manager.get_session, request)
     
     # Set session cookie
-    session_manager.set_session_cookie(response, session)
+    services.session_manager.set_session_cookie(response, session)
     
     # Check if the session has files/collection
     if not session.collection_name or not session.uploaded_files:
         raise HTTPException(status_code=400, detail="No files have been uploaded yet. Please upload files first.")
     
-    # Get chat history
-    chat_history = session.get_chat_history()
+    # Recent turns and a summary of older ones, taken before adding the new message
+    chat_history, history_summary = await run_in_threadpool(services.history_manager.get_history, session)
     
-    # Add user message to history
-    session_manager.add_chat_message(session, "user", chat_request.text)
+    def record_turn(answer: str, sources: Optional[List[Dict[str, Any]]]) -> None:
+        services.session_manager.add_chat_message(session, "user", chat_request.text)
+        services.session_manager.add_chat_message(session, "assistant", answer)
+        services.history_manager.schedule_summary(session, services.rag_service)
     
-    # Query RAG system
-    answer, sources = rag_service.query(
+    # Query RAG system; a duplicate of a question still being answered shares its answer.
+    # The turn is added to history once, after answering so duplicates see the same history,
+    # and by the shared work so it is kept even if the client that asked first disconnects
+    answer, sources, _ = await services.rag_service.aquery_coalesced(
         query=chat_request.text,
         collection_name=session.collection_name,
         chat_history=chat_history,
-        use_web_search=chat_request.use_web_search
+        use_web_search=chat_request.use_web_search,
+        history_summary=history_summary,
+        on_answer=record_turn
     )
     
-    # Add assistant message to history
-    session_manager.add_chat_message(session, "assistant", answer)
-    
     # Build response
     chat_response = ChatResponse(
         reply=answer,
@@ -53,3 +57,63 @@ async def chat(
     )
     
     return chat_response
+
+def _format_sse(event: str, data: Any) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: Request,
+    chat_request: ChatRequest
+):
+    """
+    Chat with the RAG system, streaming the response as Server-Sent Events
+    
+    Emits a "sources" event as soon as retrieval finishes, then a "token"
+    event per generated token and a final "done" event with the full answer.
+    """
+    # Get session; the store may read from disk, so keep it off the event loop
+    session = await run_in_threadpool(services.session_manager.get_session, request)
+    
+    # Check if the session has files/collection
+    if not session.collection_name or not session.uploaded_files:
+        raise HTTPException(status_code=400, detail="No files have been uploaded yet. Please upload files first.")
+    
+    # Recent turns and a summary of older ones, taken before adding the new message
+    chat_history, history_summary = await run_in_threadpool(services.history_manager.get_history, session)
+    
+    # Add user message to history
+    services.session_manager.add_chat_message(session, "user", chat_request.text)
+    
+    async def event_stream():
+        answer_parts = []
+        try:
+            async for event, data in services.rag_service.astream_query(
+                query=chat_request.text,
+                collection_name=session.collection_name,
+                chat_history=chat_history,
+                use_web_search=chat_request.use_web_search,
+                history_summary=history_summary
+            ):
+                if event == "token":
+                    answer_parts.append(data)
+                elif event == "error":
+                    answer_parts = [data]
+                yield _format_sse(event, data)
+        finally:
+            # Store whatever was generated, even if the client disconnected
+            if answer_parts:
+                services.session_manager.add_chat_message(session, "assistant", "".join(answer_parts))
+                services.history_manager.schedule_summary(session, services.rag_service)
+    
+    streaming_response = StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    
+    # Set session cookie
+    services.session_manager.set_session_cookie(streaming_response, session)
+    
+    return streaming_response
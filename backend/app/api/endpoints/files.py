@@ -1,5 +1,4 @@
 import os
-import shutil
 from typing import List, Dict, Any, Optional
 from fastapi import (
     APIRouter, 
@@ -11,95 +10,161 @@ from fastapi import (
     Request,
     Response
 )
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 import logging
-import uuid
 
-from app.models.api import UploadResponse, FileListResponse
-from app.services.session_manager import session_manager
-from app.services.rag_service import RagService
+from app.models.api import UploadResponse, FileListResponse, JobStatusResponse, FileDeleteResponse
+from app.services.container import services
+from app.core.admission import hold_admission
 from app.core.config import settings
+from app.utils.file_utils import (
+    SavedUpload, UploadTooLargeError, receive_upload_files, get_file_extension, remove_upload_file
+)
+from app.utils.timing import stage
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
-rag_service = RagService()
 
-@router.post("/upload", response_model=UploadResponse)
+SUPPORTED_EXTENSIONS = ['.pdf', '.csv', '.txt', '.xls', '.xlsx']
+
+def _upload_form(field: str, multiple: bool) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints that stream their multipart body themselves"""
+    file_schema = {"type": "string", "format": "binary"}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": [field],
+                        "properties": {
+                            field: {"type": "array", "items": file_schema} if multiple else file_schema
+                        },
+                    }
+                }
+            },
+        }
+    }
+
+def _is_supported(filename: str) -> bool:
+    return get_file_extension(filename) in SUPPORTED_EXTENSIONS
+
+async def _receive_files(request: Request, field: str, max_files: Optional[int] = None) -> List[SavedUpload]:
+    """Stream a request's files to disk, turning size and format errors into HTTP errors"""
+    try:
+        with stage("upload_save"):
+            uploads = await receive_upload_files(
+                request, field, _is_supported, settings.MAX_UPLOAD_SIZE, max_files
+            )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="Upload was interrupted")
+    if not uploads:
+        raise HTTPException(status_code=422, detail=f"No files in the '{field}' form field")
+    return uploads
+
+@router.post("/upload", response_model=UploadResponse, openapi_extra=_upload_form("files", multiple=True))
 async def upload_files(
     request: Request,
     response: Response,
-    files: List[UploadFile] = File(...),
 ):
     """
     Upload files (PDF, CSV, Excel, TXT) for RAG processing
+    
+    Files are streamed to disk as they arrive; files over MAX_UPLOAD_SIZE
+    are rejected with a 413. Accepted files are queued for ingestion in the
+    background. Poll /upload/{job_id} for per-file progress.
     """
     # Get session
-    session = session_manager.get_session(request)
+    session = await run_in_threadpool(services.session_manager.get_session, request)
     
     # Create collection name for this session if it doesn't exist yet
     if not session.collection_name:
         session.collection_name = f"collection_{session.session_id}"
+        await run_in_threadpool(services.session_manager.save_session, session)
     
-    # Process each file
-    processed_files = []
-    all_documents = []
-    
-    for file in files:
-        try:
-            # Check file type
-            filename = file.filename
-            file_extension = os.path.splitext(filename)[1].lower()
-            
-            if file_extension not in ['.pdf', '.csv', '.txt', '.xls', '.xlsx']:
-                logger.warning(f"Unsupported file type: {file_extension}")
-                continue
-            
-            # Create a unique filename to avoid collisions
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
-            
-            # Save file
-            with open(file_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            
-            # Process file for RAG
-            documents = rag_service.process_file(file_path, file_extension)
-            all_documents.extend(documents)
-            
-            # Add file to session
-            file_size = os.path.getsize(file_path)
-            session_manager.add_file_to_session(
-                session, 
-                filename, 
-                file_path, 
-                file_extension, 
-                file_size
-            )
-            
-            # Add to processed files list for response
-            processed_files.append({
-                "name": filename,
-                "type": file_extension,
-                "size": file_size
-            })
-            
-            logger.info(f"Processed file: {filename}")
-            
-        except Exception as e:
-            logger.error(f"Error processing file {file.filename}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-    
-    # Create or update vector store
-    if all_documents:
-        rag_service.create_or_update_vectorstore(all_documents, session.collection_name)
+    uploads = await _receive_files(request, "files")
+    
+    job = services.ingestion_manager.create_job(session)
+    accepted_files = []
+    dedup_stats = {"duplicate_files": 0, "linked_files": 0}
+    seen_hashes = set()
+    
+    for upload in uploads:
+        filename = upload.filename
+        file_extension = get_file_extension(filename)
+        
+        if upload.path is None:
+            logger.warning(f"Unsupported file type: {file_extension}")
+            continue
+        
+        # Skip files this session already has
+        if session.has_file_hash(upload.sha256) or upload.sha256 in seen_hashes:
+            logger.info(f"Skipping duplicate file: {filename}")
+            dedup_stats["duplicate_files"] += 1
+            await run_in_threadpool(remove_upload_file, upload.path)
+            continue
+        seen_hashes.add(upload.sha256)
+        
+        # Reuse the chunks of an identical file indexed for another session
+        link_from = services.rag_service.find_indexed_file(upload.sha256)
+        if link_from == session.collection_name:
+            link_from = None
+        if link_from:
+            dedup_stats["linked_files"] += 1
+        
+        file_info = job.add_file(filename, upload.path, file_extension, upload.size, upload.sha256, link_from)
+        accepted_files.append({
+            "file_id": file_info["file_id"],
+            "name": filename,
+            "type": file_extension,
+            "size": upload.size
+        })
+    
+    # Ingest in the background
+    if accepted_files:
+        task = services.ingestion_manager.start_job(job, session, services.rag_service)
+        # The upload counts against admission limits until its files are ingested
+        hold_admission(request, task)
+    else:
+        job.finish()
     
     # Set session cookie
-    session_manager.set_session_cookie(response, session)
+    services.session_manager.set_session_cookie(response, session)
     
     return UploadResponse(
-        message=f"Successfully processed {len(processed_files)} files",
-        files=processed_files
+        message=f"Accepted {len(accepted_files)} files for processing",
+        files=accepted_files,
+        job_id=job.job_id,
+        dedup=dedup_stats
     )
 
+@router.get("/upload/{job_id}", response_model=JobStatusResponse)
+async def get_upload_status(
+    job_id: str,
+    request: Request,
+    response: Response
+):
+    """
+    Get the ingestion progress of an upload job
+    """
+    # Get session
+    session = await run_in_threadpool(services.session_manager.get_session, request)
+    
+    # Set session cookie
+    services.session_manager.set_session_cookie(response, session)
+    
+    job = services.ingestion_manager.get_job(job_id)
+    if not job or job.session_id != session.session_id:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    
+    return JobStatusResponse(**job.to_dict())
+
 @router.get("/files", response_model=FileListResponse)
 async def get_session_files(
     request: Request,
@@ -109,11 +174,98 @@ async def get_session_files(
     Get all files uploaded in the current session
     """
     # Get session
-    session = session_manager.get_session(request)
+    session = await run_in_threadpool(services.session_manager.get_session, request)
     
     # Set session cookie
-    session_manager.set_session_cookie(response, session)
+    services.session_manager.set_session_cookie(response, session)
     
     # Return files
-    files = session_manager.get_session_files(session)
+    files = services.session_manager.get_session_files(session)
     return FileListResponse(files=files)
+
+
+@router.delete("/files/{file_id}", response_model=FileDeleteResponse)
+async def delete_file(
+    file_id: str,
+    request: Request,
+    response: Response
+):
+    """
+    Delete a file from the current session and remove its chunks from the collection
+    """
+    # Get session
+    session = await run_in_threadpool(services.session_manager.get_session, request)
+    
+    # Set session cookie
+    services.session_manager.set_session_cookie(response, session)
+    
+    file_info = session.get_file(file_id)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    other_files = [f for f in session.get_files() if f["file_id"] != file_id]
+    chunks_removed = await run_in_threadpool(
+        services.rag_service.delete_file, session.collection_name, file_info, other_files
+    )
+    await run_in_threadpool(services.session_manager.remove_file_from_session, session, file_id)
+    await run_in_threadpool(remove_upload_file, file_info["path"])
+    
+    return FileDeleteResponse(
+        message=f"Deleted {file_info['name']}",
+        file_id=file_id,
+        chunks_removed=chunks_removed
+    )
+
+@router.put("/files/{file_id}", response_model=UploadResponse, openapi_extra=_upload_form("file", multiple=False))
+async def replace_file(
+    file_id: str,
+    request: Request,
+    response: Response,
+):
+    """
+    Upload a new version of a file in the current session
+    
+    Only chunks whose content changed are embedded again. Poll
+    /upload/{job_id} for progress.
+    """
+    # Get session
+    session = await run_in_threadpool(services.session_manager.get_session, request)
+    
+    # Set session cookie
+    services.session_manager.set_session_cookie(response, session)
+    
+    old_file = session.get_file(file_id)
+    if not old_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    uploads = await _receive_files(request, "file", max_files=1)
+    if len(uploads) > 1:
+        for extra in uploads:
+            if extra.path is not None:
+                await run_in_threadpool(remove_upload_file, extra.path)
+        raise HTTPException(status_code=400, detail="Upload exactly one file")
+    upload = uploads[0]
+    
+    file_extension = get_file_extension(upload.filename)
+    if upload.path is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_extension}")
+    
+    if upload.sha256 == old_file.get("hash"):
+        await run_in_threadpool(remove_upload_file, upload.path)
+        return UploadResponse(message=f"{old_file['name']} is unchanged", files=[])
+    
+    job = services.ingestion_manager.create_job(session)
+    job.add_file(upload.filename, upload.path, file_extension, upload.size, upload.sha256, replaces=old_file)
+    task = services.ingestion_manager.start_job(job, session, services.rag_service)
+    hold_admission(request, task)
+    
+    return UploadResponse(
+        message=f"Accepted new version of {old_file['name']} for processing",
+        files=[{
+            "file_id": file_id,
+            "name": upload.filename,
+            "type": file_extension,
+            "size": upload.size
+        }],
+        job_id=job.job_id
+    )
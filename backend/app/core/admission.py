@@ -0,0 +1,347 @@
+from typing import Any, Deque, Dict, Optional, Tuple
+from collections import deque
+import asyncio
+import math
+import time
+
+from starlette.responses import JSONResponse
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+CHAT = "chat"
+INGESTION = "ingestion"
+
+# Request kinds, highest priority first
+PRIORITIES = (CHAT, INGESTION)
+
+admission_decisions = metrics.counter(
+    "rag_admission_total", "Requests by kind and admission outcome", ("kind", "outcome")
+)
+admission_wait = metrics.histogram(
+    "rag_admission_wait_seconds", "Time admitted requests spent queued", ("kind",)
+)
+
+
+class AdmissionRejected(Exception):
+    """A request turned away, to be answered with status_code and a Retry-After header"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Permit:
+    """
+    A slot held by an admitted request
+
+    The slot is freed when every holder has released it. An upload keeps
+    its slot past the response, until the ingestion it started finishes.
+    """
+
+    def __init__(self, controller: "AdmissionController", kind: str, session_key: Optional[str]):
+        self.controller = controller
+        self.kind = kind
+        self.session_key = session_key
+        self.start = time.monotonic()
+        self._holders = 1
+
+    def hold_until(self, task: "asyncio.Future") -> None:
+        """Keep the slot until task is done"""
+        self._holders += 1
+        task.add_done_callback(lambda _: self.release())
+
+    def release(self) -> None:
+        self._holders -= 1
+        if self._holders == 0:
+            self.controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, kind: str, session_key: Optional[str], future: "asyncio.Future"):
+        self.kind = kind
+        self.session_key = session_key
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Bounds the chat and ingestion work a worker takes on at once
+
+    Up to max_concurrent requests run at a time, of which at most
+    max_ingestion are uploads, and each session may have session_limit
+    chat requests and as many uploads running or queued. Beyond that,
+    requests wait in a bounded queue where chat goes ahead of ingestion;
+    an upload that has waited longer than a chat request may goes next, so
+    steady chat traffic can't starve ingestion.
+
+    A request is rejected with 429 if its session is over its limit, and
+    with 503 if the queue is full or it would wait longer than its kind's
+    queue timeout; both carry a Retry-After estimate. When the queue is
+    full, a chat request sheds the most recently queued upload rather than
+    being rejected itself.
+
+    Only used from the event loop, so it needs no locks.
+    """
+
+    def __init__(self, max_concurrent: int, max_ingestion: int, session_limit: int, max_queue: int,
+                 queue_timeouts: Dict[str, float]):
+        self.max_concurrent = max_concurrent
+        self.max_ingestion = min(max_ingestion, max_concurrent)
+        self.session_limit = session_limit
+        self.max_queue = max_queue
+        self.queue_timeouts = queue_timeouts
+        self._active: Dict[str, int] = {kind: 0 for kind in PRIORITIES}
+        self._queues: Dict[str, Deque[_Waiter]] = {kind: deque() for kind in PRIORITIES}
+        # Running and queued requests per (kind, session)
+        self._sessions: Dict[Tuple[str, str], int] = {}
+        # Moving average of how long a slot is held, for wait estimates
+        self._hold_seconds: Dict[str, float] = {CHAT: 1.0, INGESTION: 5.0}
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, kind: str, session_key: Optional[str]) -> Permit:
+        """
+        Wait for a slot
+
+        Requests without a session_key start a new session, so only the
+        global limits apply to them.
+
+        Raises:
+            AdmissionRejected: If the request should be turned away
+        """
+        if session_key is not None and self._sessions.get((kind, session_key), 0) >= self.session_limit:
+            admission_decisions.inc(kind=kind, outcome="session_limit")
+            raise AdmissionRejected(
+                429, "Too many requests in progress for this session", self._hold_seconds[kind]
+            )
+
+        if self._can_start(kind) and not self._waiting_ahead(kind):
+            admission_decisions.inc(kind=kind, outcome="admitted")
+            admission_wait.observe(0.0, kind=kind)
+            return self._start(kind, session_key)
+
+        expected_wait = self._expected_wait(kind)
+        if expected_wait > self.queue_timeouts[kind]:
+            admission_decisions.inc(kind=kind, outcome="deadline")
+            raise AdmissionRejected(503, "Server is busy, the wait would be too long", expected_wait)
+        if self.queued >= self.max_queue and not (kind == CHAT and self._shed_ingestion()):
+            admission_decisions.inc(kind=kind, outcome="queue_full")
+            raise AdmissionRejected(503, "Server is busy", expected_wait)
+
+        waiter = _Waiter(kind, session_key, asyncio.get_running_loop().create_future())
+        self._queues[kind].append(waiter)
+        self._count_session(kind, session_key)
+        try:
+            # asyncio.wait leaves the future alone on timeout, so a slot granted meanwhile isn't lost
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeouts[kind])
+        except asyncio.CancelledError:
+            # The client went away while queued
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                waiter.future.result().release()
+            else:
+                self._dequeue(waiter)
+            raise
+
+        if not waiter.future.done():
+            self._dequeue(waiter)
+            admission_decisions.inc(kind=kind, outcome="timeout")
+            raise AdmissionRejected(503, "Server is busy, timed out waiting to start", self._expected_wait(kind))
+        # Shed waiters get an AdmissionRejected
+        permit = waiter.future.result()
+        admission_decisions.inc(kind=kind, outcome="admitted")
+        admission_wait.observe(time.monotonic() - waiter.enqueued, kind=kind)
+        return permit
+
+    def _can_start(self, kind: str) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        return kind != INGESTION or self._active[INGESTION] < self.max_ingestion
+
+    def _waiting_ahead(self, kind: str) -> int:
+        """Queued requests that would be admitted before a new one of this kind"""
+        ahead = 0
+        for queued_kind in PRIORITIES:
+            ahead += len(self._queues[queued_kind])
+            if queued_kind == kind:
+                return ahead
+        return ahead
+
+    def _expected_wait(self, kind: str) -> float:
+        """Rough time until a new request of this kind would start"""
+        slots = self.max_ingestion if kind == INGESTION else self.max_concurrent
+        return (self._waiting_ahead(kind) + 1) * self._hold_seconds[kind] / max(1, slots)
+
+    def _start(self, kind: str, session_key: Optional[str], queued: bool = False) -> Permit:
+        self._active[kind] += 1
+        if not queued:
+            self._count_session(kind, session_key)
+        return Permit(self, kind, session_key)
+
+    def _release(self, permit: Permit) -> None:
+        held = time.monotonic() - permit.start
+        self._hold_seconds[permit.kind] += 0.2 * (held - self._hold_seconds[permit.kind])
+        self._active[permit.kind] -= 1
+        self._forget_session(permit.kind, permit.session_key)
+        self._admit_waiters()
+
+    def _admit_waiters(self) -> None:
+        while (waiter := self._next_waiter()) is not None:
+            self._queues[waiter.kind].popleft()
+            waiter.future.set_result(self._start(waiter.kind, waiter.session_key, queued=True))
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Chat goes first, unless an upload has waited longer than a chat request may"""
+        chat, ingestion = self._queues[CHAT], self._queues[INGESTION]
+        if ingestion and self._can_start(INGESTION):
+            if not chat or time.monotonic() - ingestion[0].enqueued > self.queue_timeouts[CHAT]:
+                return ingestion[0]
+        if chat and self._can_start(CHAT):
+            return chat[0]
+        return None
+
+    def _shed_ingestion(self) -> bool:
+        """Reject the most recently queued upload to make room for a chat request"""
+        queue = self._queues[INGESTION]
+        if not queue:
+            return False
+        waiter = queue.pop()
+        self._forget_session(INGESTION, waiter.session_key)
+        admission_decisions.inc(kind=INGESTION, outcome="shed")
+        waiter.future.set_exception(
+            AdmissionRejected(503, "Server is busy", self._expected_wait(INGESTION))
+        )
+        return True
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        try:
+            self._queues[waiter.kind].remove(waiter)
+        except ValueError:
+            return
+        self._forget_session(waiter.kind, waiter.session_key)
+
+    def _count_session(self, kind: str, session_key: Optional[str]) -> None:
+        if session_key is not None:
+            self._sessions[kind, session_key] = self._sessions.get((kind, session_key), 0) + 1
+
+    def _forget_session(self, kind: str, session_key: Optional[str]) -> None:
+        if session_key is None:
+            return
+        count = self._sessions.get((kind, session_key), 0) - 1
+        if count > 0:
+            self._sessions[kind, session_key] = count
+        else:
+            self._sessions.pop((kind, session_key), None)
+
+    def collect_metrics(self):
+        """Report slots in use and queue depth as metric families for the /metrics endpoint"""
+        yield "rag_admission_active", "gauge", "Requests holding an admission slot", [
+            ({"kind": kind}, count) for kind, count in self._active.items()
+        ]
+        yield "rag_admission_queue_depth", "gauge", "Requests waiting for an admission slot", [
+            ({"kind": kind}, len(queue)) for kind, queue in self._queues.items()
+        ]
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits chat and upload requests through an AdmissionController
+
+    Requests are told apart by method and path prefix, and sessions by
+    their signed cookie, which is only used as a key here. The permit is
+    put in the request state so an endpoint can hold it longer.
+    """
+
+    def __init__(self, app: Any, controller: AdmissionController, routes: Tuple[Tuple[str, str, str], ...],
+                 cookie_name: str):
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+        self.cookie_name = cookie_name
+
+    def _kind(self, scope: Dict[str, Any]) -> Optional[str]:
+        for method, prefix, kind in self.routes:
+            if scope["method"] == method and scope["path"].startswith(prefix):
+                return kind
+        return None
+
+    def _session_key(self, scope: Dict[str, Any]) -> Optional[str]:
+        for name, value in scope.get("headers", ()):
+            if name == b"cookie":
+                for part in value.decode("latin-1").split(";"):
+                    key, _, cookie = part.strip().partition("=")
+                    if key == self.cookie_name and cookie:
+                        return cookie
+        return None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        kind = self._kind(scope) if scope["type"] == "http" else None
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            permit = await self.controller.acquire(kind, self._session_key(scope))
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["admission_permit"] = permit
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            permit.release()
+
+
+def add_admission_control(app: Any) -> Optional[AdmissionController]:
+    """
+    Admit the app's chat and upload requests through a controller configured by the ADMISSION_* settings
+
+    Add it before CORS so CORS headers are set on its 429 and 503 responses.
+
+    Returns:
+        The controller, or None if ADMISSION_ENABLED is off
+    """
+    if not settings.ADMISSION_ENABLED:
+        return None
+    controller = AdmissionController(
+        max_concurrent=settings.ADMISSION_MAX_CONCURRENT,
+        max_ingestion=settings.ADMISSION_MAX_INGESTION,
+        session_limit=settings.ADMISSION_SESSION_LIMIT,
+        max_queue=settings.ADMISSION_MAX_QUEUE,
+        queue_timeouts={
+            CHAT: settings.ADMISSION_CHAT_QUEUE_SECONDS,
+            INGESTION: settings.ADMISSION_INGESTION_QUEUE_SECONDS,
+        }
+    )
+    metrics.add_collector(controller.collect_metrics)
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=controller,
+        routes=(
+            ("POST", f"{settings.API_V1_STR}/chat", CHAT),
+            ("POST", f"{settings.API_V1_STR}/upload", INGESTION),
+            ("PUT", f"{settings.API_V1_STR}/files/", INGESTION),
+        ),
+        cookie_name=settings.SESSION_COOKIE_NAME
+    )
+    return controller
+
+
+def hold_admission(request: Any, task: "asyncio.Future") -> None:
+    """Keep the request's admission slot until task, e.g. its ingestion, is done"""
+    permit = getattr(request.state, "admission_permit", None)
+    if permit is not None:
+        permit.hold_until(task)
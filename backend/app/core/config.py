@@ -11,19 +11,128 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api"
     PROJECT_NAME: str = "RAG Backend API"
     
+    # Startup settings
+    STARTUP_WARM_UP: bool = True  # Create services in the background at startup; /ready reports 503 until done
+    
     # File upload settings
     UPLOAD_DIR: str = os.path.abspath("uploads")
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
     
+    # Ingestion settings
+    INGESTION_PARSE_WORKERS: int = 2
+    INGESTION_EMBED_WORKERS: int = 4
+    INGESTION_JOB_RETENTION_SECONDS: int = 3600
+    INGESTION_STREAMING: bool = True
+    INGESTION_BATCH_SIZE: int = 256
+    
+    # Semantic answer cache settings
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 256
+    
     # Vector DB settings
     VECTOR_DB_PATH: str = os.path.abspath("data/chroma_db")
+    VECTOR_STORE_CACHE_SIZE: int = 64
+    CHAIN_CACHE_SIZE: int = 64
+    VECTOR_STORE_IDLE_SECONDS: int = 1800
+    VECTOR_BACKEND: str = "chroma"  # "chroma" or "flat" (in-process memory-mapped index)
+    FLAT_INDEX_QUANTIZATION: str = "none"  # "none" (float32) or "int8" for new flat indexes
+    
+    # Tabular ingestion settings (CSV and Excel)
+    TABULAR_INGESTION_ENABLED: bool = True  # Embed schema-annotated blocks of rows instead of one document per row
+    TABULAR_BLOCK_CHARS: int = 4000
+    TABULAR_BLOCK_MAX_ROWS: int = 200
+    TABULAR_READ_ROWS: int = 50000  # CSV rows parsed at a time
+    TABULAR_PARQUET_ENABLED: bool = True  # Keep tables as Parquet and answer aggregate questions from them (needs pyarrow)
+    TABLE_QUERY_MAX_GROUPS: int = 20
+    
+    # Text splitting settings
+    TEXT_SPLITTER: str = "characters"  # "characters" (1000-character chunks) or "tokens"
+    SPLITTER_CHUNK_TOKENS: int = 256
+    SPLITTER_OVERLAP_TOKENS: int = 16
+    SPLITTER_PARALLEL: bool = True  # Split streamed files' text in the parse worker processes
+    TOKENIZER_ENCODING: str = "cl100k_base"  # tiktoken encoding; token counts are approximated if it can't be loaded
+    
+    # Deduplication settings
+    DEDUP_ENABLED: bool = True
+    DEDUP_SIMHASH_MAX_DISTANCE: int = 3
+    
+    # Retrieval settings
+    RETRIEVAL_MODE: str = "vector"  # "vector" or "hybrid" (vector + BM25)
+    RETRIEVAL_K: int = 5
+    HYBRID_FETCH_K: int = 20
+    
+    # Reranking settings
+    RERANK_MODE: str = "none"  # "none", "mmr" or "cross_encoder" (needs sentence-transformers)
+    RERANK_FETCH_K: int = 20  # Candidates retrieved for reranking
+    RERANK_K: int = 5  # Chunks sent to the LLM after reranking
+    RERANK_BUDGET_MS: float = 50  # Includes reading candidate vectors and embedding the question; past it, retrieval order is kept
+    RERANK_MMR_LAMBDA: float = 0.9  # 1 ranks by relevance only, 0 by diversity only
+    RERANK_DUPLICATE_SIMILARITY: float = 0.95  # Drop candidates this similar to a chosen chunk
+    RERANK_MODEL_NAME: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    
+    # Context packing settings
+    CONTEXT_TOKEN_BUDGET: int = 0  # 0 sends the top RERANK_K/RETRIEVAL_K chunks, otherwise fill this many tokens from up to RERANK_FETCH_K ranked chunks
+    CONTEXT_MIN_CHUNK_TOKENS: int = 50  # Cut the first chunk that doesn't fit if at least this much budget is left
+    
+    # Conversation settings
+    CONDENSE_MODE: str = "always"  # "always", "heuristic" (skip rewriting standalone questions) or "speculative"
+    CONDENSE_MODEL_NAME: str = ""  # Smaller model for rewriting follow-ups, empty uses MODEL_NAME
+    SPECULATIVE_REUSE_SIMILARITY: float = 0.8  # Reuse speculative results if the rewrite is this similar
+    SPECULATIVE_RETRIEVAL_WORKERS: int = 8
+    
+    # Chat history settings
+    HISTORY_WINDOW_TURNS: int = 4  # Most recent question/answer turns sent verbatim
+    HISTORY_TOKEN_BUDGET: int = 1500  # Approximate token cap on the verbatim turns
+    HISTORY_SUMMARY_ENABLED: bool = False  # Fold turns that leave the window into a running summary, one extra LLM call per turn
+    HISTORY_SUMMARY_MAX_TOKENS: int = 400
     
     # OpenAI settings (fill these in your .env file)
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    OPENAI_BASE_URL: str = ""  # OpenAI-compatible endpoint, e.g. a local mock server; empty uses OpenAI
+    
+    # OpenAI connection pool settings, shared by the chat models and embeddings
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_SECONDS: float = 30.0  # Idle time before a kept-alive connection is closed
+    OPENAI_TIMEOUT_SECONDS: float = 60.0
+    
+    # Admission control for chat and upload requests, per worker; excess gets 429 or 503 with Retry-After
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_CONCURRENT: int = 64  # Chat and upload requests handled at once
+    ADMISSION_MAX_INGESTION: int = 16  # Of those, uploads still being received or ingested
+    ADMISSION_SESSION_LIMIT: int = 4  # Chat requests, and uploads, one session may have running or queued
+    ADMISSION_MAX_QUEUE: int = 256
+    ADMISSION_CHAT_QUEUE_SECONDS: float = 10.0  # Longest a chat request may wait to start
+    ADMISSION_INGESTION_QUEUE_SECONDS: float = 30.0
+    
+    # Threads running blocking vector store work for async chat requests
+    VECTOR_EXECUTOR_WORKERS: int = 8
+    
+    # Identical chat questions and embedding requests made concurrently share one call
+    SINGLE_FLIGHT_ENABLED: bool = True
     
     # Session settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-for-sessions")
     SESSION_COOKIE_NAME: str = "rag_session"
+    SESSION_BACKEND: str = "sqlite"  # "sqlite" or "memory"
+    SESSION_DB_PATH: str = os.path.abspath("data/sessions.sqlite3")
+    SESSION_TTL_SECONDS: int = 86400 * 7  # 7 days
+    SESSION_WRITE_BEHIND_BATCH_SIZE: int = 50
+    SESSION_WRITE_BEHIND_INTERVAL_SECONDS: float = 0.5
+    
+    # Janitor settings (expires idle sessions and reclaims their disk space)
+    JANITOR_ENABLED: bool = True
+    JANITOR_INTERVAL_SECONDS: int = 3600
+    JANITOR_GRACE_SECONDS: int = 3600  # Longer than any ingestion job; another worker may still be using younger items
+    JANITOR_COMPACT_ENABLED: bool = False  # VACUUM the Chroma database once enough space is free; blocks writes from every worker meanwhile
+    JANITOR_COMPACT_MIN_FREE_BYTES: int = 64 * 1024 * 1024
+    
+    # Metrics settings
+    METRICS_ENABLED: bool = True
+    SLOW_REQUEST_PROFILE_SECONDS: float = 0.0  # Sample stacks of requests slower than this, 0 disables
+    SLOW_REQUEST_PROFILE_INTERVAL_SECONDS: float = 0.01
     
     # CORS settings
     CORS_ORIGINS: list = ["http://localhost:5173"]
@@ -35,12 +144,22 @@ class Settings(BaseSettings):
     MODEL_NAME: str = "gpt-3.5-turbo"
     EMBEDDING_MODEL_NAME: str = "text-embedding-ada-002"
     
+    # Embedding request settings
+    EMBEDDING_BATCH_SIZE: int = 128  # Texts per embedding request
+    EMBEDDING_MAX_CONCURRENCY: int = 4  # Embedding requests in flight across all uploads
+    EMBEDDING_REQUESTS_PER_MINUTE: int = 3000  # 0 disables request rate limiting
+    EMBEDDING_TOKENS_PER_MINUTE: int = 1_000_000  # 0 disables token rate limiting
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_RETRY_BASE_SECONDS: float = 0.5
+    EMBEDDING_RETRY_MAX_SECONDS: float = 30.0
+    
+    # Embedding cache settings
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = os.path.abspath("data/embedding_cache.sqlite3")
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200_000
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
 
 settings = Settings()
-
-# Create upload and vector DB directories if they don't exist
-os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-os.makedirs(settings.VECTOR_DB_PATH, exist_ok=True)
@@ -0,0 +1,359 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+from app.utils.timing import add_stage_listener
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds, from a cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Innermost frames of threads that are idle, waiting for work or I/O readiness
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("selectors.py", "select"),
+    ("_asyncio.py", "run"),
+}
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._values: Dict[LabelValues, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# A collector returns (metric name, kind, description, [(labels, value), ...]) tuples at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics in the Prometheus text exposition format
+
+    Counters and histograms are updated inline with a lock per metric, so
+    recording is a dictionary update. Values that services already track
+    (cache hit counts, queue sizes) are read by collectors at scrape time
+    instead of being duplicated on the hot path.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name: str, description: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        """Register a function that reports gauge or counter values when metrics are scraped"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.error(f"Error in metrics collector: {e}")
+                continue
+            for name, kind, description, samples in families:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_names = tuple(labels)
+                    label_values = tuple(str(labels[n]) for n in label_names)
+                    lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """
+    Sampling profiler that explains slow requests
+
+    While any tracked request has been running longer than the threshold, a
+    background thread samples the stacks of all threads every interval. When
+    a slow request finishes, the most frequent stacks seen during its lifetime
+    are logged. Nothing is sampled while all requests are fast.
+    """
+
+    def __init__(self, threshold_seconds: float, interval_seconds: float = 0.01,
+                 max_depth: int = 12, top: int = 5):
+        self.threshold = threshold_seconds
+        self.interval = interval_seconds
+        self.max_depth = max_depth
+        self.top = top
+        self._active: Dict[int, Tuple[float, TallyCounter]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def track(self, name: str):
+        """Track a request; log its hottest stacks if it turns out to be slow"""
+        start = time.perf_counter()
+        samples: TallyCounter = TallyCounter()
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._active[request_id] = (start, samples)
+            self._ensure_thread()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(request_id, None)
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold and samples:
+                self._report(name, elapsed, samples)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = [samples for start, samples in self._active.values() if now - start >= self.threshold]
+            if not slow:
+                continue
+            stacks = [
+                self._stack(frame) for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id and not self._is_idle(frame)
+            ]
+            for samples in slow:
+                samples.update(stacks)
+
+    def _is_idle(self, frame: Any) -> bool:
+        return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES
+
+    def _stack(self, frame: Any) -> Tuple[str, ...]:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{frame.f_lineno} {code.co_name}")
+            frame = frame.f_back
+        return tuple(stack)
+
+    def _report(self, name: str, elapsed: float, samples: TallyCounter) -> None:
+        total = sum(samples.values())
+        lines = [f"Slow request {name} took {elapsed:.2f}s, {total} stack samples:"]
+        for stack, count in samples.most_common(self.top):
+            lines.append(f"  {count / total:.0%} of samples:")
+            lines.extend(f"    {entry}" for entry in stack)
+        logger.warning("\n".join(lines))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records request latency by route template
+
+    Latency covers the whole response, including streamed bodies. Requests
+    are optionally tracked by a SlowRequestProfiler.
+    """
+
+    def __init__(self, app: Any, profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.track(f"{scope['method']} {scope['path']}"):
+                    await self.app(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template rather than raw path to keep the number of series bounded
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"])
+            )
+
+
+# Global metrics registry and the metrics recorded across the app
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    "rag_http_request_duration_seconds", "Time until the response starts, by route", ("method", "route", "status")
+)
+stage_duration = metrics.histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+chunks_indexed = metrics.counter("rag_chunks_indexed_total", "Chunks written to the vector store")
+duplicate_chunks = metrics.counter("rag_duplicate_chunks_total", "Chunks skipped as duplicates at ingestion")
+llm_tokens = metrics.counter("rag_llm_tokens_total", "LLM tokens used", ("kind",))
+chat_requests = metrics.counter("rag_chat_requests_total", "Chat requests answered", ("source",))
+condense_outcomes = metrics.counter(
+    "rag_condense_total", "Follow-up questions by how the rewrite step was handled", ("outcome",)
+)
+rerank_outcomes = metrics.counter(
+    "rag_rerank_total", "Reranking runs by whether they finished within the time budget", ("outcome",)
+)
+sessions_created = metrics.counter("rag_sessions_created_total", "New sessions created")
+janitor_removed = metrics.counter(
+    "rag_janitor_removed_total", "Expired sessions, collections and uploads removed by the janitor", ("kind",)
+)
+janitor_reclaimed_bytes = metrics.counter(
+    "rag_janitor_reclaimed_bytes_total", "Disk space reclaimed by the janitor", ("kind",)
+)
+table_queries = metrics.counter(
+    "rag_table_queries_total", "Aggregate questions answered from stored tables instead of retrieval", ("outcome",)
+)
+context_tokens = metrics.histogram(
+    "rag_context_tokens", "Tokens of retrieved text packed into each prompt",
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+)
+single_flight_calls = metrics.counter(
+    "rag_single_flight_total",
+    "Calls by whether they did the work or shared an identical call already in flight", ("kind", "outcome")
+)
+
+add_stage_listener(lambda name, seconds: stage_duration.observe(seconds, stage=name))
+
+
+def instrument_app(app: Any, threshold_seconds: float = 0.0, interval_seconds: float = 0.01) -> None:
+    """Add request metrics to a FastAPI app, profiling requests slower than threshold_seconds if set"""
+    profiler = SlowRequestProfiler(threshold_seconds, interval_seconds) if threshold_seconds > 0 else None
+    app.add_middleware(MetricsMiddleware, profiler=profiler)
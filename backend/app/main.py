@@ -1,9 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import logging
 
 from app.api.api import api_router
 from app.core.config import settings
+from app.core.metrics import metrics, instrument_app
+from app.core.admission import add_admission_control
+from app.utils.setup_utils import initialize_directories
+from app.services.container import services
 
 # Configure logging
 logging.basicConfig(
@@ -16,6 +21,9 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
 )
 
+# Bound concurrent chat and upload work; added before CORS so its 429 and 503 responses get CORS headers
+add_admission_control(app)
+
 # Set up CORS
 app.add_middleware(
     CORSMiddleware,
@@ -25,6 +33,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record request latency for /metrics
+if settings.METRICS_ENABLED:
+    instrument_app(
+        app,
+        threshold_seconds=settings.SLOW_REQUEST_PROFILE_SECONDS,
+        interval_seconds=settings.SLOW_REQUEST_PROFILE_INTERVAL_SECONDS
+    )
+
 # Add API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -32,12 +48,26 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 def read_root():
     return {"message": "Welcome to the RAG API", "docs": "/docs"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 503 until the services have been created at startup"""
+    readiness = services.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Expose metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     logging.info("Starting up the application")
+    initialize_directories()
+    services.start(warm_up=settings.STARTUP_WARM_UP, janitor=settings.JANITOR_ENABLED)
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logging.info("Shutting down the application")
+    services.shutdown()
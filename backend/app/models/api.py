@@ -19,3 +19,20 @@ class FileListResponse(BaseModel):
 class UploadResponse(BaseModel):
     message: str
     files: List[Dict[str, Any]]
+    job_id: Optional[str] = None
+    dedup: Dict[str, int] = Field(default_factory=dict)
+
+
+class FileDeleteResponse(BaseModel):
+    message: str
+    file_id: str
+    chunks_removed: int
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    created_at: str
+    updated_at: str
+    files: List[Dict[str, Any]]
+    error: Optional[str] = None
@@ -0,0 +1,84 @@
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+import uuid
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class IngestionJob:
+    def __init__(self, session_id: str, collection_name: str, job_id: str = None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.session_id = session_id
+        self.collection_name = collection_name
+        self.status = JobStatus.QUEUED
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now()
+        self.files: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+    def add_file(self, filename: str, file_path: str, file_type: str, file_size: int,
+                 file_hash: Optional[str] = None, link_from: Optional[str] = None,
+                 replaces: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Add a file to be ingested by this job
+        
+        `replaces` is the session's record of a file this upload is a new version of.
+        """
+        file_info = {
+            "file_id": replaces["file_id"] if replaces else str(uuid.uuid4()),
+            "name": filename,
+            "path": file_path,
+            "type": file_type,
+            "size": file_size,
+            "hash": file_hash,
+            "link_from": link_from,
+            "replaces": replaces,
+            "status": JobStatus.QUEUED,
+            "chunks": 0,
+            "duplicate_chunks": 0,
+            "error": None
+        }
+        self.files.append(file_info)
+        return file_info
+
+    def update_file(self, file_info: Dict[str, Any], status: str, **fields: Any) -> None:
+        """Update the progress of a single file"""
+        file_info["status"] = status
+        file_info.update(fields)
+        self.updated_at = datetime.now()
+
+    def finish(self) -> None:
+        """Mark the job as finished based on the outcome of its files"""
+        if any(f["status"] == JobStatus.FAILED for f in self.files):
+            self.status = JobStatus.FAILED
+            self.error = "; ".join(
+                f"{f['name']}: {f['error']}" for f in self.files if f["status"] == JobStatus.FAILED
+            )
+        else:
+            self.status = JobStatus.COMPLETED
+        self.updated_at = datetime.now()
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert job to dictionary for serialization"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+            "files": [
+                {key: value for key, value in f.items() if key not in ("path", "link_from", "replaces")}
+                for f in self.files
+            ],
+            "error": self.error
+        }
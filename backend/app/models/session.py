@@ -1,34 +1,80 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from datetime import datetime
 import uuid
 
 
+# Loads a session's chat history; given a limit, only the most recent messages
+HistoryLoader = Callable[..., List[Dict[str, Any]]]
+
+
 class UserSession:
-    def __init__(self, session_id: str = None):
+    def __init__(self, session_id: str = None, history_loader: Optional[HistoryLoader] = None):
         self.session_id = session_id or str(uuid.uuid4())
         self.created_at = datetime.now()
         self.last_active = datetime.now()
         self.uploaded_files: List[Dict[str, Any]] = []
-        self.chat_history: List[Dict[str, Any]] = []
         self.collection_name: Optional[str] = None
+        # Chat history is loaded on first access when a loader is given
+        self._history_loader = history_loader
+        self._chat_history: Optional[List[Dict[str, Any]]] = None if history_loader else []
+        # Running summary of the turns that have left the history window
+        self.history_summary = ""
+        self.summarized_until: Optional[str] = None
+    
+    @property
+    def chat_history(self) -> List[Dict[str, Any]]:
+        if self._chat_history is None:
+            self._chat_history = self._history_loader()
+        return self._chat_history
     
-    def add_file(self, filename: str, file_path: str, file_type: str, file_size: int) -> None:
-        """Add a file to the session's uploaded files list"""
+    def add_file(self, filename: str, file_path: str, file_type: str, file_size: int,
+                 file_hash: Optional[str] = None, file_id: Optional[str] = None,
+                 chunk_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Add a file to the session's uploaded files list, replacing the file with the same ID if any"""
         file_info = {
+            "file_id": file_id or str(uuid.uuid4()),
             "name": filename,
             "path": file_path,
             "type": file_type,
             "size": file_size,
+            "hash": file_hash,
+            "chunk_ids": chunk_ids,
             "uploaded_at": datetime.now().isoformat()
         }
-        self.uploaded_files.append(file_info)
+        for i, existing in enumerate(self.uploaded_files):
+            if existing["file_id"] == file_info["file_id"]:
+                self.uploaded_files[i] = file_info
+                break
+        else:
+            self.uploaded_files.append(file_info)
+        self.last_active = datetime.now()
+        return file_info
+    
+    def touch(self) -> None:
+        """Mark the session as in use, pushing back its expiry"""
         self.last_active = datetime.now()
     
     def get_files(self) -> List[Dict[str, Any]]:
         """Get all uploaded files in the session"""
         return self.uploaded_files
     
-    def add_chat_message(self, role: str, content: str, metadata: Dict[str, Any] = None) -> None:
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Get an uploaded file by ID"""
+        return next((f for f in self.uploaded_files if f["file_id"] == file_id), None)
+    
+    def remove_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """Remove an uploaded file from the session, returning its record"""
+        file_info = self.get_file(file_id)
+        if file_info is not None:
+            self.uploaded_files.remove(file_info)
+            self.last_active = datetime.now()
+        return file_info
+    
+    def has_file_hash(self, file_hash: str) -> bool:
+        """Check whether a file with identical content is already in the session"""
+        return any(f.get("hash") == file_hash for f in self.uploaded_files)
+    
+    def add_chat_message(self, role: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
         """Add a chat message to the session history"""
         message = {
             "role": role,
@@ -36,20 +82,58 @@ class UserSession:
             "timestamp": datetime.now().isoformat(),
             "metadata": metadata or {}
         }
-        self.chat_history.append(message)
+        # Don't force a lazy load just to append; the store has the full history
+        if self._chat_history is not None:
+            self._chat_history.append(message)
         self.last_active = datetime.now()
+        return message
     
     def get_chat_history(self) -> List[Dict[str, Any]]:
         """Get the chat history for the session"""
         return self.chat_history
     
+    def get_recent_history(self, limit: int) -> List[Dict[str, Any]]:
+        """Get the last `limit` messages without loading the whole history"""
+        if self._chat_history is not None:
+            return self._chat_history[-limit:]
+        return self._history_loader(limit)
+    
+    def set_history_summary(self, summary: str, summarized_until: str) -> None:
+        """Record the running summary and the timestamp of the last message folded into it"""
+        self.history_summary = summary
+        self.summarized_until = summarized_until
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert session to dictionary for serialization"""
+        data = self.metadata_dict()
+        data["chat_history"] = self.chat_history
+        return data
+    
+    def metadata_dict(self) -> Dict[str, Any]:
+        """Convert everything except the chat history to a dictionary"""
         return {
             "session_id": self.session_id,
             "created_at": self.created_at.isoformat(),
             "last_active": self.last_active.isoformat(),
             "uploaded_files": self.uploaded_files,
-            "chat_history": self.chat_history,
-            "collection_name": self.collection_name
+            "collection_name": self.collection_name,
+            "history_summary": self.history_summary,
+            "summarized_until": self.summarized_until
         }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], history_loader: Optional[HistoryLoader] = None) -> "UserSession":
+        """Restore a session from its serialized metadata"""
+        session = cls(data["session_id"], history_loader=history_loader)
+        session.created_at = datetime.fromisoformat(data["created_at"])
+        session.last_active = datetime.fromisoformat(data["last_active"])
+        session.uploaded_files = data.get("uploaded_files", [])
+        for file_info in session.uploaded_files:
+            # Files uploaded before IDs were assigned get a stable ID derived from their path
+            file_info.setdefault("file_id", str(uuid.uuid5(uuid.NAMESPACE_URL, file_info["path"])))
+        session.collection_name = data.get("collection_name")
+        session.history_summary = data.get("history_summary", "")
+        session.summarized_until = data.get("summarized_until")
+        if history_loader is None:
+            session._chat_history = data.get("chat_history", [])
+        return session
@@ -0,0 +1,124 @@
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class _CollectionAnswers:
+    """Cached answers for one collection, with question vectors stacked for fast search"""
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+    def remove(self, keep: np.ndarray) -> None:
+        self.vectors = self.vectors[keep]
+        self.entries = [entry for entry, kept in zip(self.entries, keep) if kept]
+
+
+class SemanticAnswerCache:
+    """
+    Per-collection cache of answers, matched by question embedding similarity
+
+    A question whose embedding has cosine similarity above the threshold with a
+    previously answered question in the same collection reuses that answer.
+    """
+
+    def __init__(self, similarity_threshold: float, ttl_seconds: float, max_entries: int):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._collections: Dict[str, _CollectionAnswers] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(self, collection_name: str,
+               question_vector: List[float]) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """Return the (answer, sources) of the most similar cached question, if close enough"""
+        query = self._normalize(question_vector)
+
+        with self._lock:
+            answers = self._collections.get(collection_name)
+            if answers is not None:
+                self._expire_locked(answers)
+
+            if answers is None or not answers.entries or answers.vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = answers.vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = answers.entries[best]
+            logger.info(
+                f"Answer cache hit for collection {collection_name} "
+                f"(similarity {similarities[best]:.3f})"
+            )
+            return entry["answer"], entry["sources"]
+
+    def store(self, collection_name: str, question: str, question_vector: List[float],
+              answer: str, sources: List[Dict[str, Any]]) -> None:
+        """Cache an answer for a question"""
+        vector = self._normalize(question_vector)
+
+        with self._lock:
+            answers = self._collections.get(collection_name)
+            if answers is None or answers.vectors.shape[1] != vector.shape[0]:
+                answers = _CollectionAnswers(vector.shape[0])
+                self._collections[collection_name] = answers
+
+            answers.vectors = np.vstack([answers.vectors, vector[np.newaxis, :]])
+            answers.entries.append({
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "created_at": time.time()
+            })
+
+            # Drop the oldest entries once over capacity
+            overflow = len(answers.entries) - self.max_entries
+            if overflow > 0:
+                keep = np.ones(len(answers.entries), dtype=bool)
+                keep[:overflow] = False
+                answers.remove(keep)
+
+    def invalidate(self, collection_name: str) -> None:
+        """Forget all answers for a collection, e.g. after new files are added"""
+        with self._lock:
+            if self._collections.pop(collection_name, None) is not None:
+                self.invalidations += 1
+
+    def _expire_locked(self, answers: _CollectionAnswers) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        created = np.fromiter((entry["created_at"] for entry in answers.entries), dtype=np.float64)
+        keep = created >= cutoff
+        if not keep.all():
+            answers.remove(keep)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit-rate metrics for the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "collections": len(self._collections),
+                "entries": sum(len(a.entries) for a in self._collections.values()),
+            }
@@ -0,0 +1,307 @@
+from typing import List, Dict, Any, Optional, Set, Tuple, Iterable
+from array import array
+from collections import Counter
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+import numpy as np
+from langchain.schema import Document
+
+from app.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Identifiers such as SKU codes ("AB-1234") are kept whole as well as split into parts
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+_MAX_TF = 65535
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into BM25 terms"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_PART_RE.findall(token))
+    return tokens
+
+
+class BM25Index:
+    """
+    Incrementally built BM25 inverted index
+
+    Postings are kept per term as compact typed arrays (uint32 document
+    numbers and uint16 term frequencies) and scored with NumPy, so search
+    stays fast on collections with hundreds of thousands of chunks.
+
+    Worker processes can share an index directory. Changes not yet saved
+    are kept in a journal; save() holds a lock file and, if another process
+    saved in the meantime, reloads that version and replays the journal on
+    it before writing. Search picks up other processes' saves as long as
+    nothing is waiting to be saved.
+    """
+
+    SNAPSHOT_FILE = "postings.npz"
+    DOCS_FILE = "docs.jsonl"
+    LOCK_FILE = "write.lock"
+
+    def __init__(self, directory: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.postings: List[array] = []
+        self.frequencies: List[array] = []
+        self.doc_lengths = array("I")
+        self.chunk_ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self._docs_on_disk = 0
+        # Metadata of documents already on disk changed, so the documents file is rewritten on save
+        self._docs_changed = False
+        self._length_norm: Optional[np.ndarray] = None
+        # Changes since the last save, and the identity of the snapshot they apply to
+        self._journal: List[Tuple[str, tuple]] = []
+        self._snapshot_id: Optional[Tuple[int, int]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Index new chunks"""
+        with self._lock:
+            self._journal_locked("add", list(chunk_ids), list(texts), list(metadatas))
+            self._add_locked(chunk_ids, texts, metadatas)
+
+    def _add_locked(self, chunk_ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+            doc_number = len(self.chunk_ids)
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+
+            for token, count in counts.items():
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = len(self.postings)
+                    self.vocab[token] = term_id
+                    self.postings.append(array("I"))
+                    self.frequencies.append(array("H"))
+                self.postings[term_id].append(doc_number)
+                self.frequencies[term_id].append(min(count, _MAX_TF))
+
+            self.doc_lengths.append(len(tokens))
+            self.chunk_ids.append(chunk_id)
+            self.texts.append(text)
+            self.metadatas.append(metadata)
+
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(chunk_ids), dtype=bool)])
+        self._length_norm = None
+
+    def delete(self, chunk_ids: Iterable[str]) -> int:
+        """
+        Exclude chunks from search results
+
+        Postings are append-only, so deleted chunks are masked rather than
+        removed; their terms still count towards document statistics.
+        """
+        drop = set(chunk_ids)
+        with self._lock:
+            self._journal_locked("delete", drop)
+            return self._delete_locked(drop)
+
+    def _delete_locked(self, drop: Set[str]) -> int:
+        doc_numbers = [i for i, chunk_id in enumerate(self.chunk_ids) if chunk_id in drop]
+        self.deleted[doc_numbers] = True
+        return len(doc_numbers)
+
+    def update_metadatas(self, chunk_ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the metadata of indexed chunks, as the vector store's is replaced"""
+        with self._lock:
+            self._journal_locked("update", list(chunk_ids), list(metadatas))
+            self._update_locked(chunk_ids, metadatas)
+
+    def _update_locked(self, chunk_ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        new_metadata = dict(zip(chunk_ids, metadatas))
+        for i, chunk_id in enumerate(self.chunk_ids):
+            if chunk_id in new_metadata and not self.deleted[i]:
+                self.metadatas[i] = new_metadata[chunk_id]
+                self._docs_changed = self._docs_changed or i < self._docs_on_disk
+
+    def _journal_locked(self, op: str, *args: Any) -> None:
+        if self.directory:
+            self._journal.append((op, args))
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Return the (document number, score) of the top k chunks for the query"""
+        self._catch_up()
+        with self._lock:
+            n_docs = len(self.chunk_ids)
+            terms = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+            if not n_docs or not terms:
+                return []
+
+            if self._length_norm is None:
+                lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+                avg_length = float(lengths.mean()) or 1.0
+                self._length_norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term_id in terms:
+                docs = np.frombuffer(self.postings[term_id], dtype=np.uint32)
+                tf = np.frombuffer(self.frequencies[term_id], dtype=np.uint16).astype(np.float32)
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                # A term occurs at most once per document in its postings, so plain fancy indexing is safe
+                scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+
+            scores[self.deleted] = 0
+            k = min(k, n_docs)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def get_documents(self, results: Iterable[Tuple[int, float]]) -> List[Document]:
+        """Convert search results into documents"""
+        return [
+            Document(page_content=self.texts[i], metadata=self.metadatas[i])
+            for i, _ in results
+        ]
+
+    def save(self) -> None:
+        """Persist the index to its directory, merged with what other processes saved"""
+        if not self.directory:
+            return
+
+        with self._lock, file_lock(os.path.join(self.directory, self.LOCK_FILE)):
+            if self._disk_snapshot_id() != self._snapshot_id:
+                self._reload_locked()
+
+            # Documents are append-only, so only write the ones not yet on disk.
+            # They are written before the snapshot so the snapshot never refers
+            # to documents that are missing from disk.
+            docs_path = os.path.join(self.directory, self.DOCS_FILE)
+            if self._docs_changed:
+                self._write_docs_locked(docs_path + ".tmp", len(self.chunk_ids))
+                os.replace(docs_path + ".tmp", docs_path)
+            else:
+                with open(docs_path, "a", encoding="utf-8") as f:
+                    for i in range(self._docs_on_disk, len(self.chunk_ids)):
+                        f.write(self._doc_line(i))
+            self._docs_on_disk = len(self.chunk_ids)
+            self._docs_changed = False
+
+            # Postings are written as one CSR-style block of concatenated arrays
+            offsets = np.zeros(len(self.postings) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(p) for p in self.postings])
+            doc_numbers = np.frombuffer(b"".join(p.tobytes() for p in self.postings), dtype=np.uint32)
+            frequencies = np.frombuffer(b"".join(f.tobytes() for f in self.frequencies), dtype=np.uint16)
+
+            snapshot_path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+            tmp_path = snapshot_path + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                terms=np.array(list(self.vocab), dtype=str),
+                offsets=offsets,
+                doc_numbers=doc_numbers,
+                frequencies=frequencies,
+                doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.uint32),
+                deleted=self.deleted,
+            )
+            os.replace(tmp_path, snapshot_path)
+            self._snapshot_id = self._disk_snapshot_id()
+            self._journal = []
+
+    def _doc_line(self, i: int) -> str:
+        return json.dumps({"id": self.chunk_ids[i], "text": self.texts[i], "metadata": self.metadatas[i]}) + "\n"
+
+    def _write_docs_locked(self, path: str, n_docs: int) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(n_docs):
+                f.write(self._doc_line(i))
+
+    def _disk_snapshot_id(self) -> Optional[Tuple[int, int]]:
+        """Identity of the snapshot on disk; every save replaces the file, so it changes with each save"""
+        try:
+            stat = os.stat(os.path.join(self.directory, self.SNAPSHOT_FILE))
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _catch_up(self) -> None:
+        """Reload the index if another process saved it and there is nothing here waiting to be saved"""
+        if not self.directory or self._journal:
+            return
+        # No snapshot at all means the collection was dropped
+        if self._disk_snapshot_id() in (None, self._snapshot_id):
+            return
+        with self._lock, file_lock(os.path.join(self.directory, self.LOCK_FILE)):
+            if not self._journal:
+                self._reload_locked()
+
+    def _reload_locked(self) -> None:
+        """Replace the in-memory index with the saved one, replaying changes not saved yet"""
+        saved = self._read(self.directory)
+        for op, args in self._journal:
+            getattr(saved, f"_{op}_locked")(*args)
+        self.vocab, self.postings, self.frequencies = saved.vocab, saved.postings, saved.frequencies
+        self.doc_lengths, self.deleted = saved.doc_lengths, saved.deleted
+        self.chunk_ids, self.texts, self.metadatas = saved.chunk_ids, saved.texts, saved.metadatas
+        self._docs_on_disk, self._docs_changed = saved._docs_on_disk, saved._docs_changed
+        self._snapshot_id = saved._snapshot_id
+        self._length_norm = None
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """Load an index from disk, or return an empty one if none exists"""
+        if not os.path.exists(os.path.join(directory, cls.DOCS_FILE)):
+            return cls(directory)
+        with file_lock(os.path.join(directory, cls.LOCK_FILE)):
+            index = cls._read(directory)
+        logger.info(f"Loaded BM25 index with {len(index)} chunks from {directory}")
+        return index
+
+    @classmethod
+    def _read(cls, directory: str) -> "BM25Index":
+        """Read the saved index; the caller holds the lock file"""
+        index = cls(directory)
+        snapshot_path = os.path.join(directory, cls.SNAPSHOT_FILE)
+        docs_path = os.path.join(directory, cls.DOCS_FILE)
+        if not os.path.exists(snapshot_path):
+            # Documents without a snapshot are from an interrupted first save
+            if os.path.exists(docs_path):
+                os.remove(docs_path)
+            return index
+
+        with np.load(snapshot_path) as snapshot:
+            offsets = snapshot["offsets"]
+            doc_numbers = snapshot["doc_numbers"]
+            frequencies = snapshot["frequencies"]
+            for term_id, term in enumerate(snapshot["terms"]):
+                start, end = offsets[term_id], offsets[term_id + 1]
+                index.vocab[str(term)] = term_id
+                index.postings.append(array("I", doc_numbers[start:end].tobytes()))
+                index.frequencies.append(array("H", frequencies[start:end].tobytes()))
+            index.doc_lengths = array("I", snapshot["doc_lengths"].tobytes())
+            index.deleted = snapshot["deleted"].copy()
+        index._snapshot_id = index._disk_snapshot_id()
+
+        with open(docs_path, encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                index.chunk_ids.append(doc["id"])
+                index.texts.append(doc["text"])
+                index.metadatas.append(doc["metadata"])
+
+        # A crash between the two writes can leave documents the snapshot
+        # doesn't know about; drop them so later appends stay aligned
+        n_docs = len(index.doc_lengths)
+        if len(index.chunk_ids) > n_docs:
+            del index.chunk_ids[n_docs:], index.texts[n_docs:], index.metadatas[n_docs:]
+            index._write_docs_locked(docs_path, n_docs)
+        index._docs_on_disk = n_docs
+        return index
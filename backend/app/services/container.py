@@ -0,0 +1,168 @@
+from typing import Any, Callable, Dict, Optional
+import logging
+import threading
+import time
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """
+    Creates the app's services on first use
+
+    Importing the app only defines its routes. Each service, with the
+    langchain, Chroma and pandas modules behind it, is created the first
+    time something asks for it. warm_up() creates them all ahead of the
+    first request; until it has finished the app reports itself not ready.
+    """
+
+    def __init__(self):
+        self._services: Dict[str, Any] = {}
+        # One lock per service, so a slow one doesn't hold up requests for the others
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._startup_thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.warm_up_seconds: Optional[float] = None
+        self.warm_up_error: Optional[str] = None
+
+    def _get(self, name: str, create: Callable[[], Any]) -> Any:
+        service = self._services.get(name)
+        if service is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+            with lock:
+                service = self._services.get(name)
+                if service is None:
+                    start = time.perf_counter()
+                    service = create()
+                    self._services[name] = service
+                    logger.info(f"Created {name} in {time.perf_counter() - start:.2f}s")
+        return service
+
+    @property
+    def rag_service(self) -> "RagService":
+        return self._get("rag_service", self._create_rag_service)
+
+    @property
+    def session_manager(self) -> "SessionManager":
+        return self._get("session_manager", self._create_session_manager)
+
+    @property
+    def history_manager(self) -> "HistoryManager":
+        return self._get("history_manager", self._create_history_manager)
+
+    @property
+    def ingestion_manager(self) -> "IngestionManager":
+        return self._get("ingestion_manager", self._create_ingestion_manager)
+
+    @property
+    def janitor(self) -> "Janitor":
+        return self._get("janitor", self._create_janitor)
+
+    def _create_rag_service(self) -> "RagService":
+        from app.services.rag_service import RagService
+        rag_service = RagService()
+        metrics.add_collector(rag_service.collect_metrics)
+        return rag_service
+
+    def _create_session_manager(self) -> "SessionManager":
+        from app.services.session_manager import SessionManager
+        return SessionManager()
+
+    def _create_history_manager(self) -> "HistoryManager":
+        from app.services.history_manager import HistoryManager
+        return HistoryManager(
+            window_turns=settings.HISTORY_WINDOW_TURNS,
+            token_budget=settings.HISTORY_TOKEN_BUDGET,
+            summary_enabled=settings.HISTORY_SUMMARY_ENABLED
+        )
+
+    def _create_ingestion_manager(self) -> "IngestionManager":
+        from app.services.ingestion import IngestionManager
+        return IngestionManager(
+            parse_workers=settings.INGESTION_PARSE_WORKERS,
+            embed_workers=settings.INGESTION_EMBED_WORKERS
+        )
+
+    def _create_janitor(self) -> "Janitor":
+        from app.services.janitor import Janitor
+        return Janitor(
+            interval_seconds=settings.JANITOR_INTERVAL_SECONDS,
+            grace_seconds=settings.JANITOR_GRACE_SECONDS,
+            compact=settings.JANITOR_COMPACT_ENABLED,
+            compact_min_free_bytes=settings.JANITOR_COMPACT_MIN_FREE_BYTES
+        )
+
+    def warm_up(self) -> None:
+        """Create every service and open the stores and clients the first requests would"""
+        start = time.perf_counter()
+        try:
+            self.session_manager
+            self.history_manager
+            self.ingestion_manager
+            self.rag_service.warm_up()
+            self.warm_up_seconds = time.perf_counter() - start
+            logger.info(f"Services warmed up in {self.warm_up_seconds:.2f}s")
+        except Exception as e:
+            self.warm_up_error = str(e)
+            logger.error(f"Error warming up services: {e}")
+
+    def start(self, warm_up: bool = True, janitor: bool = True) -> None:
+        """
+        Warm up and start the janitor in a background thread
+
+        Startup returns at once, so the server answers liveness checks while
+        services are created; /ready tells load balancers when to send traffic.
+        """
+        if self._startup_thread is not None:
+            return
+
+        def run() -> None:
+            if warm_up:
+                self.warm_up()
+            if janitor and not self._stopping.is_set():
+                self.janitor.start()
+
+        self._startup_thread = threading.Thread(target=run, name="startup", daemon=True)
+        self._startup_thread.start()
+
+    def readiness(self) -> Dict[str, Any]:
+        """Report whether the app can serve requests without paying for service creation"""
+        if not settings.STARTUP_WARM_UP:
+            # Services are created by the requests that need them
+            return {"ready": True, "status": "lazy", "services": sorted(self._services)}
+        if self.warm_up_error is not None:
+            return {"ready": False, "status": "failed", "error": self.warm_up_error}
+        if self.warm_up_seconds is None:
+            return {"ready": False, "status": "warming_up", "services": sorted(self._services)}
+        return {
+            "ready": True,
+            "status": "ready",
+            "warm_up_seconds": round(self.warm_up_seconds, 3),
+            "services": sorted(self._services),
+        }
+
+    def shutdown(self) -> None:
+        """Stop background work of the services that were created"""
+        self._stopping.set()
+        if self._startup_thread is not None:
+            # Let a warm-up in progress finish creating what it started on
+            self._startup_thread.join(timeout=30)
+        janitor = self._services.get("janitor")
+        if janitor is not None:
+            janitor.stop()
+        # The RAG service goes last: ingestion and summaries use it
+        for name in ("ingestion_manager", "history_manager", "rag_service"):
+            service = self._services.get(name)
+            if service is not None:
+                service.shutdown()
+        session_manager = self._services.get("session_manager")
+        if session_manager is not None:
+            session_manager.close()
+
+# Global service container
+services = ServiceContainer()
@@ -0,0 +1,80 @@
+from typing import Callable, List, Optional
+
+from langchain.schema import Document
+
+# Shorter matches between chunk ends are as likely to be chance as overlap
+MIN_OVERLAP_CHARS = 20
+
+
+class ContextPacker:
+    """
+    Fills a token budget with retrieved chunks, best first
+
+    Neighbouring chunks of a document share the splitter's overlap, so a
+    chunk's text that is already in the context through another chunk is
+    trimmed before it is counted. Chunks are added in rank order while they
+    fit; the first one that doesn't is cut to the remaining budget if at
+    least min_chunk_tokens are left, and packing stops there.
+    """
+
+    def __init__(self, token_budget: int, count_tokens: Callable[[str], int], min_chunk_tokens: int = 50):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def pack(self, documents: List[Document]) -> List[Document]:
+        """Select and trim documents, in rank order, to fit the token budget"""
+        packed: List[Document] = []
+        remaining = self.token_budget
+        for document in documents:
+            text = self._trim_overlap(document.page_content, [chosen.page_content for chosen in packed])
+            if text is None:
+                continue
+            tokens = self.count_tokens(text)
+            if tokens > remaining:
+                if remaining >= self.min_chunk_tokens:
+                    packed.append(_with_text(document, self._truncate(text, remaining)))
+                break
+            packed.append(document if text == document.page_content else _with_text(document, text))
+            remaining -= tokens
+        return packed
+
+    def _trim_overlap(self, text: str, chosen: List[str]) -> Optional[str]:
+        """Remove the parts of text already in the chosen chunks, or None if nothing is left"""
+        for other in chosen:
+            if text in other:
+                return None
+            text = text[_overlap(other, text):]
+            cut = _overlap(text, other)
+            if cut:
+                text = text[:-cut]
+        return text.strip() or None
+
+    def _truncate(self, text: str, tokens: int) -> str:
+        """Longest run of whole words from the start of text that fits in tokens"""
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:middle])) <= tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest end of first that second starts with"""
+    if len(second) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = second[:MIN_OVERLAP_CHARS]
+    position = first.find(probe, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def _with_text(document: Document, text: str) -> Document:
+    return Document(page_content=text, metadata=document.metadata)
@@ -0,0 +1,321 @@
+from typing import List, Dict, Any, Optional, Set, Tuple
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from langchain.schema import Document
+
+from app.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+_BAND_BITS = 16
+# Metadata of chunks cut from tables (row blocks, CSV rows, spreadsheet blocks). Their rows share
+# headers and layout and differ in a few values, so SimHash would take distinct data for near duplicates.
+_TABULAR_METADATA_KEYS = ("row_start", "row", "sheet")
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Hash a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_sha256(text: str) -> str:
+    """Hash chunk text, ignoring case and whitespace differences"""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash of the words in text
+
+    Texts that differ in only a few words have hashes a small Hamming distance apart.
+    """
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little") for w in words),
+        dtype=np.uint64,
+        count=len(words)
+    )
+    bits = ((hashes[:, np.newaxis] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int32)
+    weights = (2 * bits - 1).sum(axis=0)
+    return int(np.packbits((weights > 0)[::-1].astype(np.uint8)).view(">u8")[0])
+
+
+def is_tabular_chunk(doc: Document) -> bool:
+    """Whether a chunk holds rows of a table rather than prose"""
+    return any(key in doc.metadata for key in _TABULAR_METADATA_KEYS)
+
+
+class ChunkDeduplicator:
+    """
+    Per-collection index of chunk hashes for exact and near-duplicate detection
+
+    Near duplicates are found with SimHash; hashes are split into four 16-bit
+    bands so any hash within Hamming distance 3 shares at least one band.
+    Chunks of tables are only skipped as exact duplicates.
+    The chunk ID of each entry is kept so a skipped duplicate can point at
+    the chunk that stands in for it, and entries can be removed when their
+    chunks are deleted.
+
+    As with BM25Index, changes not yet saved are journaled so save() can
+    replay them on a version another worker process saved in the meantime.
+    """
+
+    FILE_NAME = "chunks.npz"
+    LOCK_FILE = "write.lock"
+
+    def __init__(self, directory: Optional[str] = None, max_distance: int = 3):
+        self.directory = directory
+        self.max_distance = max_distance
+        self.exact: Dict[str, int] = {}
+        self.simhashes: List[int] = []
+        self.chunk_ids: List[str] = []
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(64 // _BAND_BITS)]
+        # Changes since the last save, and the identity of the saved file they apply to
+        self._journal: List[Tuple[str, Any]] = []
+        self._saved_id: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _add_locked(self, exact_hash: str, fingerprint: int, chunk_id: str = "") -> None:
+        index = len(self.simhashes)
+        self.exact[exact_hash] = index
+        self.simhashes.append(fingerprint)
+        self.chunk_ids.append(chunk_id)
+        for band, buckets in enumerate(self._bands):
+            key = (fingerprint >> (band * _BAND_BITS)) & 0xFFFF
+            buckets.setdefault(key, []).append(index)
+
+    def _find_near_duplicate_locked(self, fingerprint: int) -> Optional[int]:
+        for band, buckets in enumerate(self._bands):
+            key = (fingerprint >> (band * _BAND_BITS)) & 0xFFFF
+            for index in buckets.get(key, ()):
+                if bin(self.simhashes[index] ^ fingerprint).count("1") <= self.max_distance:
+                    return index
+        return None
+
+    def filter(self, documents: List[Document]) -> Tuple[List[Document], List[str], List[Tuple[str, int, str]]]:
+        """
+        Drop chunks that duplicate ones already in the collection (or earlier in the list)
+
+        The index itself is left unchanged: pass the returned entries to
+        record() once the unique chunks are stored, so chunks that failed
+        to be stored aren't taken for duplicates when the file is retried.
+
+        Returns:
+            Tuple of (unique documents, chunk ID matched by each duplicate skipped,
+            index entries of the unique documents). IDs are empty for entries
+            recorded before chunk IDs were kept.
+        """
+        self._catch_up()
+        unique = []
+        duplicate_of = []
+        # Chunks earlier in the list are checked in an index of their own
+        pending = ChunkDeduplicator(max_distance=self.max_distance)
+        with self._lock:
+            for doc in documents:
+                exact_hash = chunk_sha256(doc.page_content)
+                index, match = self, self.exact.get(exact_hash)
+                if match is None:
+                    index, match = pending, pending.exact.get(exact_hash)
+                if match is None:
+                    fingerprint = simhash(doc.page_content)
+                    if not is_tabular_chunk(doc):
+                        for index in (self, pending):
+                            match = index._find_near_duplicate_locked(fingerprint)
+                            if match is not None:
+                                break
+                if match is not None:
+                    duplicate_of.append(index.chunk_ids[match])
+                    continue
+                pending._add_locked(exact_hash, fingerprint, doc.metadata.get("chunk_id", ""))
+                unique.append(doc)
+        entries = list(zip(pending._exact_hashes_locked(), pending.simhashes, pending.chunk_ids))
+        return unique, duplicate_of, entries
+
+    def record(self, entries: List[Tuple[str, int, str]]) -> None:
+        """Add the entries returned by filter() for chunks that were stored"""
+        with self._lock:
+            self._journal_locked("record", entries)
+            self._record_locked(entries)
+
+    def _record_locked(self, entries: List[Tuple[str, int, str]]) -> None:
+        for exact_hash, fingerprint, chunk_id in entries:
+            if exact_hash not in self.exact:
+                self._add_locked(exact_hash, fingerprint, chunk_id)
+
+    def add(self, texts: List[str], chunk_ids: Optional[List[str]] = None) -> None:
+        """Record chunks that were added to the collection without filtering"""
+        chunk_ids = chunk_ids or [""] * len(texts)
+        with self._lock:
+            entries = [
+                (exact_hash, simhash(text), chunk_id)
+                for exact_hash, text, chunk_id in zip(map(chunk_sha256, texts), texts, chunk_ids)
+                if exact_hash not in self.exact
+            ]
+        self.record(entries)
+
+    def remove(self, chunk_ids: List[str]) -> int:
+        """Forget the entries of deleted chunks so their content can be indexed again"""
+        drop = set(chunk_ids)
+        with self._lock:
+            self._journal_locked("remove", drop)
+            return self._remove_locked(drop)
+
+    def _remove_locked(self, drop: Set[str]) -> int:
+        exact = self._exact_hashes_locked()
+        entries = [
+            (exact_hash, fingerprint, chunk_id)
+            for exact_hash, fingerprint, chunk_id in zip(exact, self.simhashes, self.chunk_ids)
+            if chunk_id not in drop
+        ]
+        removed = len(self.simhashes) - len(entries)
+        if removed:
+            # Deletes are rare, so the bands are simply rebuilt
+            self.exact, self.simhashes, self.chunk_ids = {}, [], []
+            self._bands = [{} for _ in range(64 // _BAND_BITS)]
+            for entry in entries:
+                self._add_locked(*entry)
+        return removed
+
+    def _journal_locked(self, op: str, args: Any) -> None:
+        if self.directory:
+            self._journal.append((op, args))
+
+    def _exact_hashes_locked(self) -> List[str]:
+        exact = [""] * len(self.simhashes)
+        for exact_hash, index in self.exact.items():
+            exact[index] = exact_hash
+        return exact
+
+    def save(self) -> None:
+        """Persist the hashes to the index directory, merged with what other processes saved"""
+        if not self.directory:
+            return
+        with self._lock, file_lock(os.path.join(self.directory, self.LOCK_FILE)):
+            if self._disk_id() != self._saved_id:
+                self._reload_locked()
+            path = os.path.join(self.directory, self.FILE_NAME)
+            tmp_path = path + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                exact=np.array(self._exact_hashes_locked(), dtype=str),
+                simhashes=np.array(self.simhashes, dtype=np.uint64),
+                chunk_ids=np.array(self.chunk_ids, dtype=str)
+            )
+            os.replace(tmp_path, path)
+            self._saved_id = self._disk_id()
+            self._journal = []
+
+    def _disk_id(self) -> Optional[Tuple[int, int]]:
+        """Identity of the saved file; every save replaces it, so it changes with each save"""
+        try:
+            stat = os.stat(os.path.join(self.directory, self.FILE_NAME))
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _catch_up(self) -> None:
+        """Reload the hashes if another process saved them and there is nothing here waiting to be saved"""
+        if not self.directory or self._journal:
+            return
+        # No file at all means the collection was dropped
+        if self._disk_id() in (None, self._saved_id):
+            return
+        with self._lock:
+            if not self._journal:
+                self._reload_locked()
+
+    def _reload_locked(self) -> None:
+        """Replace the in-memory hashes with the saved ones, replaying changes not saved yet"""
+        saved = self.load(self.directory, self.max_distance)
+        for op, args in self._journal:
+            getattr(saved, f"_{op}_locked")(args)
+        self.exact, self.simhashes, self.chunk_ids = saved.exact, saved.simhashes, saved.chunk_ids
+        self._bands, self._saved_id = saved._bands, saved._saved_id
+
+    @classmethod
+    def load(cls, directory: str, max_distance: int = 3) -> "ChunkDeduplicator":
+        """Load the index from disk, or return an empty one if none exists"""
+        dedup = cls(directory, max_distance)
+        path = os.path.join(directory, cls.FILE_NAME)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                # The file is replaced rather than rewritten, so the open one matches this identity
+                stat = os.fstat(f.fileno())
+                dedup._saved_id = (stat.st_dev, stat.st_ino)
+                with np.load(f) as data:
+                    # Indexes saved before chunk IDs were kept have no chunk_ids array
+                    chunk_ids = data["chunk_ids"] if "chunk_ids" in data else [""] * len(data["simhashes"])
+                    for exact_hash, fingerprint, chunk_id in zip(data["exact"], data["simhashes"], chunk_ids):
+                        dedup._add_locked(str(exact_hash), int(fingerprint), str(chunk_id))
+        return dedup
+
+
+class FileHashRegistry:
+    """Records which collection already holds the chunks of each file hash"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_hash TEXT NOT NULL, collection_name TEXT NOT NULL, chunks INTEGER NOT NULL, "
+            "PRIMARY KEY (file_hash, collection_name))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def find(self, file_hash: str) -> Optional[str]:
+        """Get a collection that already contains the file, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT collection_name FROM files WHERE file_hash = ? AND chunks > 0 LIMIT 1",
+                (file_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def register(self, file_hash: str, collection_name: str, chunks: int) -> None:
+        """Record that a collection contains the chunks of a file"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (file_hash, collection_name, chunks) VALUES (?, ?, ?)",
+                (file_hash, collection_name, chunks)
+            )
+            self._conn.commit()
+
+    def unregister(self, file_hash: str, collection_name: str) -> None:
+        """Record that a collection no longer contains a file"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE file_hash = ? AND collection_name = ?",
+                (file_hash, collection_name)
+            )
+            self._conn.commit()
+
+    def remove_collection(self, collection_name: str) -> None:
+        """Forget every file held by a collection"""
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE collection_name = ?", (collection_name,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files, collections = self._conn.execute(
+                "SELECT COUNT(DISTINCT file_hash), COUNT(DISTINCT collection_name) FROM files"
+            ).fetchone()
+        return {"files": files, "collections": collections}
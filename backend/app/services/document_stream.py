@@ -0,0 +1,266 @@
+from typing import List, Iterator, Iterable, Optional, TypeVar
+from collections import deque
+from concurrent.futures import Executor, Future
+from functools import lru_cache
+import csv
+import logging
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+
+from app.core.config import settings
+from app.services.tabular import TableWriter, is_tabular, iter_table_blocks
+from app.utils.file_utils import original_filename
+from app.utils.timing import stage
+from app.utils.tokenizer import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Plain text and spreadsheet rows are grouped into blocks of roughly this many characters
+TEXT_BLOCK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=1)
+def create_text_splitter() -> TextSplitter:
+    """
+    Create the splitter for the configured TEXT_SPLITTER, shared per process
+
+    "characters" cuts CHUNK_SIZE-character chunks overlapping by
+    CHUNK_OVERLAP characters. "tokens" measures chunks with the tokenizer
+    instead, so they line up with model limits and overlap less.
+    """
+    if settings.TEXT_SPLITTER == "tokens":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=settings.SPLITTER_CHUNK_TOKENS,
+            chunk_overlap=settings.SPLITTER_OVERLAP_TOKENS,
+            length_function=get_token_counter(settings.TOKENIZER_ENCODING)
+        )
+    if settings.TEXT_SPLITTER != "characters":
+        raise ValueError(f"Unsupported text splitter: {settings.TEXT_SPLITTER}")
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """Split documents with the configured splitter; module-level so it can run in a worker process"""
+    return create_text_splitter().split_documents(documents)
+
+
+def is_table_file(file_type: str) -> bool:
+    """Whether a file is ingested as blocks of table rows"""
+    return settings.TABULAR_INGESTION_ENABLED and is_tabular(file_type)
+
+
+def iter_table_chunks(file_path: str, file_type: str, writer: Optional[TableWriter] = None) -> Iterator[Document]:
+    """Yield the schema-annotated row blocks of a CSV or Excel file, ready to embed"""
+    return iter_table_blocks(
+        file_path,
+        file_type,
+        original_filename(file_path),
+        block_chars=settings.TABULAR_BLOCK_CHARS,
+        block_rows=settings.TABULAR_BLOCK_MAX_ROWS,
+        read_rows=settings.TABULAR_READ_ROWS,
+        writer=writer
+    )
+
+
+def load_and_split_file(file_path: str, file_type: str) -> List[Document]:
+    """
+    Load a file and split it into chunks
+    
+    This is a module-level function so it can run in a worker process. It
+    lives here rather than next to RagService so a spawned worker imports
+    the loaders without the LLM and vector store clients.
+    
+    Args:
+        file_path: Path to the file on disk
+        file_type: The file extension
+        
+    Returns:
+        List of chunked documents
+    """
+    try:
+        if is_table_file(file_type):
+            with stage("parsing"):
+                documents = list(iter_table_chunks(file_path, file_type))
+            logger.info(f"Read {len(documents)} row blocks from {file_path}")
+            return documents
+        
+        # Loaders are imported on first use; langchain_community imports every loader it has
+        if file_type.lower().endswith('pdf'):
+            from langchain_community.document_loaders import PyPDFLoader
+            loader = PyPDFLoader(file_path)
+        elif file_type.lower().endswith('csv'):
+            from langchain_community.document_loaders import CSVLoader
+            loader = CSVLoader(file_path)
+        elif file_type.lower().endswith('txt'):
+            from langchain_community.document_loaders import TextLoader
+            loader = TextLoader(file_path)
+        elif file_type.lower().endswith(('xls', 'xlsx')):
+            from langchain_community.document_loaders import UnstructuredExcelLoader
+            loader = UnstructuredExcelLoader(file_path)
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+        
+        with stage("parsing"):
+            documents = loader.load()
+        logger.info(f"Loaded {len(documents)} documents from {file_path}")
+        
+        # Split documents
+        with stage("splitting"):
+            split_docs = split_documents(documents)
+        logger.info(f"Split into {len(split_docs)} chunks")
+        
+        return split_docs
+    
+    except Exception as e:
+        logger.error(f"Error processing file {file_path}: {str(e)}")
+        raise
+
+
+def iter_file_documents(file_path: str, file_type: str) -> Iterator[Document]:
+    """
+    Yield a file's contents as documents without loading the whole file
+
+    PDFs are yielded page by page, CSVs row by row, and text and Excel files in
+    blocks of about TEXT_BLOCK_SIZE characters.
+
+    Args:
+        file_path: Path to the file on disk
+        file_type: The file extension
+
+    Returns:
+        Iterator of documents
+    """
+    file_type = file_type.lower()
+    if file_type.endswith('pdf'):
+        from langchain_community.document_loaders import PyPDFLoader
+        yield from PyPDFLoader(file_path).lazy_load()
+    elif file_type.endswith('csv'):
+        yield from _iter_csv_rows(file_path)
+    elif file_type.endswith('txt'):
+        yield from _iter_text_blocks(file_path)
+    elif file_type.endswith('xlsx'):
+        yield from _iter_excel_blocks(file_path)
+    elif file_type.endswith('xls'):
+        # openpyxl can't read the legacy format, so fall back to the eager loader
+        from langchain_community.document_loaders import UnstructuredExcelLoader
+        yield from UnstructuredExcelLoader(file_path).load()
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+
+def _iter_csv_rows(file_path: str) -> Iterator[Document]:
+    """Yield one document per CSV row, formatted like CSVLoader"""
+    with open(file_path, newline="", encoding="utf-8", errors="replace") as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            content = "\n".join(
+                f"{k.strip() if k is not None else k}: {v.strip() if isinstance(v, str) else v}"
+                for k, v in row.items()
+            )
+            yield Document(page_content=content, metadata={"source": file_path, "row": i})
+
+
+def _iter_text_blocks(file_path: str) -> Iterator[Document]:
+    """Yield a text file in blocks that end on a line boundary"""
+    with open(file_path, encoding="utf-8", errors="replace") as f:
+        buffer = ""
+        while True:
+            data = f.read(TEXT_BLOCK_SIZE)
+            if not data:
+                break
+            buffer += data
+            cut = buffer.rfind("\n")
+            if cut == -1:
+                continue
+            yield Document(page_content=buffer[:cut + 1], metadata={"source": file_path})
+            buffer = buffer[cut + 1:]
+        if buffer:
+            yield Document(page_content=buffer, metadata={"source": file_path})
+
+
+def _iter_excel_blocks(file_path: str) -> Iterator[Document]:
+    """Yield blocks of spreadsheet rows, reading the workbook in read-only mode"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            lines: List[str] = []
+            size = 0
+            for row in sheet.iter_rows(values_only=True):
+                line = "\t".join("" if value is None else str(value) for value in row).rstrip()
+                if not line:
+                    continue
+                lines.append(line)
+                size += len(line) + 1
+                if size >= TEXT_BLOCK_SIZE:
+                    yield Document(page_content="\n".join(lines), metadata={"source": file_path, "sheet": sheet.title})
+                    lines, size = [], 0
+            if lines:
+                yield Document(page_content="\n".join(lines), metadata={"source": file_path, "sheet": sheet.title})
+    finally:
+        workbook.close()
+
+
+def iter_split_documents(documents: Iterable[Document], text_splitter: TextSplitter,
+                         executor: Optional[Executor] = None, window: int = 4) -> Iterator[Document]:
+    """
+    Split documents into chunks one document at a time
+
+    With an executor, e.g. a process pool, documents are sent to it in
+    groups of about TEXT_BLOCK_SIZE characters and up to window groups are
+    split at once while the next ones are read, so a large file's text is
+    split across cores. Its workers use the configured splitter rather
+    than text_splitter. Chunks are yielded in document order either way.
+    """
+    if executor is None:
+        for document in documents:
+            with stage("splitting"):
+                chunks = text_splitter.split_documents([document])
+            yield from chunks
+        return
+
+    pending: "deque[Future]" = deque()
+    group: List[Document] = []
+    size = 0
+    try:
+        for document in documents:
+            group.append(document)
+            size += len(document.page_content)
+            if size < TEXT_BLOCK_SIZE:
+                continue
+            pending.append(executor.submit(split_documents, group))
+            group, size = [], 0
+            if len(pending) >= window:
+                with stage("splitting"):
+                    chunks = pending.popleft().result()
+                yield from chunks
+        if group:
+            pending.append(executor.submit(split_documents, group))
+        while pending:
+            with stage("splitting"):
+                chunks = pending.popleft().result()
+            yield from chunks
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_batches(items: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most batch_size items"""
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
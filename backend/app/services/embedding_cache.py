@@ -0,0 +1,204 @@
+from typing import List, Dict, Any, Optional, Sequence
+from array import array
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain.schema.embeddings import Embeddings
+
+from app.services.embedding_scheduler import EmbeddingBatchError
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_LOOKUP_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """Persistent, size-bounded store of embedding vectors keyed by content hash"""
+
+    def __init__(self, path: str, model_name: str, max_entries: int = 200_000):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def make_key(self, text: str) -> str:
+        """Hash the chunk text together with the embedding model name"""
+        digest = hashlib.sha256()
+        digest.update(self.model_name.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Look up vectors for a batch of texts, returning None for misses"""
+        keys = [self.make_key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), _LOOKUP_BATCH_SIZE):
+                batch = unique_keys[start:start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            # Refresh recency so eviction removes the least recently used entries
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for vector in results if vector is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store vectors for a batch of texts and evict old entries if over capacity"""
+        if not texts:
+            return
+
+        now = time.time()
+        rows = {
+            self.make_key(text): (array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        }
+
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, blob, last_access) for key, (blob, last_access) in rows.items()]
+            )
+            self._entries += self._conn.total_changes - before
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        """Drop the least recently used entries once the cache exceeds max_entries"""
+        if self._entries <= self.max_entries:
+            return
+
+        # Evict down to 90% of capacity so we don't evict on every insert
+        target = int(self.max_entries * 0.9)
+        excess = self._entries - target
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (excess,)
+        )
+        self._entries -= excess
+        self.evictions += excess
+        logger.info(f"Evicted {excess} entries from embedding cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and size of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self) -> None:
+        """Remove all cached vectors"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+
+    def close(self) -> None:
+        """Close the underlying database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the underlying provider
+
+    Any Embeddings implementation can be wrapped, including a fake local one,
+    so the cache can be exercised without calling OpenAI.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, reusing cached vectors where available"""
+        vectors = self.cache.get_many(texts)
+
+        # Only embed each distinct missing text once
+        missing = list(dict.fromkeys(
+            text for text, vector in zip(texts, vectors) if vector is None
+        ))
+        if missing:
+            try:
+                new_vectors = self.underlying.embed_documents(missing)
+            except EmbeddingBatchError as e:
+                # Keep the batches that succeeded so a retry only resends the failed ones
+                done = sorted(e.completed)
+                self.cache.put_many([missing[i] for i in done], [e.completed[i] for i in done])
+                raise
+            self.cache.put_many(missing, new_vectors)
+            computed = dict(zip(missing, new_vectors))
+            vectors = [
+                vector if vector is not None else list(computed[text])
+                for text, vector in zip(texts, vectors)
+            ]
+            logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query string, reusing a cached vector if available"""
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a single query string without blocking the event loop"""
+        # Cache reads and writes may wait for the lock held by an ingestion's bulk write
+        loop = asyncio.get_running_loop()
+        vector = (await loop.run_in_executor(None, self.cache.get_many, [text]))[0]
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            await loop.run_in_executor(None, self.cache.put_many, [text], [vector])
+        return vector
@@ -0,0 +1,290 @@
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from langchain.schema.embeddings import Embeddings
+
+from app.utils.singleflight import AsyncSingleFlight, SingleFlight
+from app.utils.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class EmbeddingBatchError(Exception):
+    """
+    Raised when some batches still fail after all retries
+
+    `completed` maps the index of every text that was embedded to its vector,
+    so callers can keep that work and only resend the failed texts.
+    """
+
+    def __init__(self, message: str, completed: Dict[int, List[float]]):
+        super().__init__(message)
+        self.completed = completed
+
+
+class TokenBucket:
+    """Thread-safe token bucket; a rate of 0 means unlimited"""
+
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else rate_per_second
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> float:
+        """
+        Block until `amount` tokens are available and take them
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            delay = self._try_take(amount)
+            if delay is None:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def aacquire(self, amount: float = 1) -> float:
+        """Like acquire, but waits without blocking the event loop"""
+        waited = 0.0
+        while True:
+            delay = self._try_take(amount)
+            if delay is None:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def _try_take(self, amount: float) -> Optional[float]:
+        """Take `amount` tokens if available, otherwise return how long until they are"""
+        if self.rate <= 0:
+            return None
+        # Requests larger than the bucket would never fit; let them through once it is full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return None
+            return (amount - self._tokens) / self.rate
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeddings wrapper that batches, rate limits and retries provider calls
+
+    Texts are split into batches of batch_size and sent concurrently, with at
+    most max_concurrency requests in flight across all callers. Request and
+    token rates are kept under the provider's limits by token buckets, so
+    large uploads are paced instead of tripping 429s. A failed batch is
+    retried on its own with exponential backoff (honouring Retry-After),
+    without resending batches that already succeeded. A batch or question
+    identical to one already in flight, e.g. the same file uploaded to two
+    sessions at once, waits for that request instead of sending its own.
+    """
+
+    def __init__(self, underlying: Embeddings, batch_size: int = 128, max_concurrency: int = 4,
+                 requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 6, retry_base_seconds: float = 0.5, retry_max_seconds: float = 30.0,
+                 coalesce: bool = True):
+        self.underlying = underlying
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        # Allow short bursts of up to a second's worth of requests
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._batches = SingleFlight("embedding_batch", enabled=coalesce)
+        self._queries = AsyncSingleFlight("query_embedding", enabled=coalesce)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix="embedding"
+                )
+            return self._executor
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in concurrent, rate-limited batches"""
+        if not texts:
+            return []
+        starts = list(range(0, len(texts), self.batch_size))
+        if len(starts) == 1:
+            return self._embed_batch(texts)
+
+        futures = {
+            start: self.executor.submit(self._embed_batch, texts[start:start + self.batch_size])
+            for start in starts
+        }
+        wait(futures.values())
+
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        errors = []
+        for start, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                errors.append(error)
+                continue
+            vectors[start:start + self.batch_size] = future.result()
+
+        if errors:
+            completed = {i: vector for i, vector in enumerate(vectors) if vector is not None}
+            raise EmbeddingBatchError(
+                f"{len(errors)} of {len(starts)} embedding batches failed: {errors[0]}",
+                completed
+            ) from errors[0]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embed a question without blocking the event loop
+
+        Rate limits and retries apply as they do to batches, but questions
+        don't wait for a concurrency slot: they are single texts that
+        shouldn't queue behind an upload's batches.
+        """
+        vector, _ = await self._queries.do(text, lambda: self._asend_query(text))
+        return vector
+
+    async def _asend_query(self, text: str) -> List[float]:
+        attempt = 0
+        while True:
+            throttled = await self.request_bucket.aacquire(1)
+            throttled += await self.token_bucket.aacquire(estimate_tokens(text))
+            try:
+                vectors = await self.underlying.aembed_documents([text])
+                error = None
+            except Exception as e:
+                error = e
+            delay = self._after_request(1, error, throttled, attempt)
+            if delay is None:
+                return vectors[0]
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Send one batch, or wait for the identical one already in flight"""
+        vectors, _ = self._batches.do(tuple(texts), lambda: self._send_batch(texts))
+        return vectors
+
+    def _send_batch(self, texts: List[str]) -> List[List[float]]:
+        """Send one batch, retrying it with backoff on transient errors"""
+        attempt = 0
+        while True:
+            throttled = self.request_bucket.acquire(1)
+            throttled += self.token_bucket.acquire(sum(estimate_tokens(text) for text in texts))
+            with self._slots:
+                try:
+                    vectors = self.underlying.embed_documents(texts)
+                    error = None
+                except Exception as e:
+                    error = e
+            delay = self._after_request(len(texts), error, throttled, attempt)
+            if delay is None:
+                return vectors
+            attempt += 1
+            time.sleep(delay)
+
+    def _after_request(self, texts: int, error: Optional[Exception], throttled: float,
+                       attempt: int) -> Optional[float]:
+        """
+        Count a request and decide what happens next
+
+        Returns:
+            None if it succeeded, otherwise the seconds to wait before retrying
+
+        Raises:
+            The request's error if it can't be retried
+        """
+        with self._stats_lock:
+            self.requests += 1
+            self.throttled_seconds += throttled
+        if error is None:
+            return None
+
+        if attempt >= self.max_retries or not _is_retryable(error):
+            with self._stats_lock:
+                self.failures += 1
+            raise error
+
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+        with self._stats_lock:
+            self.retries += 1
+        logger.warning(
+            f"Embedding batch of {texts} failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+        )
+        return delay
+
+    def stats(self) -> Dict[str, float]:
+        """Get request, retry and throttling counters"""
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "throttled_seconds": self.throttled_seconds,
+            }
+
+    def shutdown(self) -> None:
+        """Stop the worker threads"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether an error from the provider is transient"""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # Connection failures and timeouts carry no status code
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from the Retry-After header"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") if hasattr(headers, "get") else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,98 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from app.models.session import UserSession
+from app.services.container import services
+from app.utils.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+class HistoryManager:
+    """
+    Bounds the chat history sent with each question
+
+    The last window_turns turns are sent verbatim, trimmed further if they
+    exceed token_budget. Turns that leave the window are folded into a
+    running summary stored on the session. Summaries are updated in the
+    background after a reply, so they never add latency to a request.
+
+    Only the last few messages are read from the session store per turn,
+    so the work per question stays proportional to the window, not to the
+    length of the conversation.
+    """
+
+    def __init__(self, window_turns: int, token_budget: int, summary_enabled: bool):
+        self.window_messages = window_turns * 2
+        self.token_budget = token_budget
+        self.summary_enabled = summary_enabled
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+        return self._executor
+
+    def _fit_budget(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep the newest messages that fit in the token budget, always keeping the last turn"""
+        kept = 0
+        tokens = 0
+        for message in reversed(messages):
+            tokens += estimate_tokens(message["content"])
+            if tokens > self.token_budget and kept >= 2:
+                break
+            kept += 1
+        return messages[len(messages) - kept:]
+
+    def get_history(self, session: UserSession) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Get the history to send with the next question
+
+        Returns:
+            Tuple of (recent messages, summary of older turns)
+        """
+        window = self._fit_budget(session.get_recent_history(self.window_messages))
+        summary = session.history_summary if self.summary_enabled else ""
+        return window, summary
+
+    def schedule_summary(self, session: UserSession, rag_service: "RagService") -> None:
+        """Fold turns that have left the window into the summary, in the background"""
+        if not self.summary_enabled:
+            return
+        with self._lock:
+            if session.session_id in self._in_flight:
+                return
+            self._in_flight.add(session.session_id)
+        self.executor.submit(self._update_summary, session, rag_service)
+
+    def _update_summary(self, session: UserSession, rag_service: "RagService") -> None:
+        try:
+            # Read some messages beyond the window so turns skipped by a failed update are caught up
+            messages = session.get_recent_history(self.window_messages * 2)
+            window = self._fit_budget(messages[-self.window_messages:])
+            older = messages[:len(messages) - len(window)]
+            new = [
+                message for message in older
+                if session.summarized_until is None or message["timestamp"] > session.summarized_until
+            ]
+            if not new:
+                return
+
+            summary = rag_service.summarize_history(session.history_summary, new)
+            services.session_manager.update_history_summary(session, summary, new[-1]["timestamp"])
+            logger.info(f"Folded {len(new)} messages into the summary for session {session.session_id}")
+        except Exception as e:
+            logger.error(f"Error summarizing chat history: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(session.session_id)
+
+    def shutdown(self) -> None:
+        """Stop the summary worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
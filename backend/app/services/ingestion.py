@@ -0,0 +1,227 @@
+from typing import Dict, List, Optional, Set
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+from app.models.job import IngestionJob, JobStatus
+from app.models.session import UserSession
+from app.services.container import services
+from app.services.document_stream import load_and_split_file
+from app.core.config import settings
+from app.utils.file_utils import remove_upload_file
+
+logger = logging.getLogger(__name__)
+
+class IngestionManager:
+    """
+    Runs file ingestion in the background so uploads don't block the event loop
+
+    Parsing (PDF/Excel loaders) is CPU bound and runs in a process pool,
+    embedding and vector store writes are I/O bound and run in a thread pool.
+    With INGESTION_STREAMING enabled, each file is instead parsed, split and
+    embedded incrementally in the thread pool so memory stays bounded.
+    """
+
+    def __init__(self, parse_workers: int, embed_workers: int):
+        self.parse_workers = parse_workers
+        self.embed_workers = embed_workers
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self._process_pool
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.embed_workers,
+                thread_name_prefix="ingestion"
+            )
+        return self._thread_pool
+
+    def create_job(self, session: UserSession) -> IngestionJob:
+        """Create a new ingestion job for the session's collection"""
+        self._prune_jobs()
+        job = IngestionJob(session.session_id, session.collection_name)
+        self.jobs[job.job_id] = job
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        """Get a job by ID"""
+        return self.jobs.get(job_id)
+
+    def active_jobs(self) -> List[IngestionJob]:
+        """Get the jobs that haven't finished yet"""
+        return [job for job in list(self.jobs.values()) if not job.is_done]
+
+    def start_job(self, job: IngestionJob, session: UserSession, rag_service: "RagService") -> asyncio.Task:
+        """Schedule the job on the running event loop and return its task immediately"""
+        task = asyncio.create_task(self._run_job(job, session, rag_service))
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_job(self, job: IngestionJob, session: UserSession, rag_service: "RagService") -> None:
+        job.status = JobStatus.RUNNING
+        await asyncio.gather(
+            *(self._ingest_file(job, file_info, session, rag_service) for file_info in job.files)
+        )
+        job.finish()
+        logger.info(f"Ingestion job {job.job_id} finished with status {job.status}")
+
+    async def _ingest_file(self, job: IngestionJob, file_info: Dict, session: UserSession,
+                           rag_service: "RagService") -> None:
+        try:
+            if file_info["replaces"]:
+                chunk_ids = await self._replace_file(job, file_info, session, rag_service)
+            elif file_info["link_from"]:
+                chunk_ids = await self._link_file(job, file_info, rag_service)
+            elif settings.INGESTION_STREAMING:
+                chunk_ids = await self._stream_file(job, file_info, rag_service)
+            else:
+                chunk_ids = await self._parse_and_embed_file(job, file_info, rag_service)
+
+            # Saving the session reads and writes the session store
+            await asyncio.get_running_loop().run_in_executor(
+                self.thread_pool,
+                lambda: services.session_manager.add_file_to_session(
+                    session,
+                    file_info["name"],
+                    file_info["path"],
+                    file_info["type"],
+                    file_info["size"],
+                    file_info["hash"],
+                    file_id=file_info["file_id"],
+                    chunk_ids=chunk_ids
+                )
+            )
+            if file_info["replaces"] and file_info["replaces"]["path"] != file_info["path"]:
+                # The new version's upload is kept in place of the old one
+                await asyncio.get_running_loop().run_in_executor(
+                    self.thread_pool, remove_upload_file, file_info["replaces"]["path"]
+                )
+            job.update_file(file_info, JobStatus.COMPLETED)
+            logger.info(f"Processed file: {file_info['name']}")
+
+        except Exception as e:
+            logger.error(f"Error processing file {file_info['name']}: {str(e)}")
+            job.update_file(file_info, JobStatus.FAILED, error=str(e))
+
+    async def _stream_file(self, job: IngestionJob, file_info: Dict, rag_service: "RagService") -> List[str]:
+        """Parse, split and embed a file in bounded batches on the thread pool, returning its chunk IDs"""
+        loop = asyncio.get_running_loop()
+        job.update_file(file_info, JobStatus.EMBEDDING)
+        stats = await loop.run_in_executor(
+            self.thread_pool,
+            lambda: rag_service.ingest_file(
+                file_info["path"],
+                file_info["type"],
+                job.collection_name,
+                file_hash=file_info["hash"],
+                on_progress=lambda chunks: job.update_file(file_info, JobStatus.EMBEDDING, chunks=chunks),
+                split_executor=self.process_pool if settings.SPLITTER_PARALLEL else None,
+                split_window=2 * self.parse_workers
+            )
+        )
+        chunk_ids = stats.pop("chunk_ids")
+        job.update_file(file_info, JobStatus.EMBEDDING, **stats)
+        return chunk_ids
+
+    async def _link_file(self, job: IngestionJob, file_info: Dict, rag_service: "RagService") -> List[str]:
+        """Reuse the chunks of an identical file indexed in another collection, returning their IDs"""
+        loop = asyncio.get_running_loop()
+        job.update_file(file_info, JobStatus.EMBEDDING)
+        chunk_ids = await loop.run_in_executor(
+            self.thread_pool,
+            rag_service.link_file,
+            file_info["hash"],
+            file_info["link_from"],
+            job.collection_name
+        )
+        if not chunk_ids:
+            # The source collection no longer has the chunks, index from scratch
+            file_info["link_from"] = None
+            return await self._stream_file(job, file_info, rag_service)
+        job.update_file(file_info, JobStatus.EMBEDDING, chunks=len(chunk_ids), linked=True)
+        return chunk_ids
+
+    async def _replace_file(self, job: IngestionJob, file_info: Dict, session: UserSession,
+                            rag_service: "RagService") -> List[str]:
+        """Re-index a new version of a file, embedding only its changed chunks"""
+        loop = asyncio.get_running_loop()
+        job.update_file(file_info, JobStatus.EMBEDDING)
+        other_files = [f for f in session.get_files() if f["file_id"] != file_info["file_id"]]
+        stats = await loop.run_in_executor(
+            self.thread_pool,
+            lambda: rag_service.replace_file(
+                file_info["path"],
+                file_info["type"],
+                job.collection_name,
+                file_info["replaces"],
+                other_files,
+                file_hash=file_info["hash"]
+            )
+        )
+        chunk_ids = stats.pop("chunk_ids")
+        job.update_file(file_info, JobStatus.EMBEDDING, **stats)
+        return chunk_ids
+
+    async def _parse_and_embed_file(self, job: IngestionJob, file_info: Dict, rag_service: "RagService") -> List[str]:
+        """Parse a file in the process pool, then embed all of its chunks, returning their IDs"""
+        loop = asyncio.get_running_loop()
+        job.update_file(file_info, JobStatus.PARSING)
+        documents = await loop.run_in_executor(
+            self.process_pool,
+            load_and_split_file,
+            file_info["path"],
+            file_info["type"]
+        )
+
+        job.update_file(file_info, JobStatus.EMBEDDING, chunks=len(documents))
+        if not documents:
+            return []
+        stats = await loop.run_in_executor(
+            self.thread_pool,
+            rag_service.add_file_chunks,
+            documents,
+            job.collection_name,
+            file_info["hash"]
+        )
+        await loop.run_in_executor(
+            self.thread_pool,
+            rag_service.save_tables,
+            file_info["path"],
+            file_info["type"],
+            job.collection_name,
+            file_info["hash"]
+        )
+        chunk_ids = stats.pop("chunk_ids")
+        job.update_file(file_info, JobStatus.EMBEDDING, **stats)
+        return chunk_ids
+
+    def _prune_jobs(self) -> None:
+        """Forget finished jobs older than the retention period"""
+        cutoff = datetime.now() - timedelta(seconds=settings.INGESTION_JOB_RETENTION_SECONDS)
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.is_done and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def shutdown(self) -> None:
+        """Stop the worker pools"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
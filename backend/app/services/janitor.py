@@ -0,0 +1,221 @@
+from typing import Any, Dict, Optional, Set, Tuple
+from datetime import datetime, timedelta
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from app.core.config import settings
+from app.core.metrics import janitor_removed, janitor_reclaimed_bytes
+from app.services.container import services
+from app.services.vectorstore_registry import vectorstore_registry
+from app.utils.file_utils import remove_upload_file
+from app.utils.setup_utils import clean_temp_files, disk_usage
+from app.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+# Sessions name their collections collection_{session_id}; other collections are left alone
+COLLECTION_PREFIX = "collection_"
+CHROMA_DB_FILE = "chroma.sqlite3"
+FIRST_RUN_DELAY_SECONDS = 60
+
+
+class Janitor:
+    """
+    Background thread that reclaims the disk space of idle sessions
+
+    Each run deletes sessions that expired more than the grace period ago,
+    drops every session collection whose session is gone (with its BM25 and
+    dedup indexes and tables), deletes uploads nothing refers to and,
+    optionally, compacts the Chroma database once enough of it is free space.
+
+    Ingestion jobs are only known to the worker running them, so the grace
+    period must outlast any job: nothing younger is reclaimed, in case
+    another worker is still ingesting into it.
+    """
+
+    def __init__(self, interval_seconds: float, grace_seconds: float,
+                 compact: bool = False, compact_min_free_bytes: int = 0):
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self.compact = compact
+        self.compact_min_free_bytes = compact_min_free_bytes
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._run_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start running in the background"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, letting a run in progress finish its current step"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self) -> None:
+        delay = min(FIRST_RUN_DELAY_SECONDS, self.interval_seconds)
+        while not self._stopped.wait(delay):
+            delay = self.interval_seconds
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error in janitor run: {e}")
+
+    def run_once(self) -> Dict[str, Any]:
+        """Reclaim space now, returning what was removed and the bytes freed"""
+        with self._run_lock, stage("janitor"):
+            start = time.perf_counter()
+            result = {
+                "expired_sessions": 0,
+                "collections": 0,
+                "uploads": 0,
+                "collection_bytes": 0,
+                "upload_bytes": 0,
+                "compaction_bytes": 0,
+            }
+
+            # List collections before sessions: a session is saved before its collection is created
+            existing = set(vectorstore_registry.collection_names())
+            store = services.session_manager.store
+            expired = store.expired_sessions()
+            active = store.active_sessions()
+            jobs = services.ingestion_manager.active_jobs()
+
+            # A session is saved before anything is ingested for it, so one that expired within
+            # the grace period may still have a job running on another worker
+            cutoff = datetime.now() - timedelta(seconds=store.ttl_seconds + self.grace_seconds)
+            busy_sessions = {job.session_id for job in jobs}
+            kept = list(active)
+            reclaimable = []
+            for session in expired:
+                if session.session_id in busy_sessions or session.last_active >= cutoff:
+                    kept.append(session)
+                else:
+                    reclaimable.append(session)
+
+            live_collections = {session.collection_name for session in kept if session.collection_name}
+            live_collections |= {job.collection_name for job in jobs}
+            live_collections |= {f["link_from"] for job in jobs for f in job.files if f["link_from"]}
+
+            for session in reclaimable:
+                if self._stopped.is_set():
+                    break
+                store.delete(session.session_id)
+                result["expired_sessions"] += 1
+                for f in session.get_files():
+                    size = os.path.getsize(f["path"]) if os.path.exists(f["path"]) else 0
+                    if remove_upload_file(f["path"]):
+                        result["uploads"] += 1
+                        result["upload_bytes"] += size
+
+            orphans = {
+                name for name in existing
+                if name.startswith(COLLECTION_PREFIX) and name not in live_collections
+            }
+            if orphans and not self._stopped.is_set():
+                result["collections"], result["collection_bytes"] = self._drop_collections(orphans)
+            self._remove_stale_indexes()
+
+            keep = {f["path"] for session in kept for f in session.get_files()}
+            keep |= {f["path"] for job in jobs for f in job.files}
+            orphaned_uploads, orphaned_bytes = clean_temp_files(keep, self.grace_seconds)
+            result["uploads"] += orphaned_uploads
+            result["upload_bytes"] += orphaned_bytes
+
+            if self.compact and not self._stopped.is_set():
+                result["compaction_bytes"] = self._compact()
+
+            result["seconds"] = time.perf_counter() - start
+            self._record(result)
+            return result
+
+    def _drop_collections(self, names: Set[str]) -> Tuple[int, int]:
+        """Drop collections, returning (collections dropped, bytes reclaimed)"""
+        # Chroma keeps each collection's vector index in its own directory; measure
+        # them up front and count the ones that are gone afterwards. Flat indexes
+        # and tables are measured per collection with the others below
+        segments = {
+            entry.path: disk_usage(entry.path)
+            for entry in os.scandir(settings.VECTOR_DB_PATH)
+            if entry.is_dir() and entry.name not in ("bm25", "dedup", "flat", "tables")
+        }
+        reclaimed = 0
+        dropped = 0
+        for name in sorted(names):
+            if self._stopped.is_set():
+                break
+            index_bytes = sum(
+                disk_usage(vectorstore_registry.index_directory(kind, name))
+                for kind in ("bm25", "dedup", "flat", "tables")
+                if os.path.exists(vectorstore_registry.index_directory(kind, name))
+            )
+            try:
+                services.rag_service.drop_collection(name)
+            except Exception as e:
+                logger.error(f"Error dropping collection {name}: {e}")
+                continue
+            dropped += 1
+            reclaimed += index_bytes
+        reclaimed += sum(size for path, size in segments.items() if not os.path.exists(path))
+        return dropped, reclaimed
+
+    def _remove_stale_indexes(self) -> None:
+        """Delete BM25, dedup and table directories left behind by collections that no longer exist"""
+        directories = []
+        for kind in ("bm25", "dedup", "tables"):
+            root = os.path.join(settings.VECTOR_DB_PATH, kind)
+            if os.path.isdir(root):
+                directories.extend((kind, entry) for entry in os.scandir(root) if entry.is_dir())
+        # Indexes and tables are written after their collection is created, so list collections second
+        collections = set(vectorstore_registry.collection_names())
+        for kind, entry in directories:
+            if entry.name not in collections:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"Removed stale {kind} index {entry.name}")
+
+    def _compact(self) -> int:
+        """VACUUM the Chroma database if enough of it is free pages, returning the bytes reclaimed"""
+        path = os.path.join(settings.VECTOR_DB_PATH, CHROMA_DB_FILE)
+        if not os.path.exists(path):
+            return 0
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages or page_size * free_pages < self.compact_min_free_bytes:
+                return 0
+            before = os.path.getsize(path)
+            # Rewrites the file; Chroma writes wait on the database lock meanwhile
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        reclaimed = max(0, before - os.path.getsize(path))
+        logger.info(f"Compacted {path}, reclaimed {reclaimed} bytes")
+        return reclaimed
+
+    def _record(self, result: Dict[str, Any]) -> None:
+        janitor_removed.inc(result["expired_sessions"], kind="sessions")
+        janitor_removed.inc(result["collections"], kind="collections")
+        janitor_removed.inc(result["uploads"], kind="uploads")
+        janitor_reclaimed_bytes.inc(result["collection_bytes"], kind="collections")
+        janitor_reclaimed_bytes.inc(result["upload_bytes"], kind="uploads")
+        janitor_reclaimed_bytes.inc(result["compaction_bytes"], kind="compaction")
+        self.last_run = dict(result, finished_at=time.time())
+
+        reclaimed = result["collection_bytes"] + result["upload_bytes"] + result["compaction_bytes"]
+        logger.info(
+            f"Janitor expired {result['expired_sessions']} sessions, dropped {result['collections']} "
+            f"collections and {result['uploads']} uploads, reclaimed {reclaimed} bytes "
+            f"in {result['seconds']:.2f}s"
+        )
@@ -0,0 +1,60 @@
+from typing import Any, Dict, Optional
+import logging
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClients:
+    """
+    OpenAI clients shared by the chat models and embeddings
+
+    Left to themselves, every ChatOpenAI and OpenAIEmbeddings instance
+    opens its own sync and async connection pools. Sharing one of each
+    keeps connections alive between requests and caps how many are open
+    to the API. The async client is what lets chat requests await the
+    LLM without holding a thread.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, max_connections: int = 100,
+                 max_keepalive_connections: int = 20, keepalive_seconds: float = 30.0,
+                 timeout_seconds: float = 60.0):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_seconds
+        )
+        timeout = httpx.Timeout(timeout_seconds, connect=min(timeout_seconds, 10.0))
+        client_params = {"api_key": api_key, "base_url": base_url or None, "timeout": timeout}
+        self.sync = openai.OpenAI(
+            http_client=httpx.Client(limits=limits, timeout=timeout),
+            **client_params
+        )
+        # Connections are opened on the event loop that first uses them
+        self.async_ = openai.AsyncOpenAI(
+            http_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+            **client_params
+        )
+
+    def chat_kwargs(self, max_retries: int = 2) -> Dict[str, Any]:
+        """Keyword arguments that make a ChatOpenAI use the shared clients"""
+        return {
+            "client": self.sync.with_options(max_retries=max_retries).chat.completions,
+            "async_client": self.async_.with_options(max_retries=max_retries).chat.completions,
+        }
+
+    def embeddings_kwargs(self, max_retries: int = 0) -> Dict[str, Any]:
+        """Keyword arguments that make an OpenAIEmbeddings use the shared clients"""
+        return {
+            "client": self.sync.with_options(max_retries=max_retries).embeddings,
+            "async_client": self.async_.with_options(max_retries=max_retries).embeddings,
+        }
+
+    def close(self) -> None:
+        """Close the sync pool; the async one is closed with its event loop"""
+        try:
+            self.sync.close()
+        except Exception as e:
+            logger.error(f"Error closing OpenAI client: {e}")
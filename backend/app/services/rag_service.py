@@ -1,82 +1,597 @@
-from typing import List, Dict, Any, Optional, Tuple, Union
+from typing import List, Dict, Any, Optional, Tuple, Union, Iterator, AsyncIterator, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import functools
+import hashlib
+import json
 import os
 import logging
-from langchain_community.document_loaders import (
-    PyPDFLoader, 
-    CSVLoader, 
-    TextLoader,
-    UnstructuredExcelLoader
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
+import uuid
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR as QA_PROMPT_SELECTOR
 from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
 from langchain.schema.messages import HumanMessage, AIMessage, SystemMessage
-import pandas as pd
+from langchain.memory.prompt import SUMMARY_PROMPT
 
 from app.core.config import settings
+from app.services.embedding_cache import EmbeddingCache, CachedEmbeddings
+from app.services.embedding_scheduler import EmbeddingScheduler
+from app.services.openai_clients import OpenAIClients
+from app.services.vectorstore_registry import vectorstore_registry
+from app.services.vector_stores import ChunkVectorStore
+from app.services.answer_cache import SemanticAnswerCache
+from app.services.retrievers import HybridRetriever, RerankingRetriever, ContextPackingRetriever, TableQueryRetriever
+from app.services.context_packer import ContextPacker
+from app.services.reranker import Reranker, MMRReranker, CrossEncoderReranker
+from app.services.document_stream import (
+    create_text_splitter, iter_file_documents, iter_split_documents, iter_batches,
+    is_table_file, iter_table_chunks, load_and_split_file
+)
+from app.services.dedup import FileHashRegistry, chunk_sha256
+from app.services.tabular import TableWriter, iter_table_frames, table_store
+from app.utils.file_utils import original_filename
+from app.utils.singleflight import AsyncSingleFlight
+from app.utils.timing import stage, timed_iter
+from app.utils.tokenizer import get_token_counter
+from app.utils.callbacks import TimedEmbeddings, stage_timing_callback, token_usage_callback
+from app.core.metrics import chunks_indexed, duplicate_chunks, chat_requests, condense_outcomes
+from app.utils.text_utils import is_standalone_question, question_similarity, CHARS_PER_TOKEN
 
 logger = logging.getLogger(__name__)
 
+# A (question, answer) turn, or a system message carrying the summary of older turns
+ChatTurn = Union[Tuple[str, str], SystemMessage]
+
+# Callbacks passed to every chain, retriever and LLM call for stage timings and token counts
+CALLBACKS = [stage_timing_callback, token_usage_callback]
+
+
 class RagService:
-    def __init__(self):
+    def __init__(self, embeddings: Optional[Embeddings] = None):
         self.openai_api_key = settings.OPENAI_API_KEY
-        self.embeddings = OpenAIEmbeddings(api_key=self.openai_api_key)
-        self.persist_directory = settings.VECTOR_DB_PATH
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+        self.openai_clients = OpenAIClients(
+            api_key=self.openai_api_key,
+            base_url=settings.OPENAI_BASE_URL,
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_seconds=settings.OPENAI_KEEPALIVE_SECONDS,
+            timeout_seconds=settings.OPENAI_TIMEOUT_SECONDS
         )
+        self.embedding_cache: Optional[EmbeddingCache] = None
+        self.embeddings = self._build_embeddings(embeddings)
+        self.persist_directory = settings.VECTOR_DB_PATH
+        self.text_splitter = create_text_splitter()
+        
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(
+                similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+                max_entries=settings.ANSWER_CACHE_MAX_ENTRIES
+            )
+        
+        self.file_registry: Optional[FileHashRegistry] = None
+        if settings.DEDUP_ENABLED:
+            self.file_registry = FileHashRegistry(
+                os.path.join(self.persist_directory, "dedup", "files.sqlite3")
+            )
         
         # Initialize LLM
         self.llm = ChatOpenAI(
             api_key=self.openai_api_key,
             model_name=settings.MODEL_NAME,
-            temperature=0.2
+            temperature=0.2,
+            **self.openai_clients.chat_kwargs()
+        )
+        
+        # Optional smaller model for rewriting follow-up questions
+        self.condense_llm: Optional[ChatOpenAI] = None
+        if settings.CONDENSE_MODEL_NAME:
+            self.condense_llm = ChatOpenAI(
+                api_key=self.openai_api_key,
+                model_name=settings.CONDENSE_MODEL_NAME,
+                temperature=0,
+                **self.openai_clients.chat_kwargs()
+            )
+        self._speculative_pool: Optional[ThreadPoolExecutor] = None
+        self._vector_pool: Optional[ThreadPoolExecutor] = None
+        self._cross_encoder: Optional[CrossEncoderReranker] = None
+        self._chat_flight = AsyncSingleFlight("chat", enabled=settings.SINGLE_FLIGHT_ENABLED)
+    
+    @property
+    def speculative_pool(self) -> ThreadPoolExecutor:
+        """Threads that retrieve for the raw question while it is being rewritten"""
+        if self._speculative_pool is None:
+            self._speculative_pool = ThreadPoolExecutor(
+                max_workers=settings.SPECULATIVE_RETRIEVAL_WORKERS,
+                thread_name_prefix="speculative"
+            )
+        return self._speculative_pool
+    
+    @property
+    def vector_pool(self) -> ThreadPoolExecutor:
+        """Threads that run blocking vector store work for async queries"""
+        if self._vector_pool is None:
+            self._vector_pool = ThreadPoolExecutor(
+                max_workers=settings.VECTOR_EXECUTOR_WORKERS,
+                thread_name_prefix="vector"
+            )
+        return self._vector_pool
+    
+    async def _run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """Run blocking vector store work in the vector pool, bounding how many threads it takes"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.vector_pool, functools.partial(func, *args, **kwargs))
+    
+    def shutdown(self) -> None:
+        """Stop the worker threads and close the OpenAI connection pool"""
+        for pool in (self._vector_pool, self._speculative_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self.embedding_scheduler.shutdown()
+        self.openai_clients.close()
+    
+    def _build_embeddings(self, embeddings: Optional[Embeddings] = None) -> Embeddings:
+        """Create the embedding function, wrapped in the on-disk cache if enabled"""
+        if embeddings is None:
+            embeddings = OpenAIEmbeddings(
+                api_key=self.openai_api_key,
+                model=settings.EMBEDDING_MODEL_NAME,
+                chunk_size=settings.EMBEDDING_BATCH_SIZE,
+                # Retries are handled per batch by the scheduler
+                max_retries=0,
+                **self.openai_clients.embeddings_kwargs(max_retries=0)
+            )
+        self.embedding_scheduler = EmbeddingScheduler(
+            TimedEmbeddings(embeddings),
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            requests_per_minute=settings.EMBEDDING_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.EMBEDDING_TOKENS_PER_MINUTE,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            retry_base_seconds=settings.EMBEDDING_RETRY_BASE_SECONDS,
+            retry_max_seconds=settings.EMBEDDING_RETRY_MAX_SECONDS,
+            coalesce=settings.SINGLE_FLIGHT_ENABLED
+        )
+        embeddings = self.embedding_scheduler
+        
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return embeddings
+        
+        self.embedding_cache = EmbeddingCache(
+            path=settings.EMBEDDING_CACHE_PATH,
+            model_name=settings.EMBEDDING_MODEL_NAME,
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
         )
+        return CachedEmbeddings(embeddings, self.embedding_cache)
     
     def process_file(self, file_path: str, file_type: str) -> List[Document]:
         """Process a file and return documents"""
-        try:
-            if file_type.lower().endswith('pdf'):
-                loader = PyPDFLoader(file_path)
-            elif file_type.lower().endswith('csv'):
-                loader = CSVLoader(file_path)
-            elif file_type.lower().endswith('txt'):
-                loader = TextLoader(file_path)
-            elif file_type.lower().endswith(('xls', 'xlsx')):
-                loader = UnstructuredExcelLoader(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_type}")
+        return load_and_split_file(file_path, file_type)
+    
+    def ingest_file(self, file_path: str, file_type: str, collection_name: str,
+                    file_hash: Optional[str] = None,
+                    on_progress: Optional[Callable[[int], None]] = None,
+                    split_executor: Optional[Executor] = None, split_window: int = 4) -> Dict[str, int]:
+        """
+        Stream a file into the vector store in bounded-size batches
+        
+        Pages/rows are read, split and embedded incrementally, so peak memory
+        depends on INGESTION_BATCH_SIZE rather than on the size of the file.
+        With a split_executor, text is split in it, up to split_window groups
+        of pages or blocks at once.
+        
+        Args:
+            file_path: Path to the file on disk
+            file_type: The file extension
+            collection_name: Collection to add the chunks to
+            file_hash: Content hash of the file, used to link identical uploads
+            on_progress: Called with the running chunk count after each batch
+            split_executor: Executor, e.g. a process pool, to split text in
+            split_window: Groups of pages or blocks split at once in split_executor
             
-            documents = loader.load()
-            logger.info(f"Loaded {len(documents)} documents from {file_path}")
+        Returns:
+            Dictionary with the number of chunks indexed and duplicates skipped,
+            and the IDs of the chunks that hold the file's content
+        """
+        tables = None
+        if is_table_file(file_type):
+            # Row blocks are already chunk-sized; the Parquet copy is written as the file is read
+            if file_hash and settings.TABULAR_PARQUET_ENABLED:
+                tables = table_store.writer(file_path, original_filename(file_path))
+            chunks = timed_iter(iter_table_chunks(file_path, file_type, tables), "parsing")
+        else:
+            chunks = iter_split_documents(
+                timed_iter(iter_file_documents(file_path, file_type), "parsing"),
+                self.text_splitter,
+                executor=split_executor,
+                window=split_window
+            )
+        with vectorstore_registry.pinned(collection_name):
+            stats = {"chunks": 0, "duplicate_chunks": 0, "chunk_ids": []}
+            try:
+                for batch in iter_batches(chunks, settings.INGESTION_BATCH_SIZE):
+                    batch_stats = self.add_file_chunks(batch, collection_name, file_hash, persist=False)
+                    stats["chunks"] += batch_stats["chunks"]
+                    stats["duplicate_chunks"] += batch_stats["duplicate_chunks"]
+                    stats["chunk_ids"] += batch_stats["chunk_ids"]
+                    if on_progress:
+                        on_progress(stats["chunks"])
+            except Exception:
+                if tables is not None:
+                    tables.discard()
+                raise
+            stats["chunk_ids"] = list(dict.fromkeys(stats["chunk_ids"]))
             
-            # Split documents
-            split_docs = self.text_splitter.split_documents(documents)
-            logger.info(f"Split into {len(split_docs)} chunks")
+            self._persist_indexes(collection_name)
+        if file_hash and self.file_registry is not None:
+            self.file_registry.register(file_hash, collection_name, stats["chunks"])
+        if tables is not None:
+            self._add_tables(collection_name, file_hash, tables)
+        
+        logger.info(
+            f"Streamed {stats['chunks']} chunks from {file_path} into collection {collection_name} "
+            f"({stats['duplicate_chunks']} duplicates skipped)"
+        )
+        return stats
+    
+    def add_file_chunks(self, documents: List[Document], collection_name: str,
+                        file_hash: Optional[str] = None, persist: bool = True) -> Dict[str, int]:
+        """
+        Add a file's chunks to a collection, skipping duplicate and near-duplicate chunks
+        
+        Returns:
+            Dictionary with the number of chunks indexed and duplicates skipped,
+            and the IDs of the chunks that hold the file's content. A skipped
+            duplicate is represented by the ID of the chunk it matched.
+        """
+        # Give every chunk an ID up front so skipped duplicates can point at the chunk they match
+        for doc in documents:
+            doc.metadata.setdefault("chunk_id", str(uuid.uuid4()))
+            if file_hash:
+                doc.metadata["file_hash"] = file_hash
+        
+        with vectorstore_registry.pinned(collection_name):
+            duplicate_of: List[str] = []
+            if settings.DEDUP_ENABLED:
+                deduplicator = vectorstore_registry.get_chunk_deduplicator(collection_name)
+                documents, duplicate_of, new_hashes = deduplicator.filter(documents)
+            
+            if documents:
+                self.create_or_update_vectorstore(documents, collection_name, save_lexical_index=False)
+            # Only once stored, so a batch that failed to embed isn't skipped as a duplicate when retried
+            if settings.DEDUP_ENABLED:
+                deduplicator.record(new_hashes)
+            chunks_indexed.inc(len(documents))
+            duplicate_chunks.inc(len(duplicate_of))
             
-            return split_docs
+            if persist:
+                self._persist_indexes(collection_name)
+                if file_hash and self.file_registry is not None:
+                    self.file_registry.register(file_hash, collection_name, len(documents))
         
-        except Exception as e:
-            logger.error(f"Error processing file {file_path}: {str(e)}")
+        chunk_ids = [doc.metadata["chunk_id"] for doc in documents] + [chunk_id for chunk_id in duplicate_of if chunk_id]
+        return {
+            "chunks": len(documents),
+            "duplicate_chunks": len(duplicate_of),
+            "chunk_ids": list(dict.fromkeys(chunk_ids))
+        }
+    
+    def _add_tables(self, collection_name: str, file_hash: str, tables: TableWriter) -> None:
+        """Make a file's stored tables available to aggregate questions"""
+        if table_store.add(collection_name, file_hash, tables) and self.answer_cache is not None:
+            self.answer_cache.invalidate(collection_name)
+    
+    def save_tables(self, file_path: str, file_type: str, collection_name: str, file_hash: str) -> None:
+        """Store the tables of an already indexed CSV or Excel file for aggregate questions"""
+        if not (is_table_file(file_type) and settings.TABULAR_PARQUET_ENABLED):
+            return
+        tables = table_store.writer(file_path, original_filename(file_path))
+        if tables is None:
+            return
+        try:
+            with stage("parsing"):
+                for sheet, frame in iter_table_frames(file_path, file_type, settings.TABULAR_READ_ROWS):
+                    tables.write(sheet, frame)
+        except Exception:
+            tables.discard()
             raise
+        self._add_tables(collection_name, file_hash, tables)
+    
+    def _persist_indexes(self, collection_name: str) -> None:
+        """Write the collection's lexical and dedup indexes to disk"""
+        vectorstore_registry.get_lexical_index(collection_name).save()
+        if settings.DEDUP_ENABLED:
+            vectorstore_registry.get_chunk_deduplicator(collection_name).save()
+    
+    def find_indexed_file(self, file_hash: str) -> Optional[str]:
+        """Get a collection that already holds the chunks of an identical file"""
+        if self.file_registry is None:
+            return None
+        return self.file_registry.find(file_hash)
+    
+    def link_file(self, file_hash: str, source_collection: str, target_collection: str) -> List[str]:
+        """
+        Copy an already indexed file's chunks and vectors into another collection
+        
+        Nothing is parsed or embedded; the stored vectors are reused.
+        
+        Returns:
+            IDs of the chunks copied
+        """
+        source = vectorstore_registry.get_vectorstore(source_collection, self.embeddings)
+        data = source.get_chunks(
+            where={"file_hash": file_hash},
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not data["ids"]:
+            return []
+        
+        chunk_ids = [str(uuid.uuid4()) for _ in data["ids"]]
+        metadatas = [dict(metadata, chunk_id=chunk_id) for metadata, chunk_id in zip(data["metadatas"], chunk_ids)]
+        
+        target = vectorstore_registry.get_vectorstore(target_collection, self.embeddings)
+        target.add_chunks(
+            ids=chunk_ids,
+            embeddings=data["embeddings"],
+            documents=data["documents"],
+            metadatas=metadatas
+        )
+        with vectorstore_registry.pinned(target_collection):
+            vectorstore_registry.get_lexical_index(target_collection).add(chunk_ids, data["documents"], metadatas)
+            if settings.DEDUP_ENABLED:
+                vectorstore_registry.get_chunk_deduplicator(target_collection).add(data["documents"], chunk_ids)
+            self._persist_indexes(target_collection)
+        
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(target_collection)
+        if self.file_registry is not None:
+            self.file_registry.register(file_hash, target_collection, len(chunk_ids))
+        if settings.TABULAR_PARQUET_ENABLED:
+            table_store.link_file(file_hash, source_collection, target_collection)
+        
+        logger.info(f"Linked {len(chunk_ids)} chunks from {source_collection} into {target_collection}")
+        return chunk_ids
+    
+    def delete_chunks(self, collection_name: str, chunk_ids: List[str]) -> None:
+        """Remove chunks from the vector store, lexical index and dedup index of a collection"""
+        if not chunk_ids:
+            return
+        vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+        vectorstore.delete(ids=chunk_ids)
+        with vectorstore_registry.pinned(collection_name):
+            vectorstore_registry.get_lexical_index(collection_name).delete(chunk_ids)
+            if settings.DEDUP_ENABLED:
+                vectorstore_registry.get_chunk_deduplicator(collection_name).remove(chunk_ids)
+            self._persist_indexes(collection_name)
+        
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(collection_name)
+        logger.info(f"Deleted {len(chunk_ids)} chunks from collection {collection_name}")
+    
+    def _file_chunk_ids(self, collection_name: str, file_info: Dict[str, Any]) -> List[str]:
+        """Get the IDs of a file's chunks, looking them up by file hash for files indexed before IDs were tracked"""
+        if file_info.get("chunk_ids") is not None:
+            return file_info["chunk_ids"]
+        if not file_info.get("hash"):
+            return []
+        vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+        return vectorstore.get_chunks(where={"file_hash": file_info["hash"]})["ids"]
+    
+    def _chunk_owners(self, files: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Map each chunk ID to a file that points to it"""
+        owners: Dict[str, Dict[str, Any]] = {}
+        for file_info in files:
+            for chunk_id in file_info.get("chunk_ids") or ():
+                owners.setdefault(chunk_id, file_info)
+        return owners
+    
+    def _update_chunk_metadatas(self, collection_name: str, chunk_ids: List[str],
+                                metadatas: List[Dict[str, Any]]) -> None:
+        """Replace chunk metadata in the vector store and the lexical index; the caller saves the index"""
+        vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+        vectorstore.update_metadatas(ids=chunk_ids, metadatas=metadatas)
+        vectorstore_registry.get_lexical_index(collection_name).update_metadatas(chunk_ids, metadatas)
+    
+    def _hand_over_chunks(self, collection_name: str, chunk_ids: List[str], file_hash: Optional[str],
+                          owners: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Re-point chunks that outlive the file they came from at another file that shares them
+        
+        Returns:
+            Whether any chunk was handed over
+        """
+        if not chunk_ids or not file_hash:
+            return False
+        vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+        data = vectorstore.get_chunks(ids=chunk_ids, include=["metadatas"])
+        moved = [
+            (chunk_id, metadata) for chunk_id, metadata in zip(data["ids"], data["metadatas"])
+            if metadata.get("file_hash") == file_hash
+        ]
+        if moved:
+            self._update_chunk_metadatas(
+                collection_name,
+                [chunk_id for chunk_id, _ in moved],
+                [
+                    dict(metadata, file_hash=owners[chunk_id]["hash"], source=owners[chunk_id]["path"])
+                    for chunk_id, metadata in moved
+                ]
+            )
+        return bool(moved)
+    
+    def delete_file(self, collection_name: str, file_info: Dict[str, Any],
+                    other_files: List[Dict[str, Any]]) -> int:
+        """
+        Remove a file's chunks from a collection
+        
+        Chunks that other files in the collection also point to, because
+        their copies were skipped as duplicates, are kept and handed over
+        to one of those files.
+        
+        Args:
+            collection_name: Collection holding the file
+            file_info: The session's record of the file
+            other_files: Records of the collection's remaining files
+            
+        Returns:
+            Number of chunks removed
+        """
+        owners = self._chunk_owners(other_files)
+        file_chunk_ids = self._file_chunk_ids(collection_name, file_info)
+        chunk_ids = [chunk_id for chunk_id in file_chunk_ids if chunk_id not in owners]
+        self.delete_chunks(collection_name, chunk_ids)
+        with vectorstore_registry.pinned(collection_name):
+            if self._hand_over_chunks(
+                collection_name,
+                [chunk_id for chunk_id in file_chunk_ids if chunk_id in owners],
+                file_info.get("hash"),
+                owners
+            ):
+                vectorstore_registry.get_lexical_index(collection_name).save()
+        if file_info.get("hash") and self.file_registry is not None:
+            self.file_registry.unregister(file_info["hash"], collection_name)
+        self._remove_tables(collection_name, file_info.get("hash"), other_files)
+        return len(chunk_ids)
+    
+    def _remove_tables(self, collection_name: str, file_hash: Optional[str],
+                       other_files: List[Dict[str, Any]]) -> None:
+        """Remove a file's stored tables unless another file in the collection has the same content"""
+        if file_hash and not any(f.get("hash") == file_hash for f in other_files):
+            table_store.remove_file(collection_name, file_hash)
+    
+    def replace_file(self, file_path: str, file_type: str, collection_name: str,
+                     old_file: Dict[str, Any], other_files: List[Dict[str, Any]],
+                     file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Re-index a new version of a file, embedding only the chunks that changed
+        
+        Chunks of the new version are matched to the old version's chunks by
+        content hash. Matching chunks keep their IDs and vectors; only new
+        chunks are embedded and only chunks that disappeared are deleted.
+        
+        Args:
+            file_path: Path to the new version on disk
+            file_type: The file extension
+            collection_name: Collection holding the file
+            old_file: The session's record of the old version
+            other_files: Records of the collection's remaining files
+            file_hash: Content hash of the new version
+            
+        Returns:
+            Dictionary with chunk counts and the IDs of the new version's chunks
+        """
+        documents = load_and_split_file(file_path, file_type)
+        vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+        old_ids = self._file_chunk_ids(collection_name, old_file)
+        old = {"ids": [], "documents": [], "metadatas": []}
+        if old_ids:
+            old = vectorstore.get_chunks(ids=old_ids, include=["documents", "metadatas"])
+        old_by_hash: Dict[str, List[int]] = {}
+        for i, text in enumerate(old["documents"]):
+            old_by_hash.setdefault(chunk_sha256(text), []).append(i)
+        
+        kept: List[int] = []
+        changed: List[Document] = []
+        for doc in documents:
+            matches = old_by_hash.get(chunk_sha256(doc.page_content))
+            if matches:
+                kept.append(matches.pop())
+            else:
+                changed.append(doc)
+        
+        with vectorstore_registry.pinned(collection_name):
+            # Delete stale chunks first so the dedup index doesn't mistake their edited versions for duplicates
+            owners = self._chunk_owners(other_files)
+            dropped = [old["ids"][i] for indexes in old_by_hash.values() for i in indexes]
+            stale = [chunk_id for chunk_id in dropped if chunk_id not in owners]
+            self.delete_chunks(collection_name, stale)
+            self._hand_over_chunks(
+                collection_name,
+                [chunk_id for chunk_id in dropped if chunk_id in owners],
+                old_file.get("hash"),
+                owners
+            )
+            
+            # Point the file's own unchanged chunks at the new version; chunks shared with other files stay theirs
+            kept_ids = [old["ids"][i] for i in kept]
+            owned = [i for i in kept if old["metadatas"][i].get("file_hash") == old_file.get("hash")]
+            if owned:
+                self._update_chunk_metadatas(
+                    collection_name,
+                    [old["ids"][i] for i in owned],
+                    [dict(old["metadatas"][i], file_hash=file_hash, source=file_path) for i in owned]
+                )
+            
+            stats = {"chunks": 0, "duplicate_chunks": 0, "chunk_ids": list(kept_ids)}
+            for batch in iter_batches(changed, settings.INGESTION_BATCH_SIZE):
+                batch_stats = self.add_file_chunks(batch, collection_name, file_hash, persist=False)
+                stats["chunks"] += batch_stats["chunks"]
+                stats["duplicate_chunks"] += batch_stats["duplicate_chunks"]
+                stats["chunk_ids"] += batch_stats["chunk_ids"]
+            stats["chunk_ids"] = list(dict.fromkeys(stats["chunk_ids"]))
+            self._persist_indexes(collection_name)
+        self._remove_tables(collection_name, old_file.get("hash"), other_files)
+        if file_hash:
+            self.save_tables(file_path, file_type, collection_name, file_hash)
+        
+        if self.file_registry is not None:
+            if old_file.get("hash"):
+                self.file_registry.unregister(old_file["hash"], collection_name)
+            if file_hash:
+                self.file_registry.register(file_hash, collection_name, len(stats["chunk_ids"]))
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(collection_name)
+        
+        stats.update(unchanged_chunks=len(kept_ids), removed_chunks=len(stale))
+        logger.info(
+            f"Replaced {old_file.get('name')} in collection {collection_name}: {len(kept_ids)} chunks unchanged, "
+            f"{stats['chunks']} embedded, {len(stale)} removed"
+        )
+        return stats
     
-    def create_or_update_vectorstore(self, documents: List[Document], collection_name: str) -> Chroma:
+    def drop_collection(self, collection_name: str) -> None:
+        """Delete a collection with its indexes, file registrations and cached answers"""
+        # Unregister first so new uploads stop linking chunks from this collection
+        if self.file_registry is not None:
+            self.file_registry.remove_collection(collection_name)
+        vectorstore_registry.drop(collection_name)
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(collection_name)
+        logger.info(f"Dropped collection {collection_name}")
+    
+    def create_or_update_vectorstore(self, documents: List[Document], collection_name: str,
+                                     save_lexical_index: bool = True) -> ChunkVectorStore:
         """Create or update a vector store with documents"""
         try:
-            # Check if collection exists
-            vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-                collection_name=collection_name
-            )
+            vectorstore = vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
+            
+            # Give every chunk an ID shared by the vector store and the BM25 index
+            chunk_ids = [doc.metadata.get("chunk_id") or str(uuid.uuid4()) for doc in documents]
+            for doc, chunk_id in zip(documents, chunk_ids):
+                doc.metadata["chunk_id"] = chunk_id
             
             # Add documents to the collection
-            vectorstore.add_documents(documents)
-            vectorstore.persist()
+            vectorstore.add_documents(documents, ids=chunk_ids)
+            
+            # Keep the lexical index in step with the vector store
+            lexical_index = vectorstore_registry.get_lexical_index(collection_name)
+            lexical_index.add(
+                chunk_ids,
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents]
+            )
+            if save_lexical_index:
+                lexical_index.save()
+            
+            # Cached answers may be stale now that the collection has changed
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate(collection_name)
             
             logger.info(f"Updated vector store for collection {collection_name}")
             return vectorstore
@@ -85,83 +600,631 @@ class RagService:
             logger.error(f"Error creating/updating vector store: {str(e)}")
             raise
     
-    def get_vectorstore(self, collection_name: str) -> Optional[Chroma]:
+    def get_vectorstore(self, collection_name: str) -> Optional[ChunkVectorStore]:
         """Get a vector store by collection name"""
         try:
-            vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-                collection_name=collection_name
-            )
-            return vectorstore
+            with stage("get_vectorstore"):
+                return vectorstore_registry.get_vectorstore(collection_name, self.embeddings)
         except Exception as e:
             logger.error(f"Error getting vector store: {str(e)}")
             return None
     
+    def get_retriever(self, collection_name: str):
+        """Get a cached retriever for the collection"""
+        vectorstore = self.get_vectorstore(collection_name)
+        if not vectorstore:
+            return None
+        return vectorstore_registry.get_chain(
+            collection_name,
+            ("retriever", settings.RETRIEVAL_MODE, settings.RERANK_MODE),
+            lambda: self._build_retriever(vectorstore, collection_name)
+        )
+    
+    def _build_retriever(self, vectorstore: ChunkVectorStore, collection_name: str):
+        """Build the retriever for the configured RETRIEVAL_MODE, wrapped in the reranker and table answers if enabled"""
+        reranker = self._build_reranker(vectorstore)
+        # With a token budget, every candidate is ranked and packing decides how many are sent
+        packing = settings.CONTEXT_TOKEN_BUDGET > 0
+        k = settings.RERANK_FETCH_K if reranker or packing else settings.RETRIEVAL_K
+        
+        if settings.RETRIEVAL_MODE == "hybrid":
+            retriever = HybridRetriever(
+                vectorstore=vectorstore,
+                get_lexical_index=lambda: vectorstore_registry.get_lexical_index(collection_name),
+                k=k,
+                fetch_k=max(settings.HYBRID_FETCH_K, k)
+            )
+        else:
+            retriever = vectorstore.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": k}
+            )
+        
+        if reranker is not None:
+            retriever = RerankingRetriever(
+                base_retriever=retriever,
+                reranker=reranker,
+                k=settings.RERANK_FETCH_K if packing else settings.RERANK_K,
+                budget_seconds=settings.RERANK_BUDGET_MS / 1000
+            )
+        if packing:
+            retriever = ContextPackingRetriever(
+                base_retriever=retriever,
+                packer=ContextPacker(
+                    token_budget=settings.CONTEXT_TOKEN_BUDGET,
+                    count_tokens=get_token_counter(settings.TOKENIZER_ENCODING),
+                    min_chunk_tokens=settings.CONTEXT_MIN_CHUNK_TOKENS
+                )
+            )
+        if settings.TABULAR_PARQUET_ENABLED:
+            retriever = TableQueryRetriever(
+                base_retriever=retriever,
+                answer_from_tables=lambda question: table_store.answer(collection_name, question)
+            )
+        return retriever
+    
+    def warm_up(self) -> None:
+        """Load what the first upload and question would otherwise wait for"""
+        if settings.VECTOR_BACKEND == "chroma":
+            vectorstore_registry.client
+        # Loaders are imported on first use; this imports all of them
+        import langchain_community.document_loaders
+        if settings.TEXT_SPLITTER == "tokens" or settings.CONTEXT_TOKEN_BUDGET > 0:
+            # Loading the tokenizer may download its encoding
+            get_token_counter(settings.TOKENIZER_ENCODING)
+        if settings.RERANK_MODE == "cross_encoder" and self._cross_encoder is None:
+            self._cross_encoder = CrossEncoderReranker(settings.RERANK_MODEL_NAME)
+    
+    def _build_reranker(self, vectorstore: ChunkVectorStore) -> Optional[Reranker]:
+        """Create the reranker for the configured RERANK_MODE"""
+        if settings.RERANK_MODE == "mmr":
+            # Keep BM25's contribution to the hybrid ranking. Without the embedding cache the
+            # question would be embedded a second time, so rank by retrieval order instead.
+            rank_weight = 0.5 if settings.RETRIEVAL_MODE == "hybrid" else 0.0
+            if self.embedding_cache is None:
+                rank_weight = 1.0
+            return MMRReranker(
+                vectorstore,
+                self.embeddings,
+                lambda_mult=settings.RERANK_MMR_LAMBDA,
+                duplicate_similarity=settings.RERANK_DUPLICATE_SIMILARITY,
+                rank_weight=rank_weight
+            )
+        if settings.RERANK_MODE == "cross_encoder":
+            # One model is shared by every collection
+            if self._cross_encoder is None:
+                self._cross_encoder = CrossEncoderReranker(settings.RERANK_MODEL_NAME)
+            return self._cross_encoder
+        return None
+    
+    def get_qa_chain(self, collection_name: str) -> Optional[ConversationalRetrievalChain]:
+        """Get a cached conversational retrieval chain for the collection"""
+        retriever = self.get_retriever(collection_name)
+        if not retriever:
+            return None
+        with stage("get_qa_chain"):
+            return vectorstore_registry.get_chain(
+                collection_name,
+                "qa_chain",
+                lambda: ConversationalRetrievalChain.from_llm(
+                    llm=self.llm,
+                    retriever=retriever,
+                    condense_question_llm=self.condense_llm,
+                    return_source_documents=True,
+                    verbose=True
+                )
+            )
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Get statistics for the embedding, vector store and chain caches"""
+        stats = vectorstore_registry.stats()
+        if self.embedding_cache is not None:
+            stats["embeddings"] = self.embedding_cache.stats()
+        if self.answer_cache is not None:
+            stats["answers"] = self.answer_cache.stats()
+        return stats
+    
+    def collect_metrics(self):
+        """Report cache statistics as metric families for the /metrics endpoint"""
+        stats = self.cache_stats()
+        yield "rag_cache_hits_total", "counter", "Cache lookups that hit", [
+            ({"cache": name}, cache["hits"]) for name, cache in stats.items()
+        ]
+        yield "rag_cache_misses_total", "counter", "Cache lookups that missed", [
+            ({"cache": name}, cache["misses"]) for name, cache in stats.items()
+        ]
+        yield "rag_cache_entries", "gauge", "Entries currently held by each cache", [
+            ({"cache": name}, cache.get("entries", cache.get("size", 0))) for name, cache in stats.items()
+        ]
+        
+        scheduler = self.embedding_scheduler.stats()
+        yield "rag_embedding_requests_total", "counter", "Embedding requests sent, including retries", [
+            ({}, scheduler["requests"])
+        ]
+        yield "rag_embedding_retries_total", "counter", "Embedding batches retried after a transient error", [
+            ({}, scheduler["retries"])
+        ]
+        yield "rag_embedding_failures_total", "counter", "Embedding batches that failed after all retries", [
+            ({}, scheduler["failures"])
+        ]
+        yield "rag_embedding_throttled_seconds_total", "counter", "Time embedding requests waited for the rate limiter", [
+            ({}, scheduler["throttled_seconds"])
+        ]
+    
+    def _lookup_cached_answer(self, query: str, collection_name: str,
+                              formatted_history: List[ChatTurn]) -> Tuple[Optional[List[float]], Optional[Tuple[str, List[Dict[str, Any]]]]]:
+        """
+        Look up a semantically similar answered question
+        
+        Follow-up questions depend on the conversation, so only questions
+        asked without prior history, or that look standalone, use the cache.
+        
+        Returns:
+            Tuple of (question embedding, cached (answer, sources) or None)
+        """
+        if self.answer_cache is None:
+            return None, None
+        if formatted_history and not is_standalone_question(query):
+            return None, None
+        
+        with stage("answer_cache_lookup"):
+            try:
+                question_vector = self.embeddings.embed_query(query)
+            except Exception as e:
+                logger.warning(f"Could not embed question for answer cache: {str(e)}")
+                return None, None
+            
+            return question_vector, self.answer_cache.lookup(collection_name, question_vector)
+    
+    def _format_chat_history(self, chat_history: List[Dict[str, Any]], history_summary: str = "") -> List[ChatTurn]:
+        """Pair up user and assistant messages into (question, answer) turns, after the summary if any"""
+        formatted_history = []
+        for message in chat_history:
+            if message["role"] == "user":
+                formatted_history.append(HumanMessage(content=message["content"]))
+            elif message["role"] == "assistant":
+                formatted_history.append(AIMessage(content=message["content"]))
+        
+        formatted_history_for_chain = []
+        for i, msg in enumerate(formatted_history):
+            if isinstance(msg, HumanMessage):
+                formatted_history_for_chain.append((msg.content, ""))
+                if i < len(formatted_history) - 1 and isinstance(formatted_history[i+1], AIMessage):
+                    formatted_history_for_chain[-1] = (msg.content, formatted_history[i+1].content)
+        
+        if history_summary:
+            summary = SystemMessage(content=f"Summary of the earlier conversation: {history_summary}")
+            formatted_history_for_chain.insert(0, summary)
+        return formatted_history_for_chain
+    
+    def summarize_history(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        """Fold chat messages into the running summary of a conversation"""
+        new_lines = "\n".join(
+            f"{'Human' if message['role'] == 'user' else 'AI'}: {message['content']}"
+            for message in messages
+        )
+        llm = self.condense_llm or self.llm
+        new_summary = llm.invoke(
+            SUMMARY_PROMPT.format(summary=summary, new_lines=new_lines),
+            config={"callbacks": CALLBACKS, "tags": ["summary"]}
+        ).content.strip()
+        # Keep the summary within its budget even if the model runs long
+        return new_summary[:settings.HISTORY_SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN]
+    
+    def _format_sources(self, documents: List[Document]) -> List[Dict[str, Any]]:
+        """Convert retrieved documents into source dictionaries for the API"""
+        return [
+            {
+                "content": doc.page_content,
+                "metadata": doc.metadata
+            }
+            for doc in documents
+        ]
+    
+    def _answer_messages(self, question: str, documents: List[Document]):
+        """Build the "stuff" prompt that answers the question from the documents"""
+        return QA_PROMPT_SELECTOR.get_prompt(self.llm).format_messages(
+            context="\n\n".join(doc.page_content for doc in documents),
+            question=question
+        )
+    
+    def _condense_strategy(self, query: str, formatted_history: List[ChatTurn]) -> Optional[str]:
+        """
+        Decide how to turn this turn's question into a standalone question
+        
+        In "heuristic" and "speculative" mode, questions that look standalone
+        are used as is instead of paying for an LLM rewrite.
+        
+        Returns:
+            None if the question can be used as is, otherwise "rewrite" or "speculative"
+        """
+        if not formatted_history:
+            return None
+        if settings.CONDENSE_MODE in ("heuristic", "speculative") and is_standalone_question(query):
+            condense_outcomes.inc(outcome="skipped")
+            return None
+        if settings.CONDENSE_MODE == "speculative":
+            return "speculative"
+        condense_outcomes.inc(outcome="rewritten")
+        return "rewrite"
+    
+    def _condense_prompt(self, query: str, formatted_history: List[ChatTurn]) -> str:
+        """Build the prompt that rewrites a follow-up question into a standalone question"""
+        return CONDENSE_QUESTION_PROMPT.format(
+            chat_history=_get_chat_history(formatted_history),
+            question=query
+        )
+    
+    def _condense_question(self, query: str, formatted_history: List[ChatTurn]) -> str:
+        """Rewrite a follow-up question into a standalone question"""
+        llm = self.condense_llm or self.llm
+        return llm.invoke(
+            self._condense_prompt(query, formatted_history),
+            config={"callbacks": CALLBACKS, "tags": ["condense"]}
+        ).content
+    
+    def _retrieve_for_turn(self, retriever, query: str, formatted_history: List[ChatTurn],
+                           strategy: Optional[str]) -> Tuple[str, List[Document]]:
+        """
+        Get the standalone question for this turn and the documents retrieved for it
+        
+        With the "speculative" strategy, retrieval for the raw question runs
+        while the LLM rewrites it. The speculative results are used if the
+        rewrite barely changed the question, otherwise retrieval is redone.
+        """
+        if strategy is None:
+            return query, retriever.get_relevant_documents(query, callbacks=CALLBACKS)
+        
+        if strategy == "rewrite":
+            question = self._condense_question(query, formatted_history)
+            return question, retriever.get_relevant_documents(question, callbacks=CALLBACKS)
+        
+        speculative = self.speculative_pool.submit(retriever.get_relevant_documents, query, callbacks=CALLBACKS)
+        question = self._condense_question(query, formatted_history)
+        if question_similarity(question, query) >= settings.SPECULATIVE_REUSE_SIMILARITY:
+            condense_outcomes.inc(outcome="speculative_hit")
+            return question, speculative.result()
+        
+        condense_outcomes.inc(outcome="speculative_miss")
+        speculative.cancel()
+        return question, retriever.get_relevant_documents(question, callbacks=CALLBACKS)
+    
     def query(self, 
               query: str, 
               collection_name: str, 
               chat_history: List[Dict[str, Any]],
-              use_web_search: bool = False) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+              use_web_search: bool = False,
+              history_summary: str = "") -> Tuple[str, Optional[List[Dict[str, Any]]]]:
         """Query the RAG system"""
         try:
-            # Format chat history for the model
-            formatted_history = []
-            for message in chat_history:
-                if message["role"] == "user":
-                    formatted_history.append(HumanMessage(content=message["content"]))
-                elif message["role"] == "assistant":
-                    formatted_history.append(AIMessage(content=message["content"]))
-            
-            # Get vector store
-            vectorstore = self.get_vectorstore(collection_name)
-            if not vectorstore:
+            # Get the cached RAG chain for this collection
+            qa_chain = self.get_qa_chain(collection_name)
+            if not qa_chain:
+                chat_requests.inc(source="no_documents")
                 return "I don't have any documents to search through yet. Please upload some files first.", None
             
-            # Create retriever
-            retriever = vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            )
-            
-            # Create RAG chain
-            qa_chain = ConversationalRetrievalChain.from_llm(
-                llm=self.llm,
-                retriever=retriever,
-                return_source_documents=True,
-                verbose=True
-            )
-            
             # Generate system message based on whether web search is enabled
             system_message = "You are a helpful assistant that answers questions based on the provided documents."
             if use_web_search:
                 system_message += " You also have access to web search for up-to-date information."
             
             # Prepare the formatted history for the chain
-            formatted_history_for_chain = []
-            for i, msg in enumerate(formatted_history):
-                if isinstance(msg, HumanMessage):
-                    formatted_history_for_chain.append((msg.content, ""))
-                    if i < len(formatted_history) - 1 and isinstance(formatted_history[i+1], AIMessage):
-                        formatted_history_for_chain[-1] = (msg.content, formatted_history[i+1].content)
+            formatted_history_for_chain = self._format_chat_history(chat_history, history_summary)
             
-            # Execute the chain
-            result = qa_chain(
-                {"question": query, "chat_history": formatted_history_for_chain},
+            # Serve repeated questions from the answer cache
+            question_vector, cached = self._lookup_cached_answer(
+                query, collection_name, formatted_history_for_chain
             )
+            if cached:
+                chat_requests.inc(source="cache")
+                return cached
+            
+            strategy = self._condense_strategy(query, formatted_history_for_chain)
+            if strategy == "speculative":
+                # The chain can't overlap retrieval with the rewrite, so run its steps directly
+                question, documents = self._retrieve_for_turn(
+                    self.get_retriever(collection_name), query, formatted_history_for_chain, strategy
+                )
+                answer = self.llm.invoke(
+                    self._answer_messages(question, documents),
+                    config={"callbacks": CALLBACKS, "tags": ["answer"]}
+                ).content
+            else:
+                # The chain only rewrites the question when it is given history
+                result = qa_chain(
+                    {"question": query, "chat_history": formatted_history_for_chain if strategy else []},
+                    callbacks=CALLBACKS
+                )
+                answer = result["answer"]
+                documents = result.get("source_documents", [])
             
             # Format sources
-            sources = []
-            if "source_documents" in result:
-                for doc in result["source_documents"]:
-                    source = {
-                        "content": doc.page_content,
-                        "metadata": doc.metadata
-                    }
-                    sources.append(source)
+            sources = self._format_sources(documents)
+            
+            if question_vector is not None:
+                self.answer_cache.store(collection_name, query, question_vector, answer, sources)
             
-            return result["answer"], sources
+            chat_requests.inc(source="llm")
+            return answer, sources
             
         except Exception as e:
+            chat_requests.inc(source="error")
             logger.error(f"Error querying RAG system: {str(e)}")
             return f"Sorry, an error occurred while processing your query: {str(e)}", None
+    
+    def stream_query(self,
+                     query: str,
+                     collection_name: str,
+                     chat_history: List[Dict[str, Any]],
+                     use_web_search: bool = False,
+                     history_summary: str = "") -> Iterator[Tuple[str, Any]]:
+        """
+        Query the RAG system, yielding results as they become available
+        
+        Mirrors the steps of ConversationalRetrievalChain (condense question,
+        retrieve, answer with the "stuff" prompt) so sources can be sent before
+        the LLM starts generating and answer tokens can be streamed.
+        
+        Yields:
+            ("sources", list of sources), then ("token", str) for each generated
+            token, then ("done", full answer). On failure yields ("error", message).
+        """
+        try:
+            retriever = self.get_retriever(collection_name)
+            if not retriever:
+                chat_requests.inc(source="no_documents")
+                yield "error", "I don't have any documents to search through yet. Please upload some files first."
+                return
+            
+            formatted_history_for_chain = self._format_chat_history(chat_history, history_summary)
+            
+            # Serve repeated questions from the answer cache
+            question_vector, cached = self._lookup_cached_answer(
+                query, collection_name, formatted_history_for_chain
+            )
+            if cached:
+                chat_requests.inc(source="cache")
+                answer, sources = cached
+                yield "sources", sources
+                yield "token", answer
+                yield "done", answer
+                return
+            
+            # Condense follow-up questions into a standalone question and retrieve for it
+            strategy = self._condense_strategy(query, formatted_history_for_chain)
+            question, documents = self._retrieve_for_turn(
+                retriever, query, formatted_history_for_chain, strategy
+            )
+            yield "sources", self._format_sources(documents)
+            
+            # Stream the answer
+            messages = self._answer_messages(question, documents)
+            answer_parts = []
+            for chunk in self.llm.stream(messages, config={"callbacks": CALLBACKS, "tags": ["answer"]}):
+                if chunk.content:
+                    answer_parts.append(chunk.content)
+                    yield "token", chunk.content
+            
+            answer = "".join(answer_parts)
+            if question_vector is not None:
+                self.answer_cache.store(
+                    collection_name, query, question_vector, answer, self._format_sources(documents)
+                )
+            
+            chat_requests.inc(source="llm")
+            yield "done", answer
+            
+        except Exception as e:
+            chat_requests.inc(source="error")
+            logger.error(f"Error streaming RAG query: {str(e)}")
+            yield "error", f"Sorry, an error occurred while processing your query: {str(e)}"
+    
+    async def _alookup_cached_answer(self, query: str, collection_name: str,
+                                     formatted_history: List[ChatTurn]) -> Tuple[Optional[List[float]], Optional[Tuple[str, List[Dict[str, Any]]]]]:
+        """Look up a semantically similar answered question, embedding it without blocking the event loop"""
+        if self.answer_cache is None:
+            return None, None
+        if formatted_history and not is_standalone_question(query):
+            return None, None
+        
+        with stage("answer_cache_lookup"):
+            try:
+                question_vector = await self.embeddings.aembed_query(query)
+            except Exception as e:
+                logger.warning(f"Could not embed question for answer cache: {str(e)}")
+                return None, None
+            
+            return question_vector, self.answer_cache.lookup(collection_name, question_vector)
+    
+    async def _acondense_question(self, query: str, formatted_history: List[ChatTurn]) -> str:
+        """Rewrite a follow-up question into a standalone question without blocking the event loop"""
+        llm = self.condense_llm or self.llm
+        result = await llm.ainvoke(
+            self._condense_prompt(query, formatted_history),
+            config={"callbacks": CALLBACKS, "tags": ["condense"]}
+        )
+        return result.content
+    
+    async def _aretrieve(self, retriever, question: str) -> List[Document]:
+        """
+        Retrieve documents for a question in the vector pool
+        
+        With the embedding cache enabled, the question is embedded on the
+        event loop first, so the retriever's own embedding is a cache hit
+        and the pool thread only does the search.
+        """
+        if self.embedding_cache is not None:
+            await self.embeddings.aembed_query(question)
+        return await self._run_blocking(retriever.get_relevant_documents, question, callbacks=CALLBACKS)
+    
+    async def _aretrieve_for_turn(self, retriever, query: str, formatted_history: List[ChatTurn],
+                                  strategy: Optional[str]) -> Tuple[str, List[Document]]:
+        """Async version of _retrieve_for_turn"""
+        if strategy is None:
+            return query, await self._aretrieve(retriever, query)
+        
+        if strategy == "rewrite":
+            question = await self._acondense_question(query, formatted_history)
+            return question, await self._aretrieve(retriever, question)
+        
+        speculative = asyncio.ensure_future(self._aretrieve(retriever, query))
+        try:
+            question = await self._acondense_question(query, formatted_history)
+        except BaseException:
+            speculative.cancel()
+            raise
+        if question_similarity(question, query) >= settings.SPECULATIVE_REUSE_SIMILARITY:
+            condense_outcomes.inc(outcome="speculative_hit")
+            return question, await speculative
+        
+        condense_outcomes.inc(outcome="speculative_miss")
+        speculative.cancel()
+        return question, await self._aretrieve(retriever, question)
+    
+    async def aquery(self,
+                     query: str,
+                     collection_name: str,
+                     chat_history: List[Dict[str, Any]],
+                     use_web_search: bool = False,
+                     history_summary: str = "") -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+        """
+        Query the RAG system without blocking the event loop
+        
+        Runs the same steps as stream_query. LLM and question embedding
+        calls are awaited on the shared connection pool and vector store
+        work runs in the bounded vector pool, so one worker can serve many
+        chats at once.
+        """
+        try:
+            retriever = await self._run_blocking(self.get_retriever, collection_name)
+            if not retriever:
+                chat_requests.inc(source="no_documents")
+                return "I don't have any documents to search through yet. Please upload some files first.", None
+            
+            formatted_history_for_chain = self._format_chat_history(chat_history, history_summary)
+            
+            # Serve repeated questions from the answer cache
+            question_vector, cached = await self._alookup_cached_answer(
+                query, collection_name, formatted_history_for_chain
+            )
+            if cached:
+                chat_requests.inc(source="cache")
+                return cached
+            
+            strategy = self._condense_strategy(query, formatted_history_for_chain)
+            question, documents = await self._aretrieve_for_turn(
+                retriever, query, formatted_history_for_chain, strategy
+            )
+            result = await self.llm.ainvoke(
+                self._answer_messages(question, documents),
+                config={"callbacks": CALLBACKS, "tags": ["answer"]}
+            )
+            answer = result.content
+            sources = self._format_sources(documents)
+            
+            if question_vector is not None:
+                self.answer_cache.store(collection_name, query, question_vector, answer, sources)
+            
+            chat_requests.inc(source="llm")
+            return answer, sources
+            
+        except Exception as e:
+            chat_requests.inc(source="error")
+            logger.error(f"Error querying RAG system: {str(e)}")
+            return f"Sorry, an error occurred while processing your query: {str(e)}", None
+    
+    async def aquery_coalesced(self,
+                               query: str,
+                               collection_name: str,
+                               chat_history: List[Dict[str, Any]],
+                               use_web_search: bool = False,
+                               history_summary: str = "",
+                               on_answer: Optional[Callable[[str, Optional[List[Dict[str, Any]]]], None]] = None
+                               ) -> Tuple[str, Optional[List[Dict[str, Any]]], bool]:
+        """
+        aquery, sharing the answer with an identical question already in flight
+        
+        Questions are identical when they are asked of the same collection
+        with the same history, e.g. a resubmitted form or a client retrying
+        after a timeout. Only the first is answered; the rest wait for it.
+        
+        Args:
+            on_answer: Called with the answer and sources once per shared
+                answer, even if the caller that asked first has gone away;
+                the callback of the first caller is the one used
+        
+        Returns:
+            Tuple of (answer, sources, whether the answer was shared)
+        """
+        async def answer() -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+            result = await self.aquery(query, collection_name, chat_history, use_web_search, history_summary)
+            if on_answer is not None:
+                on_answer(*result)
+            return result
+        
+        key = (collection_name, query, use_web_search, _history_fingerprint(chat_history, history_summary))
+        (answer_text, sources), shared = await self._chat_flight.do(key, answer)
+        return answer_text, sources, shared
+    
+    async def astream_query(self,
+                            query: str,
+                            collection_name: str,
+                            chat_history: List[Dict[str, Any]],
+                            use_web_search: bool = False,
+                            history_summary: str = "") -> AsyncIterator[Tuple[str, Any]]:
+        """Async version of stream_query, yielding the same events"""
+        try:
+            retriever = await self._run_blocking(self.get_retriever, collection_name)
+            if not retriever:
+                chat_requests.inc(source="no_documents")
+                yield "error", "I don't have any documents to search through yet. Please upload some files first."
+                return
+            
+            formatted_history_for_chain = self._format_chat_history(chat_history, history_summary)
+            
+            # Serve repeated questions from the answer cache
+            question_vector, cached = await self._alookup_cached_answer(
+                query, collection_name, formatted_history_for_chain
+            )
+            if cached:
+                chat_requests.inc(source="cache")
+                answer, sources = cached
+                yield "sources", sources
+                yield "token", answer
+                yield "done", answer
+                return
+            
+            # Condense follow-up questions into a standalone question and retrieve for it
+            strategy = self._condense_strategy(query, formatted_history_for_chain)
+            question, documents = await self._aretrieve_for_turn(
+                retriever, query, formatted_history_for_chain, strategy
+            )
+            yield "sources", self._format_sources(documents)
+            
+            # Stream the answer
+            messages = self._answer_messages(question, documents)
+            answer_parts = []
+            async for chunk in self.llm.astream(messages, config={"callbacks": CALLBACKS, "tags": ["answer"]}):
+                if chunk.content:
+                    answer_parts.append(chunk.content)
+                    yield "token", chunk.content
+            
+            answer = "".join(answer_parts)
+            if question_vector is not None:
+                self.answer_cache.store(
+                    collection_name, query, question_vector, answer, self._format_sources(documents)
+                )
+            
+            chat_requests.inc(source="llm")
+            yield "done", answer
+            
+        except Exception as e:
+            chat_requests.inc(source="error")
+            logger.error(f"Error streaming RAG query: {str(e)}")
+            yield "error", f"Sorry, an error occurred while processing your query: {str(e)}"
+
+
+def _history_fingerprint(chat_history: List[Dict[str, Any]], history_summary: str) -> str:
+    """Digest of the conversation a question is asked in"""
+    turns = [(message["role"], message["content"]) for message in chat_history]
+    return hashlib.sha256(json.dumps([history_summary, turns]).encode("utf-8")).hexdigest()
@@ -0,0 +1,175 @@
+from typing import List, Optional, Tuple
+import logging
+import time
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+from app.services.vector_stores import ChunkVectorStore
+
+logger = logging.getLogger(__name__)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query_vector: Optional[np.ndarray], vectors: np.ndarray, k: int, lambda_mult: float = 0.5,
+               relevance: Optional[np.ndarray] = None, duplicate_similarity: float = 1.0,
+               deadline: Optional[float] = None) -> Tuple[List[int], bool]:
+    """
+    Pick k candidates by maximal marginal relevance
+
+    Each step picks the candidate with the best trade-off between relevance
+    and its highest similarity to the candidates already picked. Candidates
+    at least duplicate_similarity similar to a picked one are dropped, so
+    fewer than k may be returned.
+
+    Args:
+        query_vector: Question embedding; unused when relevance is given
+        vectors: Candidate embeddings, one per row
+        k: Number of candidates to pick
+        lambda_mult: 1 ranks by relevance only, 0 by diversity only
+        relevance: Relevance of each candidate; defaults to cosine similarity to the question
+        duplicate_similarity: Cosine similarity above which a candidate counts as a duplicate
+        deadline: time.monotonic() value after which selection stops early
+
+    Returns:
+        Tuple of (picked indices, whether selection finished before the deadline)
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    if relevance is None:
+        relevance = vectors @ _normalize(np.asarray(query_vector, dtype=np.float32))
+    similarity = vectors @ vectors.T
+
+    available = np.ones(len(vectors), dtype=bool)
+    redundancy = np.zeros(len(vectors), dtype=np.float32)
+    selected: List[int] = []
+    while len(selected) < k and available.any():
+        if deadline is not None and time.monotonic() > deadline:
+            return selected, False
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = similarity[best] if len(selected) == 1 else np.maximum(redundancy, similarity[best])
+        available &= redundancy < duplicate_similarity
+    return selected, True
+
+
+class Reranker:
+    """Reorders retrieval candidates; subclasses implement rerank"""
+
+    def rerank(self, query: str, documents: List[Document], k: int,
+               deadline: float) -> Tuple[List[Document], bool]:
+        """
+        Pick the k best documents for the query
+
+        Work that would run past deadline (a time.monotonic() value) is
+        skipped and the remaining slots are filled in retrieval order.
+
+        Returns:
+            Tuple of (documents, whether reranking finished within the deadline)
+        """
+        raise NotImplementedError
+
+
+class MMRReranker(Reranker):
+    """
+    Drops overlapping chunks with maximal marginal relevance
+
+    Candidate vectors are read from the vector store rather than embedded
+    again. rank_weight blends the retriever's own ranking into relevance,
+    so matches found only by BM25 are not pushed out by their embeddings;
+    at 1 the question is not embedded at all.
+    """
+
+    def __init__(self, vectorstore: ChunkVectorStore, embeddings: Embeddings, lambda_mult: float = 0.5,
+                 duplicate_similarity: float = 0.95, rank_weight: float = 0.0):
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.lambda_mult = lambda_mult
+        self.duplicate_similarity = duplicate_similarity
+        self.rank_weight = rank_weight
+
+    def _vectors(self, documents: List[Document], deadline: float) -> Optional[np.ndarray]:
+        """
+        Get the stored vector of each document, embedding any the store doesn't have
+
+        Returns None if the deadline passes before the missing ones are embedded.
+        """
+        ids = [doc.metadata.get("chunk_id") for doc in documents]
+        stored = {}
+        known = [chunk_id for chunk_id in ids if chunk_id]
+        if known:
+            data = self.vectorstore.get_chunks(ids=known, include=["embeddings"])
+            stored = dict(zip(data["ids"], data["embeddings"]))
+
+        vectors = [stored.get(chunk_id) for chunk_id in ids]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            if time.monotonic() > deadline:
+                return None
+            embedded = self.embeddings.embed_documents([documents[i].page_content for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return np.array(vectors, dtype=np.float32)
+
+    def rerank(self, query: str, documents: List[Document], k: int,
+               deadline: float) -> Tuple[List[Document], bool]:
+        # Reading vectors and embedding the question cost more than the selection, so the
+        # deadline is checked around them too; past it, retrieval order is kept
+        if time.monotonic() > deadline:
+            return documents[:k], False
+        vectors = self._vectors(documents, deadline)
+        if vectors is None or time.monotonic() > deadline:
+            return documents[:k], False
+        relevance = 1 - np.arange(len(documents), dtype=np.float32) / len(documents)
+        if self.rank_weight < 1:
+            query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            if time.monotonic() > deadline:
+                return documents[:k], False
+            similarity = _normalize(vectors) @ _normalize(query_vector)
+            relevance = (1 - self.rank_weight) * similarity + self.rank_weight * relevance
+
+        selected, complete = mmr_select(
+            None, vectors, k, self.lambda_mult, relevance, self.duplicate_similarity, deadline
+        )
+        ranked = [documents[i] for i in selected]
+        if not complete:
+            picked = set(selected)
+            ranked += [doc for i, doc in enumerate(documents) if i not in picked][:k - len(ranked)]
+        return ranked, complete
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Scores each (question, chunk) pair with a local cross-encoder model
+
+    Needs the sentence-transformers package. Candidates are scored in
+    batches until the deadline; unscored ones follow the scored ones in
+    retrieval order.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 8):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("RERANK_MODE=cross_encoder requires the sentence-transformers package") from e
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+
+    def rerank(self, query: str, documents: List[Document], k: int,
+               deadline: float) -> Tuple[List[Document], bool]:
+        scores: List[float] = []
+        for start in range(0, len(documents), self.batch_size):
+            if time.monotonic() > deadline:
+                break
+            batch = documents[start:start + self.batch_size]
+            scores.extend(self.model.predict([(query, doc.page_content) for doc in batch]))
+
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        ranked = [documents[i] for i in order] + documents[len(scores):]
+        return ranked[:k], len(scores) == len(documents)
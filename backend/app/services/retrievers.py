@@ -0,0 +1,151 @@
+from typing import List, Dict, Any, Callable, Optional
+import logging
+import time
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import Document
+from langchain.schema.retriever import BaseRetriever
+from langchain.schema.vectorstore import VectorStore
+
+from app.services.bm25_index import BM25Index
+from app.services.context_packer import ContextPacker
+from app.services.reranker import Reranker
+from app.core.metrics import context_tokens, rerank_outcomes
+from app.utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+def document_key(doc: Document) -> str:
+    """Identify a chunk across retrievers by its chunk ID, falling back to its text"""
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """
+    Merge several rankings of documents with reciprocal rank fusion
+
+    Args:
+        rankings: Ranked document lists, best first
+        k: Number of documents to return
+        rrf_k: Damping constant; larger values flatten the contribution of top ranks
+
+    Returns:
+        The top k documents by fused score
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retriever that fuses vector similarity and BM25 rankings"""
+
+    vectorstore: VectorStore
+    # Looked up per query so the retriever always sees the live index
+    get_lexical_index: Callable[[], BM25Index]
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector_docs = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        lexical_index = self.get_lexical_index()
+        lexical_docs = lexical_index.get_documents(lexical_index.search(query, self.fetch_k))
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], self.k, self.rrf_k)
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Retriever that reranks a wider candidate set from another retriever
+
+    The base retriever should fetch more candidates than k. Reranking gets
+    budget_seconds; past that, the remaining slots keep retrieval order, so
+    a slow reranker can't hold up the answer.
+    """
+
+    base_retriever: BaseRetriever
+    reranker: Reranker
+    k: int = 4
+    budget_seconds: float = 0.05
+    # The base retriever reports the search itself; this tag keeps the wrapper out of the search timings
+    tags: Optional[List[str]] = ["rerank"]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        if len(candidates) <= 1:
+            return candidates
+
+        with stage("rerank"):
+            deadline = time.monotonic() + self.budget_seconds
+            try:
+                documents, complete = self.reranker.rerank(query, candidates, self.k, deadline)
+            except Exception as e:
+                logger.warning(f"Reranking failed, keeping retrieval order: {str(e)}")
+                rerank_outcomes.inc(outcome="error")
+                return candidates[:self.k]
+
+        rerank_outcomes.inc(outcome="complete" if complete else "over_budget")
+        return documents
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """Retriever that packs the base retriever's ranked results into a token budget"""
+
+    base_retriever: BaseRetriever
+    packer: ContextPacker
+    tags: Optional[List[str]] = ["context_packing"]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
+        with stage("context_packing"):
+            documents = self.packer.pack(candidates)
+            context_tokens.observe(sum(self.packer.count_tokens(doc.page_content) for doc in documents))
+        return documents
+
+
+class TableQueryRetriever(BaseRetriever):
+    """
+    Retriever that answers aggregate questions from stored tables
+
+    answer_from_tables returns a document holding the computed result, or
+    None if the question isn't one a columnar query can answer, in which
+    case the base retriever runs as usual.
+    """
+
+    base_retriever: BaseRetriever
+    answer_from_tables: Callable[[str], Optional[Document]]
+    tags: Optional[List[str]] = ["table_query"]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with stage("table_query"):
+            document = self.answer_from_tables(query)
+        if document is not None:
+            return [document]
+        return self.base_retriever.get_relevant_documents(query, callbacks=run_manager.get_child())
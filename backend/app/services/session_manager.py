@@ -3,18 +3,23 @@ from itsdangerous import URLSafeSerializer
 from fastapi import Cookie, Request, Response
 import json
 import logging
+import threading
 
 from app.models.session import UserSession
+from app.services.session_store import SessionStore, create_session_store
 from app.core.config import settings
+from app.core.metrics import sessions_created
+from app.utils.timing import stage
 
 logger = logging.getLogger(__name__)
 
 class SessionManager:
-    def __init__(self):
+    def __init__(self, store: Optional[SessionStore] = None):
         self.secret_key = settings.SECRET_KEY
         self.cookie_name = settings.SESSION_COOKIE_NAME
         self.serializer = URLSafeSerializer(self.secret_key)
-        self.sessions: Dict[str, UserSession] = {}
+        self.store = store or create_session_store()
+        self._update_lock = threading.Lock()
     
     def get_session(self, request: Request) -> UserSession:
         """Get the current session or create a new one"""
@@ -24,17 +29,28 @@ class SessionManager:
         if session_cookie:
             try:
                 session_id = self.serializer.loads(session_cookie)
-                if session_id in self.sessions:
-                    return self.sessions[session_id]
+                with stage("session_load"):
+                    session = self.store.load(session_id)
+                if session is not None:
+                    # Any request keeps the session alive, not just ones that change it
+                    session.touch()
+                    self.store.touch(session)
+                    return session
                 logger.warning(f"Session ID {session_id} found in cookie but not in sessions")
             except Exception as e:
                 logger.error(f"Error deserializing session cookie: {e}")
         
         # Create new session if no valid session found
         new_session = UserSession()
-        self.sessions[new_session.session_id] = new_session
+        self.store.save(new_session)
+        sessions_created.inc()
         return new_session
     
+    def save_session(self, session: UserSession) -> None:
+        """Persist changes to the session's metadata"""
+        with stage("session_save"):
+            self.store.save(session)
+    
     def set_session_cookie(self, response: Response, session: UserSession) -> None:
         """Set the session cookie in the response"""
         session_cookie = self.serializer.dumps(session.session_id)
@@ -42,23 +58,57 @@ class SessionManager:
             key=self.cookie_name,
             value=session_cookie,
             httponly=True,
-            max_age=86400 * 7,  # 7 days
+            max_age=settings.SESSION_TTL_SECONDS,
             samesite="lax"
         )
     
     def get_session_files(self, session: UserSession) -> List[Dict[str, Any]]:
-        """Get files associated with the session"""
-        return session.get_files()
+        """Get files associated with the session, with chunk counts instead of chunk IDs"""
+        return [
+            dict(
+                {key: value for key, value in f.items() if key != "chunk_ids"},
+                chunks=len(f["chunk_ids"]) if f.get("chunk_ids") is not None else None
+            )
+            for f in session.get_files()
+        ]
     
     def add_file_to_session(self, session: UserSession, filename: str, file_path: str, 
-                           file_type: str, file_size: int) -> None:
-        """Add a file to the session"""
-        session.add_file(filename, file_path, file_type, file_size)
+                           file_type: str, file_size: int, file_hash: Optional[str] = None,
+                           file_id: Optional[str] = None, chunk_ids: Optional[List[str]] = None) -> None:
+        """Add a file to the session, replacing the file with the same ID if any"""
+        with self._update_lock:
+            # Apply the change to the latest stored copy so concurrent updates don't overwrite each other
+            latest = self.store.load(session.session_id) or session
+            latest.add_file(filename, file_path, file_type, file_size, file_hash, file_id, chunk_ids)
+            self.store.save(latest)
+            if latest is not session:
+                session.uploaded_files = latest.uploaded_files
+    
+    def remove_file_from_session(self, session: UserSession, file_id: str) -> None:
+        """Remove a file from the session"""
+        with self._update_lock:
+            latest = self.store.load(session.session_id) or session
+            latest.remove_file(file_id)
+            self.store.save(latest)
+            if latest is not session:
+                session.uploaded_files = latest.uploaded_files
+    
+    def update_history_summary(self, session: UserSession, summary: str, summarized_until: str) -> None:
+        """Store a new running summary of the session's older chat turns"""
+        with self._update_lock:
+            latest = self.store.load(session.session_id) or session
+            latest.set_history_summary(summary, summarized_until)
+            self.store.save(latest)
+            if latest is not session:
+                session.set_history_summary(summary, summarized_until)
     
     def add_chat_message(self, session: UserSession, role: str, content: str, 
                          metadata: Optional[Dict[str, Any]] = None) -> None:
         """Add a chat message to the session history"""
-        session.add_chat_message(role, content, metadata)
-
-# Global session manager instance
-session_manager = SessionManager()
+        message = session.add_chat_message(role, content, metadata)
+        with stage("session_save"):
+            self.store.append_message(session, message)
+    
+    def close(self) -> None:
+        """Flush pending session writes"""
+        self.store.close()
@@ -0,0 +1,286 @@
+from typing import Dict, Optional, List, Any, Tuple
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from app.models.session import UserSession
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(ABC):
+    """Backend that persists user sessions and their chat history"""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    def is_expired(self, last_active: datetime) -> bool:
+        return last_active < datetime.now() - timedelta(seconds=self.ttl_seconds)
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[UserSession]:
+        """Load a session, returning None if it doesn't exist or has expired"""
+
+    @abstractmethod
+    def save(self, session: UserSession) -> None:
+        """Persist session metadata (files, collection, timestamps)"""
+
+    @abstractmethod
+    def append_message(self, session: UserSession, message: Dict[str, Any]) -> None:
+        """Persist a new chat message for the session"""
+
+    def touch(self, session: UserSession) -> None:
+        """Persist a new last_active time for the session, possibly later"""
+        self.save(session)
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Remove a session and its chat history"""
+
+    @abstractmethod
+    def expired_sessions(self) -> List[UserSession]:
+        """Get all sessions that are past their TTL"""
+
+    @abstractmethod
+    def active_sessions(self) -> List[UserSession]:
+        """Get the metadata of all sessions within their TTL, without chat history"""
+
+    def flush(self) -> None:
+        """Write any buffered changes"""
+
+    def close(self) -> None:
+        """Flush and release resources"""
+        self.flush()
+
+
+class MemorySessionStore(SessionStore):
+    """In-process session store, only suitable for a single worker"""
+
+    def __init__(self, ttl_seconds: int):
+        super().__init__(ttl_seconds)
+        self.sessions: Dict[str, UserSession] = {}
+
+    def load(self, session_id: str) -> Optional[UserSession]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if self.is_expired(session.last_active):
+            return None
+        return session
+
+    def save(self, session: UserSession) -> None:
+        self.sessions[session.session_id] = session
+
+    def append_message(self, session: UserSession, message: Dict[str, Any]) -> None:
+        # The session object itself holds the history
+        pass
+
+    def delete(self, session_id: str) -> None:
+        self.sessions.pop(session_id, None)
+
+    def expired_sessions(self) -> List[UserSession]:
+        return [s for s in list(self.sessions.values()) if self.is_expired(s.last_active)]
+
+    def active_sessions(self) -> List[UserSession]:
+        return [s for s in list(self.sessions.values()) if not self.is_expired(s.last_active)]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite-backed session store that can be shared by several workers
+
+    Chat messages are buffered and written in batches by a background thread
+    (write-behind), and chat history is only read when a request needs it.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, batch_size: int, flush_interval: float):
+        super().__init__(ttl_seconds)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = self._connect()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_active TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+            """
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        # Batches are written on their own connection so a flush doesn't hold up reads
+        self._flush_conn = self._connect()
+        self._flush_lock = threading.Lock()
+
+        self._pending_messages: List[Tuple[str, str]] = []
+        self._pending_touches: Dict[str, str] = {}
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-write-behind", daemon=True)
+        self._flusher.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, session_id: str) -> Optional[UserSession]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        session = UserSession.from_dict(
+            json.loads(row[0]),
+            history_loader=lambda limit=None: self.load_chat_history(session_id, limit)
+        )
+        with self._pending_lock:
+            if session_id in self._pending_touches:
+                session.last_active = datetime.fromisoformat(self._pending_touches[session_id])
+        if self.is_expired(session.last_active):
+            return None
+        return session
+
+    def load_chat_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Read the chat history of a session, or only its last `limit` messages"""
+        # Make sure this worker's buffered messages are visible
+        self.flush()
+        with self._db_lock:
+            if limit is None:
+                rows = self._conn.execute(
+                    "SELECT message FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, limit)
+                ).fetchall()
+                rows.reverse()
+        return [json.loads(row[0]) for row in rows]
+
+    def save(self, session: UserSession) -> None:
+        data = session.metadata_dict()
+        with self._pending_lock:
+            self._pending_touches.pop(session.session_id, None)
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, last_active, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_active = excluded.last_active, data = excluded.data",
+                (session.session_id, data["last_active"], json.dumps(data))
+            )
+            self._conn.commit()
+
+    def append_message(self, session: UserSession, message: Dict[str, Any]) -> None:
+        with self._pending_lock:
+            self._pending_messages.append((session.session_id, json.dumps(message)))
+            self._pending_touches[session.session_id] = session.last_active.isoformat()
+            should_flush = len(self._pending_messages) >= self.batch_size
+        if should_flush:
+            self._wake.set()
+
+    def touch(self, session: UserSession) -> None:
+        # Written with the next batch of messages; load() already sees it
+        with self._pending_lock:
+            self._pending_touches[session.session_id] = session.last_active.isoformat()
+
+    def delete(self, session_id: str) -> None:
+        self.flush()
+        with self._db_lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def expired_sessions(self) -> List[UserSession]:
+        return self._sessions_where("last_active < ?")
+
+    def active_sessions(self) -> List[UserSession]:
+        return self._sessions_where("last_active >= ?")
+
+    def _sessions_where(self, condition: str) -> List[UserSession]:
+        """Get session metadata matching a condition on the TTL cutoff"""
+        self.flush()
+        cutoff = (datetime.now() - timedelta(seconds=self.ttl_seconds)).isoformat()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM sessions WHERE {condition}", (cutoff,)
+            ).fetchall()
+        return [
+            UserSession.from_dict(json.loads(row[0]), history_loader=lambda limit=None: [])
+            for row in rows
+        ]
+
+    def flush(self) -> None:
+        # Held while writing, so a caller that finds nothing pending still waits for
+        # a batch the flusher thread has taken but not yet committed
+        with self._flush_lock:
+            with self._pending_lock:
+                messages, self._pending_messages = self._pending_messages, []
+                touches, self._pending_touches = self._pending_touches, {}
+            if not messages and not touches:
+                return
+
+            self._flush_conn.executemany(
+                "INSERT INTO messages (session_id, message) VALUES (?, ?)", messages
+            )
+            # Keep last_active in sync without rewriting the whole session row
+            self._flush_conn.executemany(
+                "UPDATE sessions SET last_active = ?, "
+                "data = json_set(data, '$.last_active', ?) WHERE session_id = ?",
+                [(last_active, last_active, session_id) for session_id, last_active in touches.items()]
+            )
+            self._flush_conn.commit()
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing session writes: {e}")
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._flush_lock:
+            self._flush_conn.close()
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_session_store() -> SessionStore:
+    """Create the session store configured by SESSION_BACKEND"""
+    if settings.SESSION_BACKEND == "memory":
+        return MemorySessionStore(ttl_seconds=settings.SESSION_TTL_SECONDS)
+    if settings.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(
+            path=settings.SESSION_DB_PATH,
+            ttl_seconds=settings.SESSION_TTL_SECONDS,
+            batch_size=settings.SESSION_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=settings.SESSION_WRITE_BEHIND_INTERVAL_SECONDS
+        )
+    raise ValueError(f"Unsupported session backend: {settings.SESSION_BACKEND}")
@@ -0,0 +1,515 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+from langchain.schema import Document
+
+from app.core.config import settings
+from app.core.metrics import table_queries
+
+logger = logging.getLogger(__name__)
+
+TABULAR_TYPES = ("csv", "xls", "xlsx")
+MANIFEST_FILE = "tables.json"
+
+# Words that may appear in an aggregate question besides the operation, columns and table name.
+# Anything else (a region name, a year, ...) probably narrows the question down, which the
+# columnar query can't do, so such questions are left to retrieval.
+_QUESTION_WORDS = set("""
+    a all an and are across as at by calculate column columns compute count csv data dataset did
+    distinct do does different each entire every file for from get give how i in is it its
+    list many me much number of on overall per please records rows sheet show spreadsheet xls xlsx
+    sum table tell than that the their there this to total unique value values was we were
+    s what whats which whole with would you
+    average avg mean minimum min lowest smallest maximum max highest largest biggest
+""".split())
+
+_OPERATIONS = [
+    # (operation, pattern), checked in order
+    ("count", re.compile(r"\bhow many (?:rows|records|entries|lines)\b|\b(?:number|count) of (?:rows|records|entries|lines)\b")),
+    ("nunique", re.compile(r"\bhow many (?:distinct|unique|different)\b|\bnumber of (?:distinct|unique|different)\b")),
+    ("mean", re.compile(r"\b(?:average|avg|mean)\b")),
+    ("sum", re.compile(r"\b(?:total|sum)\b")),
+    ("min", re.compile(r"\b(?:minimum|min|lowest|smallest)\b")),
+    ("max", re.compile(r"\b(?:maximum|max|highest|largest|biggest)\b")),
+    ("count", re.compile(r"\bhow many\b")),
+]
+_GROUP_RE = re.compile(r"\b(?:by|per|for each|for every|in each|across)\s+(?:the\s+)?(.+)")
+_LABELS = {"count": "number of rows", "nunique": "number of distinct values of", "mean": "average",
+           "sum": "total", "min": "minimum", "max": "maximum"}
+
+
+def is_tabular(file_type: str) -> bool:
+    """Whether a file type is read as a table"""
+    return file_type.lower().lstrip(".") in TABULAR_TYPES
+
+
+def _normalize_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """Give columns unique string names and store mixed or text columns as strings"""
+    names: List[str] = []
+    for i, column in enumerate(frame.columns):
+        name = str(column).strip() or f"column {i + 1}"
+        if name in names:
+            name = f"{name} {i + 1}"
+        names.append(name)
+    frame.columns = names
+    for name in names:
+        if frame[name].dtype == object:
+            frame[name] = frame[name].astype("string")
+    return frame
+
+
+def iter_table_frames(file_path: str, file_type: str, read_rows: int = 50000) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Yield a file's tables as (sheet name, DataFrame) pairs
+
+    CSVs are read read_rows rows at a time; every chunk has the columns and
+    dtypes of the first one. Workbooks are read a sheet at a time, and CSVs
+    have an empty sheet name.
+    """
+    file_type = file_type.lower()
+    if file_type.endswith("csv"):
+        dtypes: Optional[pd.Series] = None
+        reader = pd.read_csv(file_path, chunksize=read_rows, dtype_backend="numpy_nullable",
+                             encoding_errors="replace", skipinitialspace=True)
+        with reader:
+            for frame in reader:
+                frame = _normalize_frame(frame)
+                if dtypes is None:
+                    # Later chunks may hold decimals in a column that started out whole numbers
+                    frame = frame.astype({
+                        name: "Float64" for name, dtype in frame.dtypes.items() if pd.api.types.is_integer_dtype(dtype)
+                    })
+                    dtypes = frame.dtypes
+                else:
+                    frame = _conform(frame, dtypes)
+                yield "", frame
+    else:
+        for sheet, frame in pd.read_excel(file_path, sheet_name=None, dtype_backend="numpy_nullable").items():
+            frame = _normalize_frame(frame.dropna(how="all"))
+            if len(frame.columns):
+                yield str(sheet), frame
+
+
+def _conform(frame: pd.DataFrame, dtypes: pd.Series) -> pd.DataFrame:
+    """Cast a chunk to the dtypes of the first chunk; values that don't fit become missing"""
+    frame = frame.reindex(columns=dtypes.index)
+    for name, dtype in dtypes.items():
+        column = frame[name]
+        if column.dtype == dtype:
+            continue
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            frame[name] = pd.to_numeric(column, errors="coerce").astype(dtype)
+        elif pd.api.types.is_bool_dtype(dtype):
+            frame[name] = column.astype("string").str.lower().map({"true": True, "false": False}).astype(dtype)
+        else:
+            frame[name] = column.astype(dtype)
+    return frame
+
+
+def _type_name(dtype: Any) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "yes/no"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "date"
+    return "text"
+
+
+def _row_lines(frame: pd.DataFrame, max_chars: int) -> np.ndarray:
+    """Format every row as "value | value | ..." with whole-column string operations"""
+    lines = None
+    for name in frame.columns:
+        cells = frame[name].astype("string").fillna("").str.replace(r"\s+", " ", regex=True)
+        if pd.api.types.is_float_dtype(frame[name].dtype):
+            # Whole-number columns are stored as floats (see iter_table_frames)
+            cells = cells.str.replace(r"\.0$", "", regex=True)
+        lines = cells if lines is None else lines + " | " + cells
+    return lines.str.slice(0, max_chars).to_numpy(dtype=object)
+
+
+def _block_bounds(lines: np.ndarray, budget: int, max_rows: int) -> np.ndarray:
+    """
+    Choose where blocks of rows end, returning each block's end row
+
+    Block ends are picked by a hash of the row, so they move with the
+    content: inserting or editing a row changes only the block holding it,
+    and an unchanged block keeps its text (and its stored vector) when a new
+    version of the table is uploaded. Blocks are also cut at budget
+    characters and max_rows rows.
+    """
+    lengths = np.fromiter((len(line) + 1 for line in lines), dtype=np.int64, count=len(lines))
+    target_rows = int(min(max_rows, max(1, budget // (2 * lengths.mean()))))
+    hashes = pd.util.hash_array(lines).astype(np.uint64)
+    content_end = (hashes % np.uint64(target_rows)) == 0
+
+    # Position of every row within its content-defined segment, in rows and in characters
+    segment = np.r_[0, np.cumsum(content_end[:-1])]
+    starts = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+    ends = np.cumsum(lengths)
+    start_chars = (ends - lengths)[starts][segment]
+    row_in_segment = np.arange(len(lines)) - starts[segment]
+    # Split long segments by size, then by row count
+    key = segment * (len(lines) + 1) + np.maximum((ends - lengths - start_chars) // budget, row_in_segment // max_rows)
+    return np.r_[np.flatnonzero(key[1:] != key[:-1]) + 1, len(lines)]
+
+
+def iter_table_blocks(file_path: str, file_type: str, name: str, block_chars: int = 4000,
+                      block_rows: int = 200, read_rows: int = 50000,
+                      writer: Optional["TableWriter"] = None) -> Iterator[Document]:
+    """
+    Yield a file's rows grouped into blocks of up to block_chars characters
+
+    Each block starts with the table's name and its column names and types,
+    so every block reads as a small table on its own; the rows a block holds
+    are in its metadata. Blocks are meant to be embedded as they are,
+    without further splitting. If a writer is given, every table is also
+    written to it.
+    """
+    rows_seen: Dict[str, int] = {}
+    for sheet, frame in iter_table_frames(file_path, file_type, read_rows):
+        if writer is not None:
+            writer.write(sheet, frame)
+        offset = rows_seen.get(sheet, 0)
+        rows_seen[sheet] = offset + len(frame)
+        if not len(frame):
+            continue
+
+        title = f"{name}, sheet {sheet}" if sheet else name
+        schema = ", ".join(f"{column} ({_type_name(dtype)})" for column, dtype in frame.dtypes.items())
+        header = f"Table: {title}\nColumns: {schema}\n{' | '.join(frame.columns)}\n"
+        budget = max(200, block_chars - len(header))
+
+        lines = _row_lines(frame, budget)
+        start = 0
+        # Only the rows of one block are joined at a time
+        for end in _block_bounds(lines, budget, block_rows):
+            metadata = {"source": file_path, "row_start": offset + int(start) + 1, "row_end": offset + int(end)}
+            if sheet:
+                metadata["sheet"] = sheet
+            yield Document(page_content=header + "\n".join(lines[start:end]), metadata=metadata)
+            start = end
+
+
+class TableWriter:
+    """Writes the tables of one file to Parquet files in a staging directory"""
+
+    def __init__(self, staging_dir: str, source: str, name: str):
+        import pyarrow.parquet as pq
+
+        self._pq = pq
+        self.staging_dir = staging_dir
+        self.source = source
+        self.name = name
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self._writers: Dict[str, Any] = {}
+
+    def write(self, sheet: str, frame: pd.DataFrame) -> None:
+        import pyarrow as pa
+
+        table = self.tables.get(sheet)
+        if table is None:
+            os.makedirs(self.staging_dir, exist_ok=True)
+            arrow_table = pa.Table.from_pandas(frame, preserve_index=False)
+            path = os.path.join(self.staging_dir, f".{uuid.uuid4()}.parquet.part")
+            self._writers[sheet] = self._pq.ParquetWriter(path, arrow_table.schema)
+            table = self.tables[sheet] = {
+                "name": self.name,
+                "sheet": sheet,
+                "source": self.source,
+                "path": path,
+                "rows": 0,
+                "columns": {column: _type_name(dtype) for column, dtype in frame.dtypes.items()},
+            }
+        else:
+            arrow_table = pa.Table.from_pandas(frame, schema=self._writers[sheet].schema, preserve_index=False)
+        self._writers[sheet].write_table(arrow_table)
+        table["rows"] += len(frame)
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Finish writing, returning a description of each table"""
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        return list(self.tables.values())
+
+    def discard(self) -> None:
+        """Close and delete what was written"""
+        for table in self.close():
+            try:
+                os.remove(table["path"])
+            except FileNotFoundError:
+                pass
+
+
+@dataclass
+class TableQuery:
+    """An aggregate over one column of a stored table, optionally grouped by another"""
+    table: Dict[str, Any]
+    operation: str
+    column: Optional[str] = None
+    group_by: Optional[str] = None
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def _find_column(words: List[str], columns: List[str]) -> Tuple[Optional[str], int, int]:
+    """Find the longest column name spelled out in words (plurals allowed), returning (column, start, end)"""
+    best: Tuple[Optional[str], int, int] = (None, 0, 0)
+    words = [_singular(word) for word in words]
+    for column in columns:
+        column_words = [_singular(word) for word in _words(column)]
+        n = len(column_words)
+        if not n or (best[0] is not None and n <= best[2] - best[1]):
+            continue
+        for i in range(len(words) - n + 1):
+            if words[i:i + n] == column_words:
+                best = (column, i, i + n)
+                break
+    return best
+
+
+def parse_table_question(question: str, tables: List[Dict[str, Any]]) -> Optional[TableQuery]:
+    """
+    Recognize a question that an aggregate over a whole column answers
+
+    Understood: row counts, distinct counts, and the average, total,
+    minimum or maximum of a numeric column, optionally "by" another column.
+    Questions with words beyond the operation, the columns and the table
+    name (which usually filter the rows) are not recognized.
+    """
+    text = question.lower()
+    operation = next((op for op, pattern in _OPERATIONS if pattern.search(text)), None)
+    if operation is None or not tables:
+        return None
+
+    group_text = None
+    match = _GROUP_RE.search(text)
+    if match:
+        group_text, text = match.group(1), text[:match.start()]
+    words = _words(text)
+    group_words = _words(group_text or "")
+
+    candidates = []
+    for table in tables:
+        columns = list(table["columns"])
+        remaining = list(words)
+        name_words = set(_words(os.path.splitext(table["name"])[0])) | set(_words(table["sheet"]))
+        named = bool(name_words & set(remaining))
+
+        group_by = None
+        if group_words:
+            group_by, start, end = _find_column(group_words, columns)
+            if group_by is None or set(group_words[:start] + group_words[end:]) - _QUESTION_WORDS - name_words:
+                continue
+        column, start, end = _find_column(remaining, columns)
+        if column is not None:
+            del remaining[start:end]
+        if operation in ("mean", "sum", "min", "max") and (column is None or table["columns"][column] != "number"):
+            continue
+        if operation == "nunique" and column is None:
+            continue
+        if set(remaining) - _QUESTION_WORDS - name_words:
+            continue
+        candidates.append((named, TableQuery(table, operation, column, group_by)))
+
+    named = [query for is_named, query in candidates if is_named]
+    if len(named) == 1:
+        return named[0]
+    if len(candidates) == 1:
+        return candidates[0][1]
+    return None
+
+
+def _format_number(value: Any) -> str:
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return "n/a"
+    if isinstance(value, (float, np.floating)):
+        if float(value).is_integer():
+            return f"{value:,.0f}"
+        return f"{value:,.2f}" if abs(value) >= 100 else f"{value:.4g}"
+    if isinstance(value, (int, np.integer)):
+        return f"{value:,}"
+    return str(value)
+
+
+def run_table_query(query: TableQuery, directory: str, max_groups: int = 20) -> Document:
+    """Answer a table query with a columnar read of the table's Parquet file"""
+    table = query.table
+    path = os.path.join(directory, table["file"])
+    title = f"{table['name']}, sheet {table['sheet']}" if table["sheet"] else table["name"]
+    column_label = f" {query.column}" if query.column else ""
+    label = f"{_LABELS[query.operation]}{column_label}"
+
+    columns = [c for c in (query.column, query.group_by) if c]
+    if query.group_by is None and query.operation == "count" and query.column is None:
+        result = f"{label}: {table['rows']:,}"
+    else:
+        frame = pd.read_parquet(path, columns=columns)
+        if query.group_by is None:
+            series = frame[query.column]
+            value = series.count() if query.operation == "count" else series.agg(query.operation)
+            result = f"{label}: {_format_number(value)}"
+        else:
+            groups = frame.groupby(query.group_by, dropna=False)
+            if query.operation == "count":
+                values = groups.size() if query.column is None else groups[query.column].count()
+            else:
+                values = groups[query.column].agg(query.operation)
+            values = values.sort_values(ascending=query.operation == "min")
+            shown = values.head(max_groups)
+            more = f", top {len(shown)} of {len(values)} groups" if len(values) > len(shown) else ""
+            result = f"{label} by {query.group_by}{more}:\n" + "\n".join(
+                f"{'(blank)' if pd.isna(key) else key}: {_format_number(value)}" for key, value in shown.items()
+            )
+
+    description = query.operation + (f"({query.column})" if query.column else "(rows)")
+    if query.group_by:
+        description += f" by {query.group_by}"
+    return Document(
+        page_content=f"Computed over all {table['rows']:,} rows of the table {title}:\n{result}",
+        metadata={"source": table["source"], "table": title, "aggregate": description}
+    )
+
+
+class TableStore:
+    """
+    Parquet copies of the tables uploaded to each collection
+
+    A collection's tables live in one directory with a JSON manifest that
+    records each table's file hash, name, columns and row count, so
+    aggregate questions can be recognized without opening any table.
+    """
+
+    def __init__(self, root: str, staging_dir: str, max_groups: int = 20):
+        self.root = root
+        self.staging_dir = staging_dir
+        self.max_groups = max_groups
+        self._lock = threading.Lock()
+        self._pyarrow_missing = False
+
+    def directory(self, collection_name: str) -> str:
+        return os.path.join(self.root, collection_name)
+
+    def writer(self, source: str, name: str) -> Optional[TableWriter]:
+        """Start writing a file's tables, or return None if pyarrow is not installed"""
+        try:
+            return TableWriter(self.staging_dir, source, name)
+        except ImportError:
+            if not self._pyarrow_missing:
+                logger.warning("pyarrow is not installed, tables won't be stored for aggregate questions")
+                self._pyarrow_missing = True
+            return None
+
+    def tables(self, collection_name: str) -> List[Dict[str, Any]]:
+        """Get the descriptions of a collection's tables"""
+        path = os.path.join(self.directory(collection_name), MANIFEST_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_manifest(self, collection_name: str, tables: List[Dict[str, Any]]) -> None:
+        directory = self.directory(collection_name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, MANIFEST_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(tables, f)
+        os.replace(path + ".tmp", path)
+
+    def add(self, collection_name: str, file_hash: str, writer: TableWriter) -> int:
+        """Move a file's finished tables into a collection, returning the number of tables added"""
+        written = writer.close()
+        for table in written:
+            if not table["rows"]:
+                os.remove(table["path"])
+        written = [table for table in written if table["rows"]]
+
+        directory = self.directory(collection_name)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            tables = [t for t in self.tables(collection_name) if t["file_hash"] != file_hash]
+            for i, table in enumerate(written):
+                file_name = f"{file_hash}-{i}.parquet"
+                # The staging directory may be on another filesystem
+                shutil.move(table.pop("path"), os.path.join(directory, file_name))
+                tables.append(dict(table, file_hash=file_hash, file=file_name))
+            self._save_manifest(collection_name, tables)
+        return len(written)
+
+    def remove_file(self, collection_name: str, file_hash: str) -> None:
+        """Remove the tables of a file from a collection"""
+        with self._lock:
+            tables = self.tables(collection_name)
+            keep = [t for t in tables if t["file_hash"] != file_hash]
+            if len(keep) == len(tables):
+                return
+            self._save_manifest(collection_name, keep)
+        for table in tables:
+            if table["file_hash"] == file_hash:
+                try:
+                    os.remove(os.path.join(self.directory(collection_name), table["file"]))
+                except FileNotFoundError:
+                    pass
+
+    def link_file(self, file_hash: str, source_collection: str, target_collection: str) -> None:
+        """Copy the tables of an identical file from another collection"""
+        source_tables = [t for t in self.tables(source_collection) if t["file_hash"] == file_hash]
+        if not source_tables:
+            return
+        directory = self.directory(target_collection)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            tables = [t for t in self.tables(target_collection) if t["file_hash"] != file_hash]
+            for table in source_tables:
+                source_path = os.path.join(self.directory(source_collection), table["file"])
+                target_path = os.path.join(directory, table["file"])
+                try:
+                    # Tables are never modified in place, so a hard link is as good as a copy
+                    os.link(source_path, target_path)
+                except FileExistsError:
+                    pass
+                except OSError:
+                    shutil.copyfile(source_path, target_path)
+                tables.append(table)
+            self._save_manifest(target_collection, tables)
+
+    def answer(self, collection_name: str, question: str) -> Optional[Document]:
+        """Answer an aggregate question over a collection's tables, or return None"""
+        tables = self.tables(collection_name)
+        if not tables:
+            return None
+        query = parse_table_question(question, tables)
+        if query is None:
+            return None
+        try:
+            document = run_table_query(query, self.directory(collection_name), self.max_groups)
+        except Exception as e:
+            logger.warning(f"Table query {query.operation} on {query.table['name']} failed: {str(e)}")
+            table_queries.inc(outcome="error")
+            return None
+        table_queries.inc(outcome="answered")
+        return document
+
+# Global table store instance; tables sit next to the collection's other indexes
+table_store = TableStore(
+    root=os.path.join(settings.VECTOR_DB_PATH, "tables"),
+    staging_dir=settings.UPLOAD_DIR,
+    max_groups=settings.TABLE_QUERY_MAX_GROUPS
+)
@@ -0,0 +1,500 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from abc import abstractmethod
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.vectorstore import VectorStore
+from langchain_community.vectorstores import Chroma
+
+from app.utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Rows converted to float32 at a time when scoring an int8 matrix; small blocks stay in cache
+_SCORE_BLOCK_ROWS = 1024
+# Rows copied at a time when compacting
+_COMPACT_BLOCK_ROWS = 65536
+
+
+class ChunkVectorStore(VectorStore):
+    """
+    Vector store with the chunk-level access RagService needs beyond search
+
+    Results of get_chunks are shaped like Chroma's collection.get(): a dict
+    with "ids" and one list per included field ("embeddings", "documents",
+    "metadatas").
+    """
+
+    @abstractmethod
+    def get_chunks(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+                   include: Sequence[str] = ()) -> Dict[str, List[Any]]:
+        """Get stored chunks by ID and/or by metadata equality"""
+
+    @abstractmethod
+    def add_chunks(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+                   documents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        """Add chunks whose vectors are already known"""
+
+    @abstractmethod
+    def update_metadatas(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        """Replace the metadata of existing chunks"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of chunks in the store"""
+
+
+class ChromaVectorStore(Chroma, ChunkVectorStore):
+    """LangChain's Chroma store with chunk access through its collection"""
+
+    def get_chunks(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+                   include: Sequence[str] = ()) -> Dict[str, List[Any]]:
+        return self._collection.get(ids=list(ids) if ids is not None else None, where=where, include=list(include))
+
+    def add_chunks(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+                   documents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        self._collection.add(ids=list(ids), embeddings=embeddings, documents=list(documents),
+                             metadatas=list(metadatas))
+
+    def update_metadatas(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        self._collection.update(ids=list(ids), metadatas=list(metadatas))
+
+    def count(self) -> int:
+        return self._collection.count()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class FlatVectorStore(ChunkVectorStore):
+    """
+    Exact cosine search over a memory-mapped matrix of chunk vectors
+
+    Vectors are normalized and appended to a flat file, as float32 or, with
+    int8 quantization, as int8 rows with a float32 scale each (a quarter of
+    the size, at a small cost in score precision). Chunk text and metadata
+    are kept in an append-only JSON lines log next to it; deletes and
+    metadata updates are appended to the same log and replayed on load.
+    Deleted rows are masked until they outnumber live rows, at which point
+    the files are rewritten without them.
+
+    Search is one matrix-vector product over the mapped file, so the OS
+    page cache rather than the Python heap holds the vectors.
+
+    Several processes can share a directory: writes hold a lock file, and
+    every process replays the records others appended before it writes or
+    searches, so row numbers always follow the files.
+    """
+
+    META_FILE = "meta.json"
+    VECTORS_FILE = "vectors.bin"
+    SCALES_FILE = "scales.f32"
+    RECORDS_FILE = "records.jsonl"
+    LOCK_FILE = "write.lock"
+    COMPACT_MIN_DELETED = 1024
+
+    def __init__(self, directory: str, embedding: Embeddings, quantization: str = "none"):
+        if quantization not in ("none", "int8"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.directory = directory
+        self._embedding = embedding
+        self.quantization = quantization
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        # Identity of the records file and how much of it has been replayed
+        self._records_id: Optional[Tuple[int, int]] = None
+        self._records_offset = 0
+        self._file_locked = False
+        self._lock = threading.RLock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @property
+    def _dtype(self) -> np.dtype:
+        return np.dtype(np.int8 if self.quantization == "int8" else np.float32)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Hold this store's lock and the lock file other processes writing to the directory share"""
+        with self._lock:
+            if self._file_locked:
+                yield
+                return
+            with file_lock(self._path(self.LOCK_FILE)):
+                self._file_locked = True
+                try:
+                    yield
+                finally:
+                    self._file_locked = False
+
+    # Writes
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict[str, Any]]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if ids is None:
+            raise ValueError("FlatVectorStore needs explicit chunk IDs")
+        embeddings = self._embedding.embed_documents(texts)
+        self.add_chunks(ids, embeddings, texts, metadatas or [{} for _ in texts])
+        return list(ids)
+
+    def add_chunks(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+                   documents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        if not len(ids):
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._exclusive():
+            self._refresh_locked()
+            if self.dim is None:
+                self._create(vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+
+            # Re-adding an ID replaces the chunk
+            replaced = [chunk_id for chunk_id in ids if chunk_id in self._rows]
+            if replaced:
+                self.delete(replaced)
+
+            # Vectors are written before their records, so a record never refers to a missing row
+            with open(self._path(self.VECTORS_FILE), "ab") as f:
+                if self.quantization == "int8":
+                    scales = np.abs(vectors).max(axis=1) / 127
+                    scales[scales == 0] = 1.0
+                    f.write(np.round(vectors / scales[:, None]).astype(np.int8).tobytes())
+                    with open(self._path(self.SCALES_FILE), "ab") as scales_file:
+                        scales_file.write(scales.astype(np.float32).tobytes())
+                else:
+                    f.write(vectors.tobytes())
+            self._append_records([{"id": chunk_id, "text": text, "metadata": metadata}
+                                  for chunk_id, text, metadata in zip(ids, documents, metadatas)])
+
+            for chunk_id, text, metadata in zip(ids, documents, metadatas):
+                self._rows[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+                self.texts.append(text)
+                self.metadatas.append(dict(metadata))
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+            # Remapped on the next search; searches already running keep the old, still valid, mapping
+            self._matrix = None
+
+    def _create(self, dim: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.dim = dim
+        with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "quantization": self.quantization}, f)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return True
+        with self._exclusive():
+            self._refresh_locked()
+            rows = [self._rows.pop(chunk_id) for chunk_id in ids if chunk_id in self._rows]
+            if not rows:
+                return True
+            self._append_op({"op": "delete", "ids": [self.ids[row] for row in rows]})
+            self.deleted[rows] = True
+            n_deleted = int(self.deleted.sum())
+            if n_deleted >= self.COMPACT_MIN_DELETED and n_deleted > len(self.ids) - n_deleted:
+                try:
+                    self.compact()
+                except OSError as e:
+                    # On Windows the files can't be replaced while another process maps them
+                    logger.warning(f"Postponed compacting flat index {self.directory}: {e}")
+        return True
+
+    def update_metadatas(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        with self._exclusive():
+            self._refresh_locked()
+            pairs = [(chunk_id, metadata) for chunk_id, metadata in zip(ids, metadatas) if chunk_id in self._rows]
+            if not pairs:
+                return
+            self._append_op({
+                "op": "update",
+                "ids": [chunk_id for chunk_id, _ in pairs],
+                "metadatas": [metadata for _, metadata in pairs],
+            })
+            for chunk_id, metadata in pairs:
+                self.metadatas[self._rows[chunk_id]] = dict(metadata)
+
+    def _append_op(self, op: Dict[str, Any]) -> None:
+        self._append_records([op])
+
+    def _append_records(self, records: List[Dict[str, Any]]) -> None:
+        """Append to the records log; the caller holds the file lock and has replayed the log"""
+        with open(self._path(self.RECORDS_FILE), "ab") as f:
+            f.write(b"".join((json.dumps(record) + "\n").encode("utf-8") for record in records))
+            self._records_offset = f.tell()
+            stat = os.fstat(f.fileno())
+            self._records_id = (stat.st_dev, stat.st_ino)
+
+    def compact(self) -> None:
+        """Rewrite the files without deleted rows"""
+        with self._exclusive():
+            self._refresh_locked()
+            if self.dim is None:
+                return
+            keep = np.flatnonzero(~self.deleted)
+            matrix, scales = self._mapped()
+            tmp_vectors = self._path(self.VECTORS_FILE + ".tmp")
+            with open(tmp_vectors, "wb") as f:
+                for start in range(0, len(keep), _COMPACT_BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(matrix[keep[start:start + _COMPACT_BLOCK_ROWS]]).tobytes())
+            if scales is not None:
+                with open(self._path(self.SCALES_FILE + ".tmp"), "wb") as f:
+                    f.write(np.ascontiguousarray(scales[keep]).tobytes())
+            with open(self._path(self.RECORDS_FILE + ".tmp"), "wb") as f:
+                for row in keep:
+                    f.write((json.dumps({"id": self.ids[row], "text": self.texts[row],
+                                         "metadata": self.metadatas[row]}) + "\n").encode("utf-8"))
+
+            # Release our mappings first; replacing a mapped file fails on Windows
+            self._matrix = self._scales = None
+            del matrix, scales
+            os.replace(tmp_vectors, self._path(self.VECTORS_FILE))
+            if self.quantization == "int8":
+                os.replace(self._path(self.SCALES_FILE + ".tmp"), self._path(self.SCALES_FILE))
+            os.replace(self._path(self.RECORDS_FILE + ".tmp"), self._path(self.RECORDS_FILE))
+            stat = os.stat(self._path(self.RECORDS_FILE))
+            self._records_id, self._records_offset = (stat.st_dev, stat.st_ino), stat.st_size
+
+            self.ids = [self.ids[row] for row in keep]
+            self.texts = [self.texts[row] for row in keep]
+            self.metadatas = [self.metadatas[row] for row in keep]
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            self.deleted = np.zeros(len(self.ids), dtype=bool)
+            logger.info(f"Compacted flat index {self.directory} to {len(self.ids)} chunks")
+
+    # Changes made by other processes
+
+    def _catch_up(self) -> None:
+        """Replay records other processes appended since the last look, if any"""
+        try:
+            stat = os.stat(self._path(self.RECORDS_FILE))
+        except FileNotFoundError:
+            return
+        if (stat.st_dev, stat.st_ino) != self._records_id or stat.st_size != self._records_offset:
+            with self._exclusive():
+                self._refresh_locked()
+
+    def _refresh_locked(self) -> None:
+        """
+        Replay the records appended since the last refresh, holding the file lock
+
+        A records file replaced by another process's compaction is replayed
+        from the start. Leftovers of a write that was interrupted, a torn
+        last record or vector rows past the last record, are cut off.
+        """
+        if self.dim is None:
+            if not os.path.exists(self._path(self.META_FILE)):
+                return
+            with open(self._path(self.META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.quantization = meta["quantization"]
+
+        row_bytes = self.dim * self._dtype.itemsize
+        vectors_path = self._path(self.VECTORS_FILE)
+        n_vectors = os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0
+        records_path = self._path(self.RECORDS_FILE)
+        if os.path.exists(records_path):
+            with open(records_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if (stat.st_dev, stat.st_ino) != self._records_id or stat.st_size < self._records_offset:
+                    self._reset_locked()
+                    self._records_id = (stat.st_dev, stat.st_ino)
+                f.seek(self._records_offset)
+                self._replay_locked(f, n_vectors)
+            if os.path.getsize(records_path) > self._records_offset:
+                os.truncate(records_path, self._records_offset)
+        if n_vectors > len(self.ids):
+            os.truncate(vectors_path, len(self.ids) * row_bytes)
+            if self.quantization == "int8":
+                os.truncate(self._path(self.SCALES_FILE), len(self.ids) * 4)
+
+    def _replay_locked(self, f, n_vectors: int) -> None:
+        """Apply the records read from f, stopping at one that is torn or has no vector row"""
+        n_rows = len(self.ids)
+        deleted: List[int] = []
+        for line in f:
+            try:
+                record = json.loads(line) if line.endswith(b"\n") else None
+            except json.JSONDecodeError:
+                record = None
+            if record is None:
+                break
+            op = record.get("op")
+            if op is None:
+                if len(self.ids) == n_vectors:
+                    break
+                if record["id"] in self._rows:
+                    deleted.append(self._rows[record["id"]])
+                self._rows[record["id"]] = len(self.ids)
+                self.ids.append(record["id"])
+                self.texts.append(record["text"])
+                self.metadatas.append(record["metadata"])
+            elif op == "delete":
+                deleted.extend(self._rows.pop(chunk_id) for chunk_id in record["ids"] if chunk_id in self._rows)
+            elif op == "update":
+                for chunk_id, metadata in zip(record["ids"], record["metadatas"]):
+                    if chunk_id in self._rows:
+                        self.metadatas[self._rows[chunk_id]] = metadata
+            self._records_offset += len(line)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(self.ids) - n_rows, dtype=bool)])
+        self.deleted[deleted] = True
+
+    def _reset_locked(self) -> None:
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.deleted = np.zeros(0, dtype=bool)
+        self._rows = {}
+        self._matrix = self._scales = None
+        self._records_id, self._records_offset = None, 0
+
+    # Reads
+
+    def _mapped(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Get the vector matrix (and int8 scales) covering every row added so far"""
+        with self._lock:
+            if self._matrix is None or len(self._matrix) != len(self.ids):
+                n = len(self.ids)
+                if n == 0:
+                    self._matrix = np.zeros((0, self.dim or 0), dtype=self._dtype)
+                    self._scales = np.zeros(0, dtype=np.float32) if self.quantization == "int8" else None
+                else:
+                    self._matrix = np.memmap(self._path(self.VECTORS_FILE), dtype=self._dtype,
+                                             mode="r", shape=(n, self.dim))
+                    self._scales = None
+                    if self.quantization == "int8":
+                        self._scales = np.memmap(self._path(self.SCALES_FILE), dtype=np.float32,
+                                                 mode="r", shape=(n,))
+            return self._matrix, self._scales
+
+    def _vectors(self, rows: Sequence[int]) -> np.ndarray:
+        matrix, scales = self._mapped()
+        vectors = np.asarray(matrix[list(rows)], dtype=np.float32)
+        if scales is not None:
+            vectors *= scales[list(rows)][:, None]
+        return vectors
+
+    def _matches(self, row: int, where: Optional[Dict[str, Any]]) -> bool:
+        if not where:
+            return True
+        metadata = self.metadatas[row]
+        return all(metadata.get(key) == value for key, value in where.items())
+
+    def get_chunks(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+                   include: Sequence[str] = ()) -> Dict[str, List[Any]]:
+        self._catch_up()
+        with self._lock:
+            if ids is None:
+                rows = [row for row in np.flatnonzero(~self.deleted) if self._matches(row, where)]
+            else:
+                rows = [self._rows[chunk_id] for chunk_id in ids
+                        if chunk_id in self._rows and self._matches(self._rows[chunk_id], where)]
+            result: Dict[str, List[Any]] = {"ids": [self.ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = [self.texts[row] for row in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [dict(self.metadatas[row]) for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = list(self._vectors(rows)) if rows else []
+        return result
+
+    def count(self) -> int:
+        self._catch_up()
+        with self._lock:
+            return len(self._rows)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        """Search by vector, scoring each document by cosine distance (lower is closer)"""
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        self._catch_up()
+        with self._lock:
+            matrix, scales = self._mapped()
+            mask = self.deleted.copy()
+            if filter:
+                mask |= np.array([not self._matches(row, filter) for row in range(len(self.ids))], dtype=bool)
+            # Compaction replaces these lists rather than changing them, so rows stay valid for the snapshot
+            texts, metadatas = self.texts, self.metadatas
+        n = len(matrix)
+        if n == 0 or k <= 0:
+            return []
+
+        if scales is None:
+            scores = np.asarray(matrix @ query, dtype=np.float32)
+        else:
+            scores = np.empty(n, dtype=np.float32)
+            for start in range(0, n, _SCORE_BLOCK_ROWS):
+                block = np.asarray(matrix[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+                scores[start:start + len(block)] = (block @ query) * scales[start:start + len(block)]
+        scores[mask] = -np.inf
+
+        k = min(k, n - int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (Document(page_content=texts[row], metadata=dict(metadatas[row])), 1.0 - float(scores[row]))
+            for row in top
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, directory: Optional[str] = None,
+                   **kwargs: Any) -> "FlatVectorStore":
+        if directory is None:
+            raise ValueError("FlatVectorStore.from_texts needs a directory")
+        store = cls.load(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def load(cls, directory: str, embedding: Embeddings, quantization: str = "none") -> "FlatVectorStore":
+        """Open the store in directory; an existing store keeps the quantization it was created with"""
+        store = cls(directory, embedding, quantization)
+        if not os.path.exists(store._path(cls.META_FILE)):
+            return store
+
+        with store._exclusive():
+            store._refresh_locked()
+            n_deleted = int(store.deleted.sum())
+            if n_deleted >= cls.COMPACT_MIN_DELETED and n_deleted > len(store._rows):
+                store.compact()
+        logger.info(f"Loaded flat index with {len(store._rows)} chunks from {directory}")
+        return store
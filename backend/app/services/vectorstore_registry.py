@@ -0,0 +1,257 @@
+from typing import Dict, Any, Iterator, List, Optional, Callable, Hashable, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import os
+import shutil
+import threading
+import time
+
+from langchain.schema.embeddings import Embeddings
+
+from app.services.bm25_index import BM25Index
+from app.services.dedup import ChunkDeduplicator
+from app.services.vector_stores import ChunkVectorStore, ChromaVectorStore, FlatVectorStore
+from app.core.config import settings
+from app.utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+class ObjectCache:
+    """
+    Thread-safe LRU cache with a size bound and idle-time eviction
+
+    Pinned keys are never evicted, so an object with unsaved changes stays
+    the one every caller gets until it has been written.
+    """
+
+    def __init__(self, name: str, max_size: int, idle_seconds: float):
+        self.name = name
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._pins: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+        self._builds = SingleFlight(name)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached object for key, building it with factory on a miss"""
+        with self._lock:
+            self._evict_idle_locked()
+            if key in self._items:
+                value, _ = self._items.pop(key)
+                self._items[key] = (value, time.monotonic())
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # Build outside the lock so a slow factory doesn't block other keys, and
+        # only once per key: concurrent builds of one Chroma collection collide
+        value, _ = self._builds.do(key, lambda: self._build(key, factory))
+        return value
+
+    @contextmanager
+    def pin(self, key: Hashable) -> Iterator[None]:
+        """Keep key's entry, once cached, from being evicted while the block runs"""
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def _build(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            # A build that finished since the lookup has already left the flight
+            if key in self._items:
+                return self._items[key][0]
+        value = factory()
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            # Least recently used first; when everything is pinned the cache grows past max_size
+            excess = len(self._items) - self.max_size
+            for old_key in [k for k in self._items if k not in self._pins][:max(0, excess)]:
+                del self._items[old_key]
+                self.evictions += 1
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                del self._items[key]
+            return len(keys)
+
+    def _evict_idle_locked(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        # Entries are kept in access order, so idle ones are at the front
+        idle = []
+        for key, (_, last_used) in self._items.items():
+            if last_used >= cutoff:
+                break
+            if key not in self._pins:
+                idle.append(key)
+        for key in idle:
+            del self._items[key]
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class VectorStoreRegistry:
+    """
+    Process-wide registry of vector store handles and chain objects
+
+    With the "chroma" backend all collections share one persistent Chroma
+    client on VECTOR_DB_PATH; with the "flat" backend each collection is a
+    memory-mapped index under VECTOR_DB_PATH/flat. Either way opening a
+    collection or building a chain is paid once per process rather than
+    once per request.
+    """
+
+    def __init__(self, persist_directory: str, max_collections: int, max_chains: int,
+                 idle_seconds: float, backend: str = "chroma", flat_quantization: str = "none"):
+        if backend not in ("chroma", "flat"):
+            raise ValueError(f"Unsupported vector backend: {backend}")
+        self.persist_directory = persist_directory
+        self.backend = backend
+        self.flat_quantization = flat_quantization
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.vectorstores = ObjectCache("vectorstores", max_collections, idle_seconds)
+        self.chains = ObjectCache("chains", max_chains, idle_seconds)
+        self.lexical_indexes = ObjectCache("lexical_indexes", max_collections, idle_seconds)
+        self.deduplicators = ObjectCache("deduplicators", max_collections, idle_seconds)
+
+    @property
+    def client(self) -> "chromadb.api.ClientAPI":
+        """Get the shared Chroma client, creating it on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    # Imported here: chromadb is slow to import and unused with the flat backend
+                    import chromadb
+                    self._client = chromadb.PersistentClient(path=self.persist_directory)
+        return self._client
+
+    def get_vectorstore(self, collection_name: str, embeddings: Embeddings) -> ChunkVectorStore:
+        """Get a cached vector store handle for the collection"""
+        if self.backend == "flat":
+            return self.vectorstores.get_or_create(
+                collection_name,
+                lambda: FlatVectorStore.load(
+                    self.index_directory("flat", collection_name),
+                    embeddings,
+                    quantization=self.flat_quantization
+                )
+            )
+        return self.vectorstores.get_or_create(
+            collection_name,
+            lambda: ChromaVectorStore(
+                client=self.client,
+                embedding_function=embeddings,
+                collection_name=collection_name
+            )
+        )
+
+    def index_directory(self, kind: str, collection_name: str) -> str:
+        """Get the directory of a collection's "bm25", "dedup", "flat" or "tables" index"""
+        return os.path.join(self.persist_directory, kind, collection_name)
+
+    def get_lexical_index(self, collection_name: str) -> BM25Index:
+        """Get the BM25 index stored next to the Chroma data for the collection"""
+        return self.lexical_indexes.get_or_create(
+            collection_name,
+            lambda: BM25Index.load(self.index_directory("bm25", collection_name))
+        )
+
+    def get_chunk_deduplicator(self, collection_name: str) -> ChunkDeduplicator:
+        """Get the chunk hash index stored next to the Chroma data for the collection"""
+        return self.deduplicators.get_or_create(
+            collection_name,
+            lambda: ChunkDeduplicator.load(
+                self.index_directory("dedup", collection_name),
+                max_distance=settings.DEDUP_SIMHASH_MAX_DISTANCE
+            )
+        )
+
+    @contextmanager
+    def pinned(self, collection_name: str) -> Iterator[None]:
+        """
+        Keep the collection's lexical and dedup indexes cached while the block runs
+
+        Changes to them are saved in batches, so an index evicted before it
+        is saved would lose them and be reloaded without them.
+        """
+        with self.lexical_indexes.pin(collection_name), self.deduplicators.pin(collection_name):
+            yield
+
+    def get_chain(self, collection_name: str, kind: Hashable, factory: Callable[[], Any]) -> Any:
+        """Get a cached chain for the collection, building it with factory on a miss"""
+        return self.chains.get_or_create((collection_name, kind), factory)
+
+    def invalidate(self, collection_name: str) -> None:
+        """Forget cached objects for a collection"""
+        self.vectorstores.invalidate(lambda key: key == collection_name)
+        self.chains.invalidate(lambda key: key[0] == collection_name)
+        self.lexical_indexes.invalidate(lambda key: key == collection_name)
+        self.deduplicators.invalidate(lambda key: key == collection_name)
+
+    def collection_names(self) -> List[str]:
+        """Get the names of all collections in the configured backend"""
+        if self.backend == "flat":
+            root = os.path.join(self.persist_directory, "flat")
+            if not os.path.isdir(root):
+                return []
+            return [entry.name for entry in os.scandir(root) if entry.is_dir()]
+        return [collection.name for collection in self.client.list_collections()]
+
+    def drop(self, collection_name: str) -> None:
+        """Delete a collection and the indexes stored next to it"""
+        self.invalidate(collection_name)
+        if self.backend == "chroma":
+            try:
+                self.client.delete_collection(collection_name)
+            except ValueError:
+                # Never created, or already dropped by another worker
+                pass
+        for kind in ("bm25", "dedup", "flat", "tables"):
+            shutil.rmtree(self.index_directory(kind, collection_name), ignore_errors=True)
+        # Forget handles a concurrent request may have reopened in the meantime
+        self.invalidate(collection_name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics for vector stores and chains"""
+        return {
+            "vectorstores": self.vectorstores.stats(),
+            "chains": self.chains.stats(),
+            "lexical_indexes": self.lexical_indexes.stats(),
+            "deduplicators": self.deduplicators.stats(),
+        }
+
+# Global registry instance
+vectorstore_registry = VectorStoreRegistry(
+    persist_directory=settings.VECTOR_DB_PATH,
+    max_collections=settings.VECTOR_STORE_CACHE_SIZE,
+    max_chains=settings.CHAIN_CACHE_SIZE,
+    idle_seconds=settings.VECTOR_STORE_IDLE_SECONDS,
+    backend=settings.VECTOR_BACKEND,
+    flat_quantization=settings.FLAT_INDEX_QUANTIZATION
+)
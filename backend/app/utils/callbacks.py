@@ -0,0 +1,158 @@
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+import threading
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema.embeddings import Embeddings
+
+from app.core.metrics import Counter, llm_tokens
+from app.utils.timing import record_stage, stage
+
+
+class TimedEmbeddings(Embeddings):
+    """Embeddings wrapper that records provider calls as the "embedding" stage"""
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with stage("embedding"):
+            return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with stage("embedding"):
+            return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with stage("embedding"):
+            return await self.underlying.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        with stage("embedding"):
+            return await self.underlying.aembed_query(text)
+
+
+class StageTimingCallback(BaseCallbackHandler):
+    """
+    LangChain callback that records LLM calls and retrievals as stages
+
+    LLM calls are split into "llm_condense" (rewriting a follow-up into a
+    standalone question), "llm_answer" (answer generation) and "llm_summary"
+    (summarizing older chat turns). Calls are classified by a "condense",
+    "answer" or "summary" tag, or inside a ConversationalRetrievalChain by
+    whether they run under the documents chain.
+    """
+
+    ANSWER_CHAINS = ("StuffDocumentsChain", "MapReduceDocumentsChain", "RefineDocumentsChain")
+    # Cheap bookkeeping, so async calls needn't hand each event to a thread
+    run_inline = True
+
+    def __init__(self):
+        self._starts: Dict[UUID, Any] = {}
+        self._chains: Dict[UUID, Any] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, name: str) -> None:
+        with self._lock:
+            self._starts[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+        if started is not None:
+            name, start = started
+            record_stage(name, time.perf_counter() - start)
+
+    def _llm_stage(self, parent_run_id: Optional[UUID], tags: Optional[List[str]]) -> str:
+        tags = tags or []
+        if "summary" in tags:
+            return "llm_summary"
+        if "condense" in tags:
+            return "llm_condense"
+        if "answer" in tags:
+            return "llm_answer"
+        with self._lock:
+            in_chain = False
+            while parent_run_id is not None and parent_run_id in self._chains:
+                in_chain = True
+                name, parent_run_id = self._chains[parent_run_id]
+                if name in self.ANSWER_CHAINS:
+                    return "llm_answer"
+        return "llm_condense" if in_chain else "llm_answer"
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = ((serialized or {}).get("id") or [""])[-1]
+        with self._lock:
+            self._chains[run_id] = (name, parent_run_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._chains.pop(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._chains.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, tags: Optional[List[str]] = None,
+                            **kwargs: Any) -> None:
+        self._start(run_id, self._llm_stage(parent_run_id, tags))
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, tags: Optional[List[str]] = None,
+                     **kwargs: Any) -> None:
+        self._start(run_id, self._llm_stage(parent_run_id, tags))
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID,
+                           tags: Optional[List[str]] = None, **kwargs: Any) -> None:
+        # Wrappers (reranking, table queries) time their own stages around the inner search
+        if not {"rerank", "table_query"} & set(tags or []):
+            self._start(run_id, "vector_search")
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """LangChain callback that counts prompt and completion tokens"""
+
+    run_inline = True
+
+    def __init__(self, counter: Counter):
+        self.counter = counter
+        self._streamed: Dict[UUID, int] = {}
+        self._lock = threading.Lock()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._streamed[run_id] = self._streamed.get(run_id, 0) + 1
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            streamed = self._streamed.pop(run_id, 0)
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        if usage:
+            self.counter.inc(usage.get("prompt_tokens", 0), kind="prompt")
+            self.counter.inc(usage.get("completion_tokens", 0), kind="completion")
+        elif streamed:
+            # Streaming responses carry no usage block, count the streamed tokens instead
+            self.counter.inc(streamed, kind="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._streamed.pop(run_id, None)
+
+# Shared callback instances passed to chains, retrievers and LLM calls
+stage_timing_callback = StageTimingCallback()
+token_usage_callback = TokenUsageCallback(llm_tokens)
@@ -1,42 +1,237 @@
 import os
 import uuid
-import shutil
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
-from fastapi import UploadFile
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import aiofiles
+import aiofiles.os
+import multipart
+from multipart.multipart import parse_options_header
+from fastapi import Request
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-def save_upload_file(upload_file: UploadFile) -> Tuple[str, int]:
+# Room for boundaries and part headers when checking Content-Length against the file size limit
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class UploadTooLargeError(Exception):
+    """Raised when an uploaded file is larger than the allowed size"""
+
+
+class SavedUpload:
+    """A file from a multipart request, written to the uploads directory"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.path: Optional[str] = None  # None if the file was skipped
+        self.size = 0
+        self.sha256: Optional[str] = None
+
+
+class _MultipartFileWriter:
+    """
+    Parser callbacks that queue multipart events for one request
+    
+    The parser's callbacks can't await, so they only record what happened;
+    write() then handles the queued events with async file I/O after each
+    chunk is parsed.
+    """
+
+    def __init__(self, field_name: str, accept: Callable[[str], bool], max_size: int):
+        self.field_name = field_name.encode()
+        self.accept = accept
+        self.max_size = max_size
+        self.uploads: List[SavedUpload] = []
+        self._events: List[Tuple[str, Any]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._current: Optional[SavedUpload] = None
+        self._file = None
+        self._tmp_path: Optional[str] = None
+        self._digest = None
+
+    @property
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        filename = options.get(b"filename")
+        if options.get(b"name") == self.field_name and filename is not None:
+            self._events.append(("begin", filename.decode("utf-8", "replace")))
+        else:
+            # Other form fields are not used by the upload endpoints
+            self._events.append(("begin", None))
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        # A view of the received chunk rather than a copy of it
+        self._events.append(("data", memoryview(data)[start:end] if isinstance(data, bytes) else data[start:end]))
+
+    def on_part_end(self) -> None:
+        self._events.append(("end", None))
+
+    async def write(self) -> None:
+        """Handle the events queued while parsing the last chunk"""
+        events, self._events = self._events, []
+        for kind, value in events:
+            if kind == "begin":
+                await self._begin(value)
+            elif kind == "data":
+                if self._current is None:
+                    continue
+                self._current.size += len(value)
+                if self._current.size > self.max_size:
+                    raise UploadTooLargeError(
+                        f"{self._current.filename} is larger than {self.max_size} bytes"
+                    )
+                if self._file is not None:
+                    self._digest.update(value)
+                    await self._file.write(value)
+            elif self._file is not None:
+                await self._finish()
+
+    async def _begin(self, filename: Optional[str]) -> None:
+        self._current = None
+        if filename is None:
+            return
+        self._current = SavedUpload(filename)
+        self.uploads.append(self._current)
+        if not self.accept(filename):
+            return
+        # Written under a temporary name and renamed once complete, so a
+        # partial upload is never mistaken for a whole file
+        unique_name = f"{uuid.uuid4()}_{os.path.basename(filename)}"
+        self._current.path = os.path.join(settings.UPLOAD_DIR, unique_name)
+        self._tmp_path = os.path.join(settings.UPLOAD_DIR, f".{unique_name}.part")
+        self._digest = hashlib.sha256()
+        await aiofiles.os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        self._file = await aiofiles.open(self._tmp_path, "wb")
+
+    async def _finish(self) -> None:
+        await self._file.close()
+        self._file = None
+        await aiofiles.os.replace(self._tmp_path, self._current.path)
+        self._tmp_path = None
+        self._current.sha256 = self._digest.hexdigest()
+
+    async def discard(self) -> None:
+        """Delete everything written for this request"""
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+        paths = [self._tmp_path] + [upload.path for upload in self.uploads]
+        for path in paths:
+            if path and await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(path)
+
+
+async def receive_upload_files(request: Request, field_name: str, accept: Callable[[str], bool],
+                               max_size: int, max_files: Optional[int] = None) -> List[SavedUpload]:
     """
-    Save an uploaded file to the uploads directory
+    Stream the files of a multipart/form-data request into the uploads directory
+    
+    Each file is written chunk by chunk as the request body arrives and
+    hashed in the same pass, so a file over the limit is rejected as soon
+    as it crosses it instead of after it has been saved.
     
     Args:
-        upload_file: The file to save
+        request: The incoming request; its body must not have been read yet
+        field_name: Form field holding the files
+        accept: Called with each filename; files it rejects are not saved
+        max_size: Largest allowed file in bytes
+        max_files: If set, requests whose Content-Length can't fit this many files are rejected up front
         
     Returns:
-        Tuple of (file_path, file_size)
+        The files of the request in order, with path None for those that were skipped
+        
+    Raises:
+        UploadTooLargeError: A file is larger than max_size
+        ValueError: The request is not multipart/form-data
     """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type.lower() != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data request")
+    
+    content_length = request.headers.get("content-length")
+    if max_files is not None and content_length and content_length.isdigit():
+        if int(content_length) > max_files * max_size + MULTIPART_OVERHEAD_BYTES:
+            raise UploadTooLargeError(f"Request is larger than {max_size} bytes per file")
+    
+    writer = _MultipartFileWriter(field_name, accept, max_size)
+    parser = multipart.MultipartParser(params[b"boundary"], writer.callbacks)
     try:
-        # Create a unique filename to avoid collisions
-        filename = upload_file.filename
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(upload_file.file, f)
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await writer.write()
+        parser.finalize()
+        await writer.write()
+    except BaseException:
+        await writer.discard()
+        raise
+    return writer.uploads
+
+def remove_upload_file(file_path: str) -> bool:
+    """
+    Delete a saved upload if it still exists
+    
+    Args:
+        file_path: Path of a saved upload
         
-        return file_path, file_size
+    Returns:
+        Whether a file was deleted
+    """
+    try:
+        os.remove(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def original_filename(file_path: str) -> str:
+    """
+    Get the name a saved upload was uploaded under
     
-    except Exception as e:
-        logger.error(f"Error saving file {upload_file.filename}: {str(e)}")
-        raise
+    Args:
+        file_path: Path of a saved upload
+        
+    Returns:
+        The file name without the unique prefix added when it was saved
+    """
+    name = os.path.basename(file_path)
+    prefix, sep, rest = name.partition("_")
+    if sep and rest:
+        try:
+            uuid.UUID(prefix)
+            return rest
+        except ValueError:
+            pass
+    return name
 
 def get_file_extension(filename: str) -> str:
     """
@@ -1,5 +1,7 @@
 import os
+import time
 import logging
+from typing import Iterable, Tuple
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -18,7 +20,50 @@ def initialize_directories():
         else:
             logger.info(f"Directory already exists: {directory}")
 
-def clean_temp_files():
-    """Clean up temporary files (can be used for maintenance)"""
-    # Implement any cleanup logic here
-    pass
+def disk_usage(path: str) -> int:
+    """Get the size in bytes of a file or of everything under a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Removed while walking
+                pass
+    return total
+
+def clean_temp_files(keep: Iterable[str], min_age_seconds: float = 3600) -> Tuple[int, int]:
+    """
+    Delete uploads that no session or ingestion job refers to
+    
+    Args:
+        keep: Paths of uploads that are still in use
+        min_age_seconds: Leave younger files alone, they may belong to an upload in progress
+        
+    Returns:
+        Tuple of (files deleted, bytes reclaimed)
+    """
+    if not os.path.isdir(settings.UPLOAD_DIR):
+        return 0, 0
+    keep = {os.path.abspath(path) for path in keep}
+    cutoff = time.time() - min_age_seconds
+    files = 0
+    reclaimed = 0
+    with os.scandir(settings.UPLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file() or os.path.abspath(entry.path) in keep:
+                continue
+            try:
+                stat = entry.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            files += 1
+            reclaimed += stat.st_size
+    if files:
+        logger.info(f"Deleted {files} orphaned uploads ({reclaimed} bytes)")
+    return files, reclaimed
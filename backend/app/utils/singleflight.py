@@ -0,0 +1,97 @@
+from typing import Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+from concurrent.futures import Future
+import asyncio
+import threading
+
+from app.core.metrics import single_flight_calls
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Shares one execution of a call among threads making the same call at once
+
+    The first caller for a key runs the function; callers that arrive while
+    it is running wait for it and get its result or exception instead of
+    repeating the work. Nothing is kept once the call finishes, so a later
+    call runs again. When disabled, every call runs on its own.
+    """
+
+    def __init__(self, kind: str, enabled: bool = True):
+        self.kind = kind
+        self.enabled = enabled
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Run func, or wait for the identical call already in flight
+
+        Returns:
+            Tuple of (result, whether it was shared from another caller)
+        """
+        if not self.enabled:
+            return func(), False
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            single_flight_calls.inc(kind=self.kind, outcome="coalesced")
+            return future.result(), True
+
+        single_flight_calls.inc(kind=self.kind, outcome="executed")
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop
+
+    The work runs in its own task, so a caller that is cancelled, e.g.
+    because its client disconnected, doesn't cancel it for the others.
+    """
+
+    def __init__(self, kind: str, enabled: bool = True):
+        self.kind = kind
+        self.enabled = enabled
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Await func(), or the identical call already in flight
+
+        Returns:
+            Tuple of (result, whether it was shared from another caller)
+        """
+        if not self.enabled:
+            return await func(), False
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            single_flight_calls.inc(kind=self.kind, outcome="coalesced")
+        else:
+            single_flight_calls.inc(kind=self.kind, outcome="executed")
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Every caller may have been cancelled; don't let an error go unreported as "never retrieved"
+        if not task.cancelled():
+            task.exception()
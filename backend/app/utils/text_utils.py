@@ -0,0 +1,56 @@
+import re
+
+# Words that usually refer back to earlier turns of the conversation
+_REFERENCE_WORDS = {
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "former", "latter",
+    "above", "previous", "earlier", "same", "else", "also", "more", "again",
+    "there", "then",
+}
+
+_FOLLOW_UP_PREFIXES = ("and ", "but ", "so ", "what about", "how about", "why not", "also ")
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+# Rough characters per token for English text with OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+def is_standalone_question(question: str, min_words: int = 4) -> bool:
+    """
+    Cheap heuristic for whether a question can be understood without chat history
+
+    Args:
+        question: The user's question
+        min_words: Questions shorter than this are treated as follow-ups
+
+    Returns:
+        True if the question contains no obvious references to earlier turns
+    """
+    text = question.strip().lower()
+    if text.startswith(_FOLLOW_UP_PREFIXES):
+        return False
+
+    words = _WORD_RE.findall(text)
+    if len(words) < min_words:
+        return False
+
+    return not any(word in _REFERENCE_WORDS for word in words)
+
+
+def question_similarity(first: str, second: str) -> float:
+    """
+    Jaccard similarity of the words in two questions
+
+    Returns:
+        1.0 for the same set of words, 0.0 for no words in common
+    """
+    first_words = set(_WORD_RE.findall(first.lower()))
+    second_words = set(_WORD_RE.findall(second.lower()))
+    if not first_words and not second_words:
+        return 1.0
+    return len(first_words & second_words) / len(first_words | second_words)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap estimate of the number of tokens in text"""
+    return len(text) // CHARS_PER_TOKEN + 1
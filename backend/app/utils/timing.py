@@ -0,0 +1,55 @@
+from typing import Callable, Iterable, Iterator, List, TypeVar
+from contextlib import contextmanager
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+StageListener = Callable[[str, float], None]
+
+_listeners: List[StageListener] = []
+
+def add_stage_listener(listener: StageListener) -> None:
+    """Register a function called with (stage name, duration in seconds) after every stage"""
+    _listeners.append(listener)
+
+
+def remove_stage_listener(listener: StageListener) -> None:
+    """Unregister a stage listener"""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Report a completed stage to all listeners"""
+    for listener in list(_listeners):
+        try:
+            listener(name, seconds)
+        except Exception as e:
+            logger.error(f"Error in stage listener: {e}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def timed_iter(items: Iterable[T], name: str) -> Iterator[T]:
+    """Yield from an iterator, timing only the work done to produce each item"""
+    iterator = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            record_stage(name, time.perf_counter() - start)
+            return
+        record_stage(name, time.perf_counter() - start)
+        yield item
@@ -0,0 +1,43 @@
+from typing import Callable
+from functools import lru_cache
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Pieces that BPE tokenizers rarely merge across: letter runs, digits, punctuation runs
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]+")
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimate the tokens in text without a tokenizer
+
+    Short words are one token, long ones a token per seven or so letters,
+    and digits are tokenized three at a time, as with OpenAI's encodings.
+    """
+    count = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece[0].isdigit():
+            count += (len(piece) + 2) // 3
+        else:
+            count += 1 + (len(piece) - 1) // 7
+    return count
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding_name: str) -> Callable[[str], int]:
+    """
+    Get a function that counts tokens with the named tiktoken encoding
+
+    tiktoken downloads an encoding the first time it is used (or reads it
+    from TIKTOKEN_CACHE_DIR). If it isn't installed or the encoding can't
+    be fetched, e.g. offline, counts are approximated instead.
+    """
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Tokenizer {encoding_name} unavailable, approximating token counts: {e}")
+        return approximate_token_count
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,186 @@
+"""
+Measure chat latency of well-behaved sessions while one session floods the worker
+
+Each mode runs the app in a child process behind httpx's ASGI transport,
+with the stand-ins in benchmarks/fakes.py, once with admission control
+turned off and once with it on. Polite users each have their own session
+and ask questions one after another. A greedy session meanwhile keeps
+many chat requests and uploads in flight at once; like a well-behaved
+client it waits for Retry-After when it is turned away.
+
+Polite latency counts only answered requests; rejections are reported
+separately.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_admission --polite 16 --greedy-chats 48 --greedy-uploads 8 --duration 20
+"""
+from typing import Any, Dict, List
+from collections import Counter
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _child(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    from main import app
+    from app.services.container import services
+    from benchmarks.fakes import LatencyEmbeddings, FakeChatModel
+    from benchmarks.load_test import WORDS, _document
+
+    rag_service = services.rag_service
+    rag_service.embeddings = rag_service._build_embeddings(LatencyEmbeddings())
+    rag_service.llm = FakeChatModel(first_token_latency=args.llm_first_token_latency)
+
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app)
+
+    def client() -> Any:
+        return httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None)
+
+    async def upload(c: Any) -> int:
+        body = _document(rng, args.paragraphs).encode("utf-8")
+        response = await c.post("/api/upload", files=[("files", (f"{rng.random()}.txt", body, "text/plain"))])
+        if response.status_code != 200:
+            return response.status_code
+        job_id = response.json()["job_id"]
+        while (await c.get(f"/api/upload/{job_id}")).json()["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.05)
+        return 200
+
+    def question() -> str:
+        return "What does the document say about " + " and ".join(rng.sample(WORDS, 3)) + "?"
+
+    polite = [client() for _ in range(args.polite)]
+    greedy = client()
+    for c in [*polite, greedy]:
+        if await upload(c) != 200:
+            raise RuntimeError("Setup upload failed")
+
+    deadline = time.perf_counter() + args.duration
+    latencies: List[float] = []
+    polite_statuses: Counter = Counter()
+    greedy_statuses: Counter = Counter()
+
+    async def backoff(response: Any) -> None:
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+    async def polite_user(c: Any) -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await c.post("/api/chat", json={"text": question()})
+            polite_statuses[response.status_code] += 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                await backoff(response)
+
+    async def greedy_chat() -> None:
+        while time.perf_counter() < deadline:
+            response = await greedy.post("/api/chat", json={"text": question()})
+            greedy_statuses[f"chat_{response.status_code}"] += 1
+            if response.status_code != 200:
+                await backoff(response)
+
+    async def greedy_upload() -> None:
+        while time.perf_counter() < deadline:
+            status = await upload(greedy)
+            greedy_statuses[f"upload_{status}"] += 1
+            if status != 200:
+                await asyncio.sleep(1)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(polite_user(c) for c in polite),
+        *(greedy_chat() for _ in range(args.greedy_chats)),
+        *(greedy_upload() for _ in range(args.greedy_uploads))
+    )
+    elapsed = time.perf_counter() - start
+    for c in [*polite, greedy]:
+        await c.aclose()
+    services.shutdown()
+
+    values = np.array(latencies) * 1000
+    return {
+        "elapsed_s": elapsed,
+        "polite_answered": len(latencies),
+        "polite_rps": len(latencies) / elapsed,
+        "polite_p50_ms": float(np.percentile(values, 50)) if len(values) else None,
+        "polite_p95_ms": float(np.percentile(values, 95)) if len(values) else None,
+        "polite_statuses": {str(k): v for k, v in polite_statuses.items()},
+        "greedy_statuses": dict(greedy_statuses),
+    }
+
+
+def run_child(args: argparse.Namespace, admission: bool) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench_admission_") as directory:
+        env = dict(
+            os.environ,
+            PYTHONPATH=BACKEND_DIR,
+            OPENAI_API_KEY="sk-offline-benchmark",
+            UPLOAD_DIR=os.path.join(directory, "uploads"),
+            VECTOR_DB_PATH=os.path.join(directory, "chroma_db"),
+            EMBEDDING_CACHE_PATH=os.path.join(directory, "embedding_cache.sqlite3"),
+            SESSION_DB_PATH=os.path.join(directory, "sessions.sqlite3"),
+            ANSWER_CACHE_ENABLED="false",
+            HISTORY_SUMMARY_ENABLED="false",
+            ADMISSION_ENABLED=str(admission).lower(),
+            ADMISSION_MAX_CONCURRENT=str(args.max_concurrent),
+        )
+        command = [
+            sys.executable, "-m", "benchmarks.bench_admission", "--child",
+            "--polite", str(args.polite), "--greedy-chats", str(args.greedy_chats),
+            "--greedy-uploads", str(args.greedy_uploads), "--duration", str(args.duration),
+            "--paragraphs", str(args.paragraphs), "--llm-first-token-latency", str(args.llm_first_token_latency),
+            "--seed", str(args.seed),
+        ]
+        completed = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=1800)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-3000:])
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polite", type=int, default=16, help="Sessions asking one question at a time")
+    parser.add_argument("--greedy-chats", type=int, default=48, help="Chat requests the greedy session keeps in flight")
+    parser.add_argument("--greedy-uploads", type=int, default=8, help="Uploads the greedy session keeps in flight")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load per mode")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="ADMISSION_MAX_CONCURRENT when enabled")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs in each uploaded file")
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args))))
+        return
+
+    modes = {"off": run_child(args, admission=False), "on": run_child(args, admission=True)}
+
+    print(f"{'admission':>10}{'polite answered':>17}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}  rejected / greedy outcomes")
+    for name, mode in modes.items():
+        rejected = sum(count for status, count in mode["polite_statuses"].items() if status != "200")
+        print(f"{name:>10}{mode['polite_answered']:>17}{mode['polite_rps']:>8.2f}"
+              f"{mode['polite_p50_ms']:>9.0f}{mode['polite_p95_ms']:>9.0f}  {rejected} / {mode['greedy_statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "modes": modes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
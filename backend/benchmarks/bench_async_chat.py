@@ -0,0 +1,218 @@
+"""
+Measure /api/chat throughput of one worker as concurrent requests grow
+
+The app runs in a child process behind httpx's ASGI transport, the way a
+single uvicorn worker would serve it, and talks to OpenAI through the real
+langchain clients pointed at the local mock server in
+benchmarks/fake_openai_server.py. That server runs in this process and
+answers chat completions after a time to first token plus a delay per
+token, so a worker that awaits the LLM can overlap requests and one that
+blocks on it cannot.
+
+Each virtual user has its own session holding the same uploaded document
+and sends questions one after another; the number of users is the
+concurrency. The answer cache and history summaries are turned off so every
+request runs the whole query path.
+
+Pass --app-dir with the backend directory of another checkout to measure
+it the same way, e.g. a worktree of an older revision.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_async_chat --concurrency 1 8 32 --requests 64
+"""
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SDKEmbeddings(Embeddings):
+    """
+    Calls the embeddings endpoint through openai SDK clients
+
+    OpenAIEmbeddings counts tokens with tiktoken first, which downloads its
+    encoding; this sends the texts as they are.
+    """
+
+    def __init__(self, client: Any, async_client: Any):
+        self.client = client
+        self.async_client = async_client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.create(input=texts, model="text-embedding-ada-002")
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        response = await self.async_client.create(input=texts, model="text-embedding-ada-002")
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+async def _child(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    import openai
+
+    from main import app
+    from benchmarks.load_test import WORDS, _document
+    try:
+        from app.services.container import services
+        rag_service = services.rag_service
+    except ImportError:
+        # Revisions before the service container
+        from app.services.rag_service import rag_service
+
+    clients = getattr(rag_service, "openai_clients", None)
+    if clients is not None:
+        embeddings = SDKEmbeddings(**clients.embeddings_kwargs())
+    else:
+        embeddings = SDKEmbeddings(
+            openai.OpenAI(base_url=args.base_url, max_retries=0).embeddings,
+            openai.AsyncOpenAI(base_url=args.base_url, max_retries=0).embeddings
+        )
+    rag_service.embeddings = rag_service._build_embeddings(embeddings)
+
+    rng = random.Random(args.seed)
+    body = _document(rng, args.paragraphs).encode("utf-8")
+    transport = httpx.ASGITransport(app=app)
+    users = [
+        httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None)
+        for _ in range(max(args.concurrency))
+    ]
+
+    # Every session gets the same file; after the first it is linked rather than embedded again
+    for client in users:
+        response = await client.post("/api/upload", files=[("files", ("document.txt", body, "text/plain"))])
+        job_id = response.json()["job_id"]
+        while (job := (await client.get(f"/api/upload/{job_id}")).json())["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.05)
+        if job["status"] == "failed":
+            raise RuntimeError(f"Upload failed: {job['files'][0]['error']}")
+
+    def question() -> str:
+        return "What does the document say about " + " and ".join(rng.sample(WORDS, 3)) + "?"
+
+    # Build the chains and open connections before timing
+    await users[0].post("/api/chat", json={"text": question()})
+
+    levels = []
+    for concurrency in args.concurrency:
+        latencies: List[float] = []
+        errors = 0
+
+        async def user(client: Any, count: int) -> None:
+            nonlocal errors
+            for _ in range(count):
+                start = time.perf_counter()
+                response = await client.post("/api/chat", json={"text": question()})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200 or response.json()["reply"].startswith("Sorry"):
+                    errors += 1
+
+        per_user = max(1, args.requests // concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, per_user) for client in users[:concurrency]))
+        elapsed = time.perf_counter() - start
+        values = np.array(latencies) * 1000
+        levels.append({
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "errors": errors,
+        })
+
+    for client in users:
+        await client.aclose()
+    return {"levels": levels}
+
+
+def run_child(app_dir: str, args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench_async_chat_") as directory:
+        env = dict(
+            os.environ,
+            PYTHONPATH=app_dir,
+            OPENAI_API_KEY="sk-offline-benchmark",
+            # OPENAI_API_BASE is read by langchain_openai in revisions without OPENAI_BASE_URL
+            OPENAI_BASE_URL=base_url,
+            OPENAI_API_BASE=base_url,
+            UPLOAD_DIR=os.path.join(directory, "uploads"),
+            VECTOR_DB_PATH=os.path.join(directory, "chroma_db"),
+            EMBEDDING_CACHE_PATH=os.path.join(directory, "embedding_cache.sqlite3"),
+            SESSION_DB_PATH=os.path.join(directory, "sessions.sqlite3"),
+            ANSWER_CACHE_ENABLED="false",
+            HISTORY_SUMMARY_ENABLED="false",
+        )
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child", "--base-url", base_url,
+            "--concurrency", *map(str, args.concurrency), "--requests", str(args.requests),
+            "--paragraphs", str(args.paragraphs), "--seed", str(args.seed),
+        ]
+        completed = subprocess.run(command, cwd=app_dir, env=env, capture_output=True, text=True, timeout=1800)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-3000:])
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="Chat requests at each concurrency")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs in the uploaded file")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Mock LLM seconds before the reply starts")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Mock LLM seconds per further token")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Mock seconds per embedding request")
+    parser.add_argument("--app-dir", default=BACKEND_DIR, help="Backend directory of the checkout to measure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    # Used by the child process
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args))))
+        return
+
+    from benchmarks.fake_openai_server import FakeOpenAIServer, create_app
+
+    app_dir = os.path.abspath(args.app_dir)
+    server_app = create_app(
+        latency=args.embedding_latency,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency
+    )
+    with FakeOpenAIServer(server_app) as server:
+        results = run_child(app_dir, args, server.base_url)
+        results["server"] = server.stats
+
+    print(f"{app_dir}")
+    print(f"{'concurrency':>12}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for level in results["levels"]:
+        print(f"{level['concurrency']:>12}{level['requests']:>10}{level['throughput_rps']:>10.2f}"
+              f"{level['p50_ms']:>10.0f}{level['p95_ms']:>10.0f}{level['errors']:>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), **results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Measure how much duplicate work single-flight coalescing saves
+
+The app runs in-process behind httpx's ASGI transport with the stand-ins
+in benchmarks/fakes.py, once with coalescing turned off and once with it
+on. Two kinds of duplicate load are sent in each mode:
+
+- chat: every session asks each question several times at once, the way a
+  resubmitted form or a client retrying after a timeout would
+- upload: several new sessions upload the same file at the same moment,
+  before any of them has been recorded for deduplication
+
+The answer and embedding caches are turned off, so the only thing that can
+save work is coalescing requests while they are in flight.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_coalescing --sessions 4 --duplicates 4 --questions 5 --uploaders 8
+"""
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.load_test import StageRecorder, WORDS, _configure_environment, _document
+
+
+def _set_coalescing(rag_service: Any, enabled: bool) -> None:
+    rag_service._chat_flight.enabled = enabled
+    rag_service.embedding_scheduler._batches.enabled = enabled
+    rag_service.embedding_scheduler._queries.enabled = enabled
+
+
+def _coalesced_total() -> float:
+    from app.core.metrics import single_flight_calls
+    return sum(
+        single_flight_calls.value(kind=kind, outcome="coalesced")
+        for kind in ("chat", "embedding_batch", "query_embedding")
+    )
+
+
+async def _upload(client: Any, name: str, body: bytes) -> None:
+    response = await client.post("/api/upload", files=[("files", (name, body, "text/plain"))])
+    job_id = response.json()["job_id"]
+    while (job := (await client.get(f"/api/upload/{job_id}")).json())["status"] not in ("completed", "failed"):
+        await asyncio.sleep(0.02)
+    if job["status"] == "failed":
+        raise RuntimeError(f"Upload failed: {job['files'][0]['error']}")
+
+
+async def _run_mode(app: Any, rag_service: Any, embeddings: Any, recorder: StageRecorder,
+                    args: argparse.Namespace, enabled: bool) -> Dict[str, Any]:
+    import httpx
+
+    _set_coalescing(rag_service, enabled)
+    # Fresh documents per mode, so the second isn't served by the first's deduplication records
+    rng = random.Random(args.seed * 2 + enabled)
+    transport = httpx.ASGITransport(app=app)
+
+    def client() -> Any:
+        return httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None)
+
+    # Concurrent uploads of one file to new sessions
+    body = _document(rng, args.paragraphs).encode("utf-8")
+    uploaders = [client() for _ in range(args.uploaders)]
+    calls_before = embeddings.calls
+    start = time.perf_counter()
+    await asyncio.gather(*(_upload(c, "shared.txt", body) for c in uploaders))
+    upload_seconds = time.perf_counter() - start
+    upload_calls = embeddings.calls - calls_before
+    for c in uploaders:
+        await c.aclose()
+
+    # Bursts of identical questions within each session
+    sessions = [client() for _ in range(args.sessions)]
+    for i, c in enumerate(sessions):
+        await _upload(c, f"session_{i}.txt", _document(rng, args.paragraphs).encode("utf-8"))
+
+    latencies: List[float] = []
+    errors = 0
+
+    async def ask(c: Any, question: str) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        response = await c.post("/api/chat", json={"text": question})
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200 or response.json()["reply"].startswith("Sorry"):
+            errors += 1
+
+    answers_before = len(recorder.samples["llm_answer"])
+    coalesced_before = _coalesced_total()
+    start = time.perf_counter()
+    for _ in range(args.questions):
+        await asyncio.gather(*(
+            ask(c, question)
+            for c in sessions
+            for question in ["What does the document say about " + " and ".join(rng.sample(WORDS, 2)) + "?"]
+            for _ in range(args.duplicates)
+        ))
+    chat_seconds = time.perf_counter() - start
+    for c in sessions:
+        await c.aclose()
+
+    values = np.array(latencies) * 1000
+    return {
+        "coalescing": enabled,
+        "upload_s": upload_seconds,
+        "upload_embedding_calls": upload_calls,
+        "chat_requests": len(latencies),
+        "chat_llm_calls": len(recorder.samples["llm_answer"]) - answers_before,
+        "chat_s": chat_seconds,
+        "chat_p50_ms": float(np.percentile(values, 50)),
+        "chat_p95_ms": float(np.percentile(values, 95)),
+        "chat_errors": errors,
+        "coalesced": _coalesced_total() - coalesced_before,
+    }
+
+
+async def _run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    # Imported here so the environment is in place before settings load
+    from main import app
+    from app.services.container import services
+    from app.utils.timing import add_stage_listener, remove_stage_listener
+    from benchmarks.fakes import LatencyEmbeddings, FakeChatModel
+
+    rag_service = services.rag_service
+    embeddings = LatencyEmbeddings(call_latency=args.embedding_call_latency)
+    rag_service.embeddings = rag_service._build_embeddings(embeddings)
+    rag_service.llm = FakeChatModel(first_token_latency=args.llm_first_token_latency)
+
+    recorder = StageRecorder()
+    add_stage_listener(recorder)
+    try:
+        return [
+            await _run_mode(app, rag_service, embeddings, recorder, args, enabled)
+            for enabled in (False, True)
+        ]
+    finally:
+        remove_stage_listener(recorder)
+        services.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="Sessions asking questions")
+    parser.add_argument("--duplicates", type=int, default=4, help="Identical requests per question and session")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per session")
+    parser.add_argument("--uploaders", type=int, default=8, help="Sessions uploading the same file at once")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs in each uploaded file")
+    parser.add_argument("--embedding-call-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        _configure_environment(data_dir, disable_caches=True)
+        os.environ["HISTORY_SUMMARY_ENABLED"] = "false"
+        modes = asyncio.run(_run(args))
+
+    print(f"{'coalescing':>11}{'upload s':>10}{'embed calls':>13}{'chat reqs':>11}{'LLM calls':>11}"
+          f"{'chat s':>8}{'p50 ms':>8}{'p95 ms':>8}{'coalesced':>11}")
+    for mode in modes:
+        print(f"{'on' if mode['coalescing'] else 'off':>11}{mode['upload_s']:>10.2f}{mode['upload_embedding_calls']:>13}"
+              f"{mode['chat_requests']:>11}{mode['chat_llm_calls']:>11}{mode['chat_s']:>8.2f}"
+              f"{mode['chat_p50_ms']:>8.0f}{mode['chat_p95_ms']:>8.0f}{mode['coalesced']:>11.0f}")
+        if mode["chat_errors"]:
+            print(f"  chat errors: {mode['chat_errors']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "modes": modes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
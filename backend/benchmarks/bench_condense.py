@@ -0,0 +1,147 @@
+"""
+Compare follow-up latency across the CONDENSE_MODE settings
+
+A synthetic document is indexed, then the same scripted conversations are
+replayed under each mode. Follow-ups mix standalone questions with ones
+that refer back to the previous turn ("how does it ..."). The fake chat
+model sleeps to simulate API latency; the "fast_model" run adds a faster
+stand-in as the rewrite model. The answer cache is disabled so every turn
+reaches the LLM.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_condense --conversations 10 --turns 4
+"""
+from typing import Any, Dict, List, Tuple
+from collections import defaultdict
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.load_test import WORDS, _configure_environment, _document
+
+COLLECTION = "bench_condense"
+
+MODES = (
+    ("always", "always", False),
+    ("heuristic", "heuristic", False),
+    ("speculative", "speculative", False),
+    ("fast_model", "always", True),
+    ("heuristic+fast_model", "heuristic", True),
+)
+
+
+def _conversation(rng: random.Random, turns: int) -> List[str]:
+    questions = ["What does the document say about " + " and ".join(rng.sample(WORDS, 2)) + "?"]
+    for turn in range(1, turns):
+        topic = rng.choice(WORDS)
+        if turn % 2:
+            questions.append(f"How does it affect the {topic}?")
+        else:
+            questions.append(f"What does the document say about the {topic} schedule?")
+    return questions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=4, help="Questions per conversation, including the first")
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--embedding-call-latency", type=float, default=0.08, help="Seconds per embedding request")
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.4)
+    parser.add_argument("--llm-token-latency", type=float, default=0.01)
+    parser.add_argument("--fast-first-token-latency", type=float, default=0.15)
+    parser.add_argument("--fast-token-latency", type=float, default=0.003)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        _configure_environment(data_dir, disable_caches=True)
+        results = _run(args, data_dir)
+
+    baseline = results[0]["follow_up"]["mean_ms"]
+    print(f"\n{'mode':<22}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'rewrites':>10}{'speedup':>9}")
+    for row in results:
+        stats = row["follow_up"]
+        print(f"{row['mode']:<22}{stats['mean_ms']:>9.0f}{stats['p50_ms']:>9.0f}{stats['p95_ms']:>9.0f}"
+              f"{row['rewrites']:>10}{baseline / stats['mean_ms']:>8.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+def _run(args: argparse.Namespace, data_dir: str) -> List[Dict[str, Any]]:
+    from app.core.config import settings
+    from app.services.container import services
+    from app.services.vectorstore_registry import vectorstore_registry
+    from app.utils.timing import add_stage_listener, remove_stage_listener
+    from benchmarks.fakes import LatencyEmbeddings, FakeChatModel
+
+    rag_service = services.rag_service
+    rag_service.embeddings = rag_service._build_embeddings(
+        LatencyEmbeddings(dim=256, call_latency=args.embedding_call_latency, text_latency=0.0)
+    )
+    rag_service.llm = FakeChatModel(
+        first_token_latency=args.llm_first_token_latency,
+        token_latency=args.llm_token_latency
+    )
+    fast_llm = FakeChatModel(
+        first_token_latency=args.fast_first_token_latency,
+        token_latency=args.fast_token_latency
+    )
+
+    path = os.path.join(data_dir, "document.txt")
+    with open(path, "w") as f:
+        f.write(_document(random.Random(args.seed), args.paragraphs))
+    rag_service.ingest_file(path, ".txt", COLLECTION)
+
+    rng = random.Random(args.seed)
+    conversations = [_conversation(rng, args.turns) for _ in range(args.conversations)]
+
+    stage_counts: Dict[str, int] = defaultdict(int)
+    listener = lambda name, seconds: stage_counts.__setitem__(name, stage_counts[name] + 1)
+    add_stage_listener(listener)
+
+    results = []
+    try:
+        for name, mode, use_fast_model in MODES:
+            settings.CONDENSE_MODE = mode
+            rag_service.condense_llm = fast_llm if use_fast_model else None
+            # Rebuild the cached chain so it picks up the rewrite model
+            vectorstore_registry.invalidate(COLLECTION)
+            stage_counts.clear()
+
+            follow_ups: List[float] = []
+            for questions in conversations:
+                history: List[Dict[str, Any]] = []
+                for turn, question in enumerate(questions):
+                    start = time.perf_counter()
+                    answer, _ = rag_service.query(question, COLLECTION, history)
+                    if turn:
+                        follow_ups.append(time.perf_counter() - start)
+                    history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+            values = np.array(follow_ups) * 1000
+            results.append({
+                "mode": name,
+                "follow_up": {
+                    "count": len(follow_ups),
+                    "mean_ms": float(values.mean()),
+                    "p50_ms": float(np.percentile(values, 50)),
+                    "p95_ms": float(np.percentile(values, 95)),
+                },
+                "rewrites": stage_counts["llm_condense"],
+            })
+    finally:
+        remove_stage_listener(listener)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Measure embedding throughput against a rate-limited local fake OpenAI API
+
+The fake server (benchmarks/fake_openai_server.py) enforces a requests-per-
+minute limit with 429s and fails a small fraction of requests at random.
+The same texts are embedded by:
+
+- "serial": one SDK call per 1000 texts, relying on the SDK's own two
+  retries. This is how OpenAIEmbeddings sends an upload without the scheduler.
+- EmbeddingScheduler with several batch sizes and concurrency levels,
+  with and without client-side rate limiting.
+
+Requests go through the openai SDK, the same call OpenAIEmbeddings makes.
+OpenAIEmbeddings itself is not used because its tiktoken pre-tokenization
+needs to download the tokenizer.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_embedding_scheduler --texts 4000 --rpm 600
+"""
+from typing import Any, Dict, List
+import argparse
+import json
+import logging
+import random
+import time
+
+import openai
+from langchain.schema.embeddings import Embeddings
+
+from app.services.embedding_scheduler import EmbeddingScheduler
+from benchmarks.fake_openai_server import FakeOpenAIServer, create_app
+from benchmarks.load_test import WORDS
+
+
+class SDKEmbeddings(Embeddings):
+    """Calls the embeddings endpoint through the openai SDK"""
+
+    def __init__(self, base_url: str, max_retries: int, chunk_size: int = 1000):
+        self.client = openai.OpenAI(api_key="sk-offline-benchmark", base_url=base_url, max_retries=max_retries)
+        self.chunk_size = chunk_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.chunk_size):
+            response = self.client.embeddings.create(
+                input=texts[start:start + self.chunk_size], model="text-embedding-ada-002"
+            )
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _run(name: str, embeddings: Embeddings, texts: List[str], server: FakeOpenAIServer) -> Dict[str, Any]:
+    before = server.stats
+    start = time.perf_counter()
+    error = None
+    try:
+        vectors = embeddings.embed_documents(texts)
+        assert len(vectors) == len(texts)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - start
+    after = server.stats
+    row = {
+        "name": name,
+        "seconds": elapsed,
+        "texts_per_second": len(texts) / elapsed if error is None else 0.0,
+        "requests": after["requests"] - before["requests"],
+        "rate_limited": after["rate_limited"] - before["rate_limited"],
+        "random_errors": after["errors"] - before["errors"],
+        "error": error,
+    }
+    if isinstance(embeddings, EmbeddingScheduler):
+        row.update({key: value for key, value in embeddings.stats().items() if key != "requests"})
+        embeddings.shutdown()
+    status = "ok" if error is None else "FAILED"
+    print(f"{name:<34}{elapsed:>8.1f}s{row['texts_per_second']:>10.0f}/s{row['requests']:>7} req"
+          f"{row['rate_limited']:>6} 429s  {status}")
+    return row
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=4000)
+    parser.add_argument("--rpm", type=float, default=600, help="Server request limit per minute")
+    parser.add_argument("--latency", type=float, default=0.05, help="Server seconds per request")
+    parser.add_argument("--text-latency", type=float, default=0.0005, help="Server seconds per text")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Fraction of requests failing at random")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    # Retries are expected here; they are counted in the results instead of logged
+    logging.getLogger("app.services.embedding_scheduler").setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    texts = [" ".join(rng.choices(WORDS, k=40)) + f" #{i}" for i in range(args.texts)]
+    app = create_app(latency=args.latency, text_latency=args.text_latency, rpm=args.rpm,
+                     error_rate=args.error_rate, seed=args.seed)
+
+    results = []
+    with FakeOpenAIServer(app) as server:
+        results.append(_run("serial, 1000 per request", SDKEmbeddings(server.base_url, max_retries=2), texts, server))
+        for batch_size, concurrency, client_rpm in ((128, 1, args.rpm), (128, 4, 0), (128, 4, args.rpm),
+                                                    (64, 8, args.rpm), (256, 8, args.rpm)):
+            scheduler = EmbeddingScheduler(
+                SDKEmbeddings(server.base_url, max_retries=0),
+                batch_size=batch_size,
+                max_concurrency=concurrency,
+                requests_per_minute=client_rpm,
+                max_retries=8,
+                retry_base_seconds=0.25
+            )
+            limit = f"{client_rpm:.0f} rpm" if client_rpm else "no limit"
+            name = f"batch {batch_size} x{concurrency}, {limit}"
+            results.append(_run(name, scheduler, texts, server))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compare vector-only, BM25-only and hybrid retrieval on a synthetic catalogue
+
+Each chunk describes one product with a unique SKU code; each query asks for
+a SKU, so the relevant chunk is known. Embeddings come from the offline
+HashingEmbeddings stand-in, which (like real dense models) ignores codes.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_hybrid_retrieval --chunks 20000 --queries 200
+"""
+from typing import List, Dict, Any
+import argparse
+import json
+import random
+import statistics
+import time
+import uuid
+
+import chromadb
+from langchain.schema import Document
+from langchain_community.vectorstores import Chroma
+
+from app.services.bm25_index import BM25Index
+from app.services.retrievers import HybridRetriever
+from benchmarks.fakes import HashingEmbeddings
+
+ADJECTIVES = ["lightweight", "durable", "classic", "premium", "compact", "waterproof", "organic"]
+PRODUCTS = ["jacket", "backpack", "sneaker", "tent", "bottle", "lamp", "blanket", "helmet"]
+COLORS = ["red", "blue", "green", "black", "white", "orange", "grey"]
+
+
+def make_corpus(n_chunks: int, seed: int) -> List[Document]:
+    rng = random.Random(seed)
+    documents = []
+    for i in range(n_chunks):
+        sku = f"{rng.choice('ABCDEFGH')}{rng.choice('KLMNPQRS')}-{i:06d}"
+        text = (
+            f"SKU {sku}: {rng.choice(ADJECTIVES)} {rng.choice(PRODUCTS)} in {rng.choice(COLORS)}, "
+            f"price {rng.randint(5, 500)} USD, stock {rng.randint(0, 900)} units."
+        )
+        documents.append(Document(page_content=text, metadata={"chunk_id": str(uuid.uuid4()), "sku": sku}))
+    return documents
+
+
+def measure(name: str, search, queries: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        docs = search(query["text"])[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += any(doc.metadata.get("chunk_id") == query["chunk_id"] for doc in docs)
+
+    latencies.sort()
+    return {
+        "mode": name,
+        "recall_at_k": hits / len(queries),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    documents = make_corpus(args.chunks, args.seed)
+    chunk_ids = [doc.metadata["chunk_id"] for doc in documents]
+
+    start = time.perf_counter()
+    vectorstore = Chroma(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"bench_{uuid.uuid4().hex}",
+        embedding_function=HashingEmbeddings()
+    )
+    for i in range(0, len(documents), 1000):
+        vectorstore.add_documents(documents[i:i + 1000], ids=chunk_ids[i:i + 1000])
+    vector_build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lexical_index = BM25Index()
+    lexical_index.add(chunk_ids, [d.page_content for d in documents], [d.metadata for d in documents])
+    bm25_build_s = time.perf_counter() - start
+
+    rng = random.Random(args.seed + 1)
+    queries = [
+        {"text": f"What is the price of {doc.metadata['sku']}?", "chunk_id": doc.metadata["chunk_id"]}
+        for doc in rng.sample(documents, min(args.queries, len(documents)))
+    ]
+
+    hybrid = HybridRetriever(
+        vectorstore=vectorstore,
+        get_lexical_index=lambda: lexical_index,
+        k=args.k,
+        fetch_k=args.fetch_k
+    )
+    results = [
+        measure("vector", lambda q: vectorstore.similarity_search(q, k=args.k), queries, args.k),
+        measure("bm25", lambda q: lexical_index.get_documents(lexical_index.search(q, args.k)), queries, args.k),
+        measure("hybrid", hybrid.get_relevant_documents, queries, args.k),
+    ]
+
+    report = {
+        "chunks": args.chunks,
+        "queries": len(queries),
+        "k": args.k,
+        "vector_build_s": vector_build_s,
+        "bm25_build_s": bm25_build_s,
+        "results": results,
+    }
+
+    print(f"{args.chunks} chunks, {len(queries)} queries, k={args.k}")
+    print(f"build: vector {vector_build_s:.1f}s, bm25 {bm25_build_s:.1f}s")
+    print(f"{'mode':<8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in results:
+        print(f"{row['mode']:<8} {row['recall_at_k']:>9.3f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
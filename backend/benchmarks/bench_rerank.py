@@ -0,0 +1,192 @@
+"""
+Compare what reaches the LLM with and without the reranking stage
+
+The synthetic corpus has one section per topic, and each section also
+appears as a lightly revised copy (as with policy versions or repeated
+templates), so retrieval returns near-duplicate chunks next to the
+overlapping windows produced by the 200-character chunk overlap. Each
+query asks about one topic.
+
+For every mode the report shows the chunks and estimated prompt tokens
+sent to the LLM, the share of on-topic chunks, the number of useful
+chunks (on-topic, counting a chunk and its revised copy once), the share
+of distinct text among them (lower means more repeated text) and the
+retrieval latency including reranking.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_rerank --topics 200 --queries 200
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import random
+import statistics
+import string
+import time
+import uuid
+
+import chromadb
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+
+from app.services.bm25_index import BM25Index
+from app.services.reranker import MMRReranker
+from app.services.retrievers import HybridRetriever, RerankingRetriever
+from app.services.vector_stores import ChromaVectorStore
+from app.utils.text_utils import estimate_tokens
+from benchmarks.fakes import HashingEmbeddings
+
+COMMON_WORDS = "the and for with that from this will are have each about when".split()
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 9)))
+
+
+def _sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    words = [rng.choice(vocabulary) if rng.random() < 0.6 else rng.choice(COMMON_WORDS) for _ in range(16)]
+    return " ".join(words).capitalize() + "."
+
+
+def make_corpus(topics: int, seed: int) -> List[Dict[str, Any]]:
+    """Build topic sections, each followed later by a revised copy"""
+    rng = random.Random(seed)
+    sections = []
+    for topic in range(topics):
+        vocabulary = [_word(rng) for _ in range(30)]
+        paragraphs = [" ".join(_sentence(rng, vocabulary) for _ in range(5)) for _ in range(rng.randint(3, 5))]
+        sections.append({"topic": topic, "vocabulary": vocabulary, "paragraphs": paragraphs})
+
+    revised = []
+    for section in sections:
+        # Change roughly one word in twenty
+        paragraphs = [
+            " ".join(rng.choice(section["vocabulary"]) if rng.random() < 0.05 else word for word in paragraph.split())
+            for paragraph in section["paragraphs"]
+        ]
+        revised.append(dict(section, paragraphs=paragraphs))
+    return sections + revised
+
+
+def split_corpus(sections: List[Dict[str, Any]], splitter: Optional[TextSplitter] = None) -> List[Document]:
+    splitter = splitter or RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    documents = []
+    for section in sections:
+        text = "\n\n".join(section["paragraphs"])
+        for part, doc in enumerate(splitter.create_documents([text], metadatas=[{"topic": section["topic"]}])):
+            # A chunk and its counterpart in the revised copy share a part number
+            doc.metadata.update(chunk_id=str(uuid.uuid4()), part=part)
+            documents.append(doc)
+    return documents
+
+
+def measure(name: str, retriever, queries: List[Dict[str, Any]],
+            count_tokens: Callable[[str], int] = estimate_tokens) -> Dict[str, Any]:
+    latencies = []
+    chunks = []
+    tokens = []
+    on_topic = []
+    useful = []
+    distinct = []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.get_relevant_documents(query["text"])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        chunks.append(len(docs))
+        tokens.append(sum(count_tokens(doc.page_content) for doc in docs))
+        relevant = [doc for doc in docs if doc.metadata["topic"] == query["topic"]]
+        on_topic.append(len(relevant) / max(1, len(docs)))
+        useful.append(len({doc.metadata["part"] for doc in relevant}))
+        shingles = [" ".join(words[i:i + 5]) for words in (doc.page_content.split() for doc in docs)
+                    for i in range(len(words) - 4)]
+        distinct.append(len(set(shingles)) / max(1, len(shingles)))
+
+    latencies.sort()
+    return {
+        "mode": name,
+        "chunks": statistics.mean(chunks),
+        "prompt_tokens": statistics.mean(tokens),
+        "prompt_tokens_max": max(tokens),
+        "on_topic": statistics.mean(on_topic),
+        "useful_chunks": statistics.mean(useful),
+        "distinct_text": statistics.mean(distinct),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="Chunks sent without reranking")
+    parser.add_argument("--rerank-k", type=int, default=4, help="Chunks sent after reranking")
+    parser.add_argument("--fetch-k", type=int, default=20, help="Candidates fetched for reranking")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    sections = make_corpus(args.topics, args.seed)
+    documents = split_corpus(sections)
+    chunk_ids = [doc.metadata["chunk_id"] for doc in documents]
+
+    embeddings = HashingEmbeddings()
+    vectorstore = ChromaVectorStore(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"bench_{uuid.uuid4().hex}",
+        embedding_function=embeddings
+    )
+    for i in range(0, len(documents), 1000):
+        vectorstore.add_documents(documents[i:i + 1000], ids=chunk_ids[i:i + 1000])
+    lexical_index = BM25Index()
+    lexical_index.add(chunk_ids, [d.page_content for d in documents], [d.metadata for d in documents])
+
+    rng = random.Random(args.seed + 1)
+    queries = []
+    for _ in range(args.queries):
+        section = rng.choice(sections[:args.topics])
+        queries.append({
+            "text": "Explain " + " ".join(rng.sample(section["vocabulary"], 6)),
+            "topic": section["topic"],
+        })
+
+    def hybrid(k: int) -> HybridRetriever:
+        return HybridRetriever(
+            vectorstore=vectorstore,
+            get_lexical_index=lambda: lexical_index,
+            k=k,
+            fetch_k=max(args.fetch_k, k)
+        )
+
+    def reranked(budget_ms: float, lambda_mult: float = 0.9) -> RerankingRetriever:
+        return RerankingRetriever(
+            base_retriever=hybrid(args.fetch_k),
+            reranker=MMRReranker(vectorstore, embeddings, lambda_mult=lambda_mult, rank_weight=0.5),
+            k=args.rerank_k,
+            budget_seconds=budget_ms / 1000
+        )
+
+    results = [
+        measure(f"hybrid top {args.k}", hybrid(args.k), queries),
+        measure(f"mmr top {args.rerank_k}, lambda 0.5", reranked(50, lambda_mult=0.5), queries),
+        measure(f"mmr top {args.rerank_k}, lambda 0.7", reranked(50, lambda_mult=0.7), queries),
+        measure(f"mmr top {args.rerank_k}, lambda 0.9", reranked(50), queries),
+        measure(f"mmr top {args.rerank_k}, lambda 1", reranked(50, lambda_mult=1.0), queries),
+        measure(f"mmr top {args.rerank_k}, lambda 0.9, 0.01 ms budget", reranked(0.01), queries),
+    ]
+
+    print(f"{len(documents)} chunks, {len(queries)} queries")
+    print(f"{'mode':<40}{'chunks':>7}{'tokens':>8}{'on topic':>10}{'useful':>8}{'distinct':>10}{'p50 ms':>8}{'p95 ms':>8}")
+    for row in results:
+        print(f"{row['mode']:<40}{row['chunks']:>7.1f}{row['prompt_tokens']:>8.0f}{row['on_topic']:>10.2f}"
+              f"{row['useful_chunks']:>8.2f}"
+              f"{row['distinct_text']:>10.2f}{row['p50_ms']:>8.2f}{row['p95_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure how long a worker process takes to import the app, start and become ready
+
+Each repeat runs in a fresh process with its own data directories:
+"import" is the time to import main, "first response" the time until
+/healthcheck answers (import plus startup), and "ready" the time until
+/ready reports the services warmed up. Checkouts without /ready count as
+ready once startup finishes. "parse worker" is the time a spawned ingestion
+process takes to import the module holding the parse function, which it
+does before parsing its first file on platforms that spawn rather than fork.
+
+Pass --app-dir with the backend directory of another checkout to measure
+it the same way, e.g. a worktree of an older revision.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --repeats 5
+"""
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child() -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    with TestClient(main.app) as client:
+        client.get("/healthcheck")
+        first_response = time.perf_counter()
+        while client.get("/ready").status_code == 503:
+            time.sleep(0.01)
+        ready = time.perf_counter()
+        from app.services import ingestion
+        module = ingestion.load_and_split_file.__module__
+    return {
+        "import_s": imported - start,
+        "first_response_s": first_response - start,
+        "ready_s": ready - start,
+        "parse_module": module,
+    }
+
+
+def worker(module: str) -> Dict[str, Any]:
+    import importlib
+
+    start = time.perf_counter()
+    importlib.import_module(module)
+    return {"parse_worker_s": time.perf_counter() - start}
+
+
+def run(app_dir: str, *phase: str) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as directory:
+        env = dict(
+            os.environ,
+            PYTHONPATH=app_dir,
+            OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-bench"),
+            UPLOAD_DIR=os.path.join(directory, "uploads"),
+            VECTOR_DB_PATH=os.path.join(directory, "chroma_db"),
+            EMBEDDING_CACHE_PATH=os.path.join(directory, "embedding_cache.sqlite3"),
+            SESSION_DB_PATH=os.path.join(directory, "sessions.sqlite3"),
+        )
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--phase", *phase],
+            cwd=app_dir, env=env, capture_output=True, text=True, timeout=300
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--app-dir", default=BACKEND_DIR, help="Backend directory of the checkout to measure")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    # Used by the subprocesses
+    parser.add_argument("--phase", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        result = child() if args.phase[0] == "child" else worker(args.phase[1])
+        print(json.dumps(result))
+        return
+
+    app_dir = os.path.abspath(args.app_dir)
+    runs: List[Dict[str, Any]] = []
+    for _ in range(args.repeats):
+        result = run(app_dir, "child")
+        result.update(run(app_dir, "worker", result["parse_module"]))
+        runs.append(result)
+
+    summary = {
+        name: statistics.median(r[name] for r in runs)
+        for name in ("import_s", "first_response_s", "ready_s", "parse_worker_s")
+    }
+    print(f"{app_dir} (median of {args.repeats})")
+    print(f"  import          {summary['import_s']:.2f}s")
+    print(f"  first response  {summary['first_response_s']:.2f}s")
+    print(f"  ready           {summary['ready_s']:.2f}s")
+    print(f"  parse worker    {summary['parse_worker_s']:.2f}s ({runs[0]['parse_module']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"app_dir": app_dir, "summary": summary, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
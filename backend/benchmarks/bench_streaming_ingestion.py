@@ -0,0 +1,152 @@
+"""
+Compare peak memory of eager and streaming ingestion on synthetic files
+
+For each size, a CSV, TXT and PDF file are generated and ingested twice:
+eagerly (load everything, split everything, embed everything) and through
+the streaming path (pages/rows -> incremental split -> bounded batches).
+Python heap peaks are measured with tracemalloc; embeddings come from the
+offline HashingEmbeddings stand-in and are discarded after each batch, as
+they would be once written to the vector store.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_streaming_ingestion --sizes 2 8 32
+"""
+from typing import Dict, Any, Callable, List
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.services.document_stream import (
+    CHUNK_SIZE, CHUNK_OVERLAP, load_and_split_file, iter_file_documents, iter_split_documents, iter_batches
+)
+from benchmarks.fakes import HashingEmbeddings
+
+WORDS = ("policy refund customer invoice shipment warehouse contract renewal account "
+         "balance payment schedule discount product support ticket").split()
+
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=12)).capitalize() + "."
+
+
+def write_txt(path: str, size_mb: float, rng: random.Random) -> None:
+    target = int(size_mb * 1024 * 1024)
+    with open(path, "w") as f:
+        written = 0
+        while written < target:
+            line = _sentence(rng) + "\n"
+            f.write(line)
+            written += len(line)
+
+
+def write_csv(path: str, size_mb: float, rng: random.Random) -> None:
+    target = int(size_mb * 1024 * 1024)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "customer", "status", "amount", "notes"])
+        row_id = 0
+        while f.tell() < target:
+            writer.writerow([row_id, f"C{rng.randint(1000, 9999)}", rng.choice(["open", "paid", "late"]),
+                             rng.randint(1, 5000), _sentence(rng)])
+            row_id += 1
+
+
+def write_pdf(path: str, size_mb: float, rng: random.Random) -> None:
+    """Write a minimal text PDF with one content stream per page"""
+    target = int(size_mb * 1024 * 1024)
+    objects: List[bytes] = [b"", b""]  # catalog and page tree are filled in at the end
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    total = 0
+    while total < target:
+        lines = [_sentence(rng) for _ in range(45)]
+        text = " T* ".join(f"({line})Tj" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+        total += len(stream)
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref_offset = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+
+
+def measure(run: Callable[[], int]) -> Dict[str, Any]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"chunks": chunks, "seconds": elapsed, "peak_mb": peak / (1024 * 1024)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[2, 8], help="File sizes in MB")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    embeddings = HashingEmbeddings(dim=64)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    writers = {".csv": write_csv, ".txt": write_txt, ".pdf": write_pdf}
+
+    def eager(path: str, ext: str) -> int:
+        documents = load_and_split_file(path, ext)
+        vectors = embeddings.embed_documents([d.page_content for d in documents])
+        return len(vectors)
+
+    def streaming(path: str, ext: str) -> int:
+        total = 0
+        chunks = iter_split_documents(iter_file_documents(path, ext), splitter)
+        for batch in iter_batches(chunks, args.batch_size):
+            total += len(embeddings.embed_documents([d.page_content for d in batch]))
+        return total
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            for ext, writer in writers.items():
+                path = os.path.join(directory, f"synthetic_{size}mb{ext}")
+                writer(path, size, random.Random(args.seed))
+                file_mb = os.path.getsize(path) / (1024 * 1024)
+                for mode, run in (("eager", eager), ("streaming", streaming)):
+                    row = {"type": ext, "file_mb": file_mb, "mode": mode, **measure(lambda: run(path, ext))}
+                    results.append(row)
+                    print(f"{ext:<5} {file_mb:>7.1f} MB  {mode:<9} chunks={row['chunks']:<7} "
+                          f"peak={row['peak_mb']:>8.1f} MB  time={row['seconds']:.1f}s")
+                os.remove(path)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"batch_size": args.batch_size, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
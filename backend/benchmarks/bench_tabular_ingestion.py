@@ -0,0 +1,132 @@
+"""
+Compare row-per-document and block ingestion of CSV files, and aggregate answers
+
+For each size, a synthetic orders CSV is ingested twice: the way it used to
+be (CSVLoader makes one document per row, then the text splitter) and as
+schema-annotated row blocks. Both report the time to read and chunk the
+file, the number of chunks, the characters sent for embedding and the
+embedding requests that takes at EMBEDDING_BATCH_SIZE texts per request.
+Vectors come from the offline HashingEmbeddings stand-in.
+
+It then stores the table as Parquet and times aggregate questions answered
+from it, next to how many of the file's rows the RETRIEVAL_K chunks that
+retrieval would put in the prompt cover in each mode.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_tabular_ingestion --rows 10000 100000
+"""
+from typing import Any, Callable, Dict, List
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from langchain.schema import Document
+
+from app.core.config import settings
+from app.services.document_stream import load_and_split_file, iter_table_chunks
+from app.services.tabular import TableStore, iter_table_frames
+from benchmarks.fakes import HashingEmbeddings
+
+REGIONS = ["North", "South", "East", "West"]
+PRODUCTS = ["tent", "jacket", "lamp", "stove", "backpack", "boots"]
+QUESTIONS = [
+    "How many rows are in orders.csv?",
+    "What is the average price?",
+    "What is the total quantity by region?",
+    "What is the highest price per product?",
+    "How many distinct customers are there?",
+]
+
+
+def write_orders(path: str, rows: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({
+        "order id": np.arange(rows),
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+        "region": rng.choice(REGIONS, rows),
+        "product": rng.choice(PRODUCTS, rows),
+        "customer": [f"C{n}" for n in rng.integers(1000, 9999, rows)],
+        "price": rng.integers(100, 10000, rows) / 100,
+        "quantity": rng.integers(1, 10, rows),
+    }).to_csv(path, index=False)
+
+
+def ingest(load: Callable[[], List[Document]], embeddings: HashingEmbeddings) -> Dict[str, Any]:
+    start = time.perf_counter()
+    documents = load()
+    chunk_seconds = time.perf_counter() - start
+    texts = [doc.page_content for doc in documents]
+    batch = settings.EMBEDDING_BATCH_SIZE
+    for i in range(0, len(texts), batch):
+        embeddings.embed_documents(texts[i:i + batch])
+    rows = [doc.metadata["row_end"] - doc.metadata["row_start"] if "row_end" in doc.metadata else 1
+            for doc in documents]
+    return {
+        "chunk_s": chunk_seconds,
+        "chunks": len(documents),
+        "embedded_chars": sum(len(text) for text in texts),
+        "embedding_requests": (len(texts) + batch - 1) // batch,
+        "rows_in_context": int(statistics.mean(rows) * settings.RETRIEVAL_K) if rows else 0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeats", type=int, default=20, help="Times each aggregate question is asked")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    embeddings = HashingEmbeddings(dim=64)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, "orders.csv")
+            write_orders(path, rows, args.seed)
+
+            settings.TABULAR_INGESTION_ENABLED = False
+            row_docs = ingest(lambda: load_and_split_file(path, ".csv"), embeddings)
+            settings.TABULAR_INGESTION_ENABLED = True
+            blocks = ingest(lambda: list(iter_table_chunks(path, ".csv")), embeddings)
+            for mode, row in (("rows", row_docs), ("blocks", blocks)):
+                results.append(dict(mode=mode, rows=rows, **row))
+                print(f"{mode:<7}{rows:>9} rows  chunk {row['chunk_s']:.2f}s, {row['chunks']} chunks, "
+                      f"{row['embedded_chars'] / 1e6:.1f}M chars, {row['embedding_requests']} embedding requests, "
+                      f"{row['rows_in_context']} rows in context", flush=True)
+
+            store = TableStore(os.path.join(directory, "tables"), directory)
+            start = time.perf_counter()
+            writer = store.writer(path, "orders.csv")
+            if writer is None:
+                print("pyarrow is not installed, skipping aggregate questions")
+                continue
+            for sheet, frame in iter_table_frames(path, ".csv", settings.TABULAR_READ_ROWS):
+                writer.write(sheet, frame)
+            store.add("bench", "orders", writer)
+            store_seconds = time.perf_counter() - start
+            for question in QUESTIONS:
+                latencies = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    answer = store.answer("bench", question)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                row = {"mode": "aggregate", "rows": rows, "question": question, "store_s": store_seconds,
+                       "answered": answer is not None, "p50_ms": statistics.median(latencies)}
+                results.append(row)
+                print(f"  {question:<42} {'answered' if row['answered'] else 'retrieval':<9} "
+                      f"p50 {row['p50_ms']:.1f} ms", flush=True)
+            store.remove_file("bench", "orders")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
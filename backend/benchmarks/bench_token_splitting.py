@@ -0,0 +1,187 @@
+"""
+Compare the character splitter with the token splitter and context packing
+
+Splitting: the bench_rerank corpus, laid out like text extracted from a
+PDF (wrapped lines, no blank lines between paragraphs) and read as one
+large file in TEXT_BLOCK_SIZE blocks, is split with the current character splitter
+(1000 characters, 200 overlap) and with the token splitter (256 tokens,
+16 overlap). The report shows the chunks and embedding requests needed
+to index it, the tokens sent for embedding compared with the tokens in
+the file (the excess is overlap embedded twice), and the time to split
+it in this process and in a pool of worker processes.
+
+Prompt tokens: both sets of chunks are indexed with hashing embeddings
+and the bench_rerank queries are answered with hybrid retrieval and MMR
+reranking, either keeping the top RERANK_K chunks (what is sent with
+CONTEXT_TOKEN_BUDGET=0, the default) or packing all RERANK_FETCH_K
+candidates into each of the --budgets token budgets.
+
+Tokens are counted with TOKENIZER_ENCODING, or approximated when
+tiktoken can't load it (the first line of output says which).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_token_splitting --topics 200 --queries 200 --workers 2 --budgets 500 600 1000
+"""
+from typing import Any, Callable, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import math
+import os
+import random
+import textwrap
+import time
+import uuid
+
+import chromadb
+from langchain.schema import Document
+
+from app.core.config import settings
+from app.services import document_stream
+from app.services.bm25_index import BM25Index
+from app.services.context_packer import ContextPacker
+from app.services.reranker import MMRReranker
+from app.services.retrievers import ContextPackingRetriever, HybridRetriever, RerankingRetriever
+from app.services.vector_stores import ChromaVectorStore
+from app.utils.tokenizer import approximate_token_count, get_token_counter
+from benchmarks.bench_rerank import make_corpus, measure, split_corpus
+from benchmarks.fakes import HashingEmbeddings
+
+
+def _use_splitter(mode: str) -> None:
+    """Select the splitter here and in worker processes started afterwards"""
+    os.environ["TEXT_SPLITTER"] = mode
+    settings.TEXT_SPLITTER = mode
+    document_stream.create_text_splitter.cache_clear()
+
+
+def _blocks(text: str) -> List[Document]:
+    """The file as the streaming reader yields it"""
+    size = document_stream.TEXT_BLOCK_SIZE
+    return [Document(page_content=text[i:i + size], metadata={"source": "corpus.txt"})
+            for i in range(0, len(text), size)]
+
+
+def measure_splitting(mode: str, text: str, count_tokens: Callable[[str], int], workers: int) -> Dict[str, Any]:
+    _use_splitter(mode)
+    splitter = document_stream.create_text_splitter()
+
+    start = time.perf_counter()
+    chunks = list(document_stream.iter_split_documents(_blocks(text), splitter))
+    serial_seconds = time.perf_counter() - start
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Start the workers before timing
+        list(pool.map(document_stream.split_documents, [[Document(page_content="warm up")]] * workers))
+        start = time.perf_counter()
+        parallel = list(document_stream.iter_split_documents(_blocks(text), splitter, executor=pool, window=2 * workers))
+        parallel_seconds = time.perf_counter() - start
+    assert [c.page_content for c in parallel] == [c.page_content for c in chunks]
+
+    embedded = sum(count_tokens(chunk.page_content) for chunk in chunks)
+    return {
+        "mode": mode,
+        "chunks": len(chunks),
+        "embedding_calls": math.ceil(len(chunks) / settings.EMBEDDING_BATCH_SIZE),
+        "embedded_tokens": embedded,
+        "overlap": embedded / count_tokens(text) - 1,
+        "serial_s": serial_seconds,
+        "parallel_s": parallel_seconds,
+    }
+
+
+def _index(documents: List[Document], embeddings: HashingEmbeddings):
+    vectorstore = ChromaVectorStore(
+        client=chromadb.EphemeralClient(),
+        collection_name=f"bench_{uuid.uuid4().hex}",
+        embedding_function=embeddings
+    )
+    ids = [doc.metadata["chunk_id"] for doc in documents]
+    for i in range(0, len(documents), 1000):
+        vectorstore.add_documents(documents[i:i + 1000], ids=ids[i:i + 1000])
+    lexical_index = BM25Index()
+    lexical_index.add(ids, [d.page_content for d in documents], [d.metadata for d in documents])
+    return vectorstore, lexical_index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes for parallel splitting")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[500, 600, 1000],
+                        help="Context token budgets to pack")
+    parser.add_argument("--wrap", type=int, default=80, help="Line width of the PDF-like layout, 0 for one line per paragraph with blank lines between")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    count_tokens = get_token_counter(settings.TOKENIZER_ENCODING)
+    tokenizer = "approximated" if count_tokens is approximate_token_count else settings.TOKENIZER_ENCODING
+    sections = make_corpus(args.topics, args.seed)
+    if args.wrap:
+        # Each section becomes a single block of wrapped lines
+        for section in sections:
+            section["paragraphs"] = ["\n".join(textwrap.fill(p, args.wrap) for p in section["paragraphs"])]
+    text = "\n\n".join("\n\n".join(section["paragraphs"]) for section in sections)
+    print(f"Tokens: {tokenizer}; corpus: {len(text)} characters, {count_tokens(text)} tokens")
+
+    splits = [measure_splitting(mode, text, count_tokens, args.workers) for mode in ("characters", "tokens")]
+    print(f"{'splitter':<12}{'chunks':>8}{'embed calls':>13}{'embedded tokens':>17}{'overlap':>9}"
+          f"{'serial s':>10}{f'{args.workers} procs s':>11}")
+    for row in splits:
+        print(f"{row['mode']:<12}{row['chunks']:>8}{row['embedding_calls']:>13}{row['embedded_tokens']:>17}"
+              f"{row['overlap']:>9.1%}{row['serial_s']:>10.2f}{row['parallel_s']:>11.2f}")
+
+    rng = random.Random(args.seed + 1)
+    queries = []
+    for _ in range(args.queries):
+        section = rng.choice(sections[:args.topics])
+        queries.append({
+            "text": "Explain " + " ".join(rng.sample(section["vocabulary"], 6)),
+            "topic": section["topic"],
+        })
+
+    embeddings = HashingEmbeddings()
+    results = []
+    for split in splits:
+        _use_splitter(split["mode"])
+        # Split per section, as bench_rerank does, so each chunk knows its topic
+        documents = split_corpus(sections, document_stream.create_text_splitter())
+        vectorstore, lexical_index = _index(documents, embeddings)
+
+        def reranked(k: int) -> RerankingRetriever:
+            return RerankingRetriever(
+                base_retriever=HybridRetriever(
+                    vectorstore=vectorstore,
+                    get_lexical_index=lambda: lexical_index,
+                    k=settings.RERANK_FETCH_K,
+                    fetch_k=settings.RERANK_FETCH_K
+                ),
+                reranker=MMRReranker(vectorstore, embeddings, lambda_mult=settings.RERANK_MMR_LAMBDA, rank_weight=0.5),
+                k=k,
+                budget_seconds=settings.RERANK_BUDGET_MS / 1000
+            )
+
+        results.append(measure(f"{split['mode']}, top {settings.RERANK_K}", reranked(settings.RERANK_K),
+                               queries, count_tokens))
+        for budget in args.budgets:
+            packed = ContextPackingRetriever(
+                base_retriever=reranked(settings.RERANK_FETCH_K),
+                packer=ContextPacker(budget, count_tokens, settings.CONTEXT_MIN_CHUNK_TOKENS)
+            )
+            results.append(measure(f"{split['mode']}, packed to {budget}", packed, queries, count_tokens))
+
+    print(f"{'retrieval':<26}{'chunks':>7}{'tokens':>8}{'max':>6}{'on topic':>10}{'useful':>8}{'distinct':>10}{'p50 ms':>8}")
+    for row in results:
+        print(f"{row['mode']:<26}{row['chunks']:>7.1f}{row['prompt_tokens']:>8.0f}{row['prompt_tokens_max']:>6}"
+              f"{row['on_topic']:>10.2f}{row['useful_chunks']:>8.2f}{row['distinct_text']:>10.2f}{row['p50_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "tokenizer": tokenizer, "splitting": splits, "retrieval": results},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Compare query latency, recall and memory of the Chroma and flat vector backends
+
+For each size, clustered random unit vectors (as sentence embeddings tend
+to be) are written to a fresh store of each backend through add_chunks, so
+no embedding model is involved. The store is then reopened in a new
+process, which runs the queries: the first one is reported separately as
+the cold query (it loads the HNSW index or pages in the mapped matrix),
+the rest give p50/p95 latency. Recall@k is measured against exact search.
+
+Memory is read from /proc/self/status (Linux only): RssAnon is heap the
+store allocated, RssFile is mapped file pages, which the OS can drop under
+memory pressure and share between worker processes.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_vector_backend --sizes 1000 100000 1000000
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.vector_stores import ChunkVectorStore, ChromaVectorStore, FlatVectorStore
+from app.utils.setup_utils import disk_usage
+from benchmarks.fakes import HashingEmbeddings
+
+BLOCK_ROWS = 10000
+N_CLUSTERS = 1000
+
+
+def _centers(dim: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((N_CLUSTERS, dim), dtype=np.float32)
+
+
+def make_block(block: int, dim: int, seed: int, centers: np.ndarray) -> np.ndarray:
+    """Generate the block-th BLOCK_ROWS vectors; any block can be regenerated on its own"""
+    rng = np.random.default_rng((seed, block))
+    vectors = centers[rng.integers(0, N_CLUSTERS, BLOCK_ROWS)]
+    vectors = vectors + rng.standard_normal((BLOCK_ROWS, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def iter_vectors(size: int, dim: int, seed: int):
+    centers = _centers(dim, seed)
+    for block in range((size + BLOCK_ROWS - 1) // BLOCK_ROWS):
+        yield block * BLOCK_ROWS, make_block(block, dim, seed, centers)[:size - block * BLOCK_ROWS]
+
+
+def make_queries(n_queries: int, dim: int, seed: int) -> np.ndarray:
+    # Past any block number, so queries are drawn independently of the stored vectors
+    rng = np.random.default_rng((seed, 2**32 - 1))
+    centers = _centers(dim, seed)
+    queries = centers[rng.integers(0, N_CLUSTERS, n_queries)]
+    queries = queries + rng.standard_normal((n_queries, dim), dtype=np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(size: int, dim: int, seed: int, queries: np.ndarray, k: int) -> List[set]:
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    for start, vectors in iter_vectors(size, dim, seed):
+        scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+        block_rows = np.broadcast_to(np.arange(start, start + len(vectors)), (len(queries), len(vectors)))
+        rows = np.concatenate([best_rows, block_rows], axis=1)
+        top = np.argsort(-scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return [set(row) for row in best_rows.tolist()]
+
+
+def memory() -> Dict[str, int]:
+    """Resident memory of this process in bytes"""
+    result = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                result[name] = int(value.split()[0]) * 1024
+    return result
+
+
+def open_store(backend: str, directory: str, quantization: str) -> ChunkVectorStore:
+    embeddings = HashingEmbeddings()
+    if backend == "chroma":
+        import chromadb
+        return ChromaVectorStore(
+            client=chromadb.PersistentClient(path=directory),
+            collection_name="bench",
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "cosine"}
+        )
+    return FlatVectorStore.load(directory, embeddings, quantization=quantization)
+
+
+def build(args: argparse.Namespace) -> Dict[str, Any]:
+    start = time.perf_counter()
+    store = open_store(args.backend, args.directory, args.quantization)
+    batch = 5000
+    for block_start, vectors in iter_vectors(args.size, args.dim, args.seed):
+        for i in range(0, len(vectors), batch):
+            rows = range(block_start + i, block_start + min(i + batch, len(vectors)))
+            store.add_chunks(
+                ids=[str(row) for row in rows],
+                embeddings=vectors[i:i + batch].tolist() if args.backend == "chroma" else vectors[i:i + batch],
+                documents=[f"chunk {row}" for row in rows],
+                metadatas=[{"row": row} for row in rows]
+            )
+    return {"build_s": time.perf_counter() - start}
+
+
+def query(args: argparse.Namespace) -> Dict[str, Any]:
+    queries = make_queries(args.queries + 1, args.dim, args.seed)
+    before = memory()
+    store = open_store(args.backend, args.directory, args.quantization)
+
+    latencies = []
+    found = []
+    for vector in queries:
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector(vector.tolist(), k=args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append({doc.metadata["row"] for doc in docs})
+    after = memory()
+
+    truth = exact_top_k(args.size, args.dim, args.seed, queries, args.k)
+    warm = sorted(latencies[1:])
+    return {
+        "cold_ms": latencies[0],
+        "p50_ms": statistics.median(warm),
+        "p95_ms": warm[int(0.95 * (len(warm) - 1))],
+        "recall": statistics.mean(len(f & t) / args.k for f, t in zip(found, truth)),
+        "rss_anon_bytes": after["RssAnon"] - before["RssAnon"],
+        "rss_file_bytes": after["RssFile"] - before["RssFile"],
+    }
+
+
+def run_phase(phase: str, args: argparse.Namespace, backend: str, size: int, directory: str,
+              quantization: str) -> Optional[Dict[str, Any]]:
+    """Run a build or query phase in a fresh process so memory and caches start clean"""
+    command = [
+        sys.executable, "-m", "benchmarks.bench_vector_backend", "--phase", phase,
+        "--backend", backend, "--size", str(size), "--directory", directory, "--quantization", quantization,
+        "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k), "--seed", str(args.seed),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+    if completed.returncode != 0:
+        print(completed.stderr[-2000:], file=sys.stderr)
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", default=["chroma", "flat", "flat-int8"],
+                        choices=["chroma", "flat", "flat-int8"])
+    parser.add_argument("--chroma-max-size", type=int, default=1000000,
+                        help="Skip Chroma above this size (building its HNSW index is slow)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=7200, help="Seconds allowed per phase")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    # Used by the subprocesses
+    parser.add_argument("--phase", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--quantization", default="none", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        print(json.dumps(build(args) if args.phase == "build" else query(args)))
+        return
+
+    results = []
+    for size in args.sizes:
+        for name in args.backends:
+            if name == "chroma" and size > args.chroma_max_size:
+                continue
+            backend, quantization = ("flat", "int8") if name == "flat-int8" else (name, "none")
+            directory = tempfile.mkdtemp(prefix="bench_vectors_")
+            try:
+                built = run_phase("build", args, backend, size, directory, quantization)
+                queried = built and run_phase("query", args, backend, size, directory, quantization)
+                if not queried:
+                    print(f"{name} failed at {size} vectors", file=sys.stderr)
+                    continue
+                row = dict(backend=name, size=size, disk_bytes=disk_usage(directory), **built, **queried)
+                results.append(row)
+                print(f"{name:<10}{size:>9}  build {row['build_s']:.1f}s, cold {row['cold_ms']:.1f} ms, "
+                      f"p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms, recall {row['recall']:.3f}, "
+                      f"anon {row['rss_anon_bytes'] / 2**20:.0f} MB, file {row['rss_file_bytes'] / 2**20:.0f} MB, "
+                      f"disk {row['disk_bytes'] / 2**20:.0f} MB", flush=True)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions APIs
+
+Serves POST /v1/embeddings with deterministic HashingEmbeddings vectors,
+simulated latency and an OpenAI-style rate limit: requests over the
+configured requests-per-minute get a 429 with a Retry-After header. A
+fraction of requests can also fail at random with 429 or 500 to exercise
+retry paths. POST /v1/chat/completions answers like FakeChatModel, after a
+time to first token and a delay per token, streamed if asked for.
+GET /stats reports what the server saw.
+
+Run standalone (from the backend directory):
+    python -m benchmarks.fake_openai_server --port 8100 --rpm 600
+and point a client at http://127.0.0.1:8100/v1.
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+import argparse
+import asyncio
+import base64
+import json
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain.schema.messages import HumanMessage
+from pydantic import BaseModel
+
+from benchmarks.fakes import FakeChatModel, HashingEmbeddings
+
+
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    model: str = "text-embedding-ada-002"
+    encoding_format: Optional[str] = None
+
+
+class ChatCompletionRequest(BaseModel):
+    messages: List[Dict[str, Any]]
+    model: str = "gpt-3.5-turbo"
+    stream: bool = False
+
+
+def create_app(dim: int = 256, latency: float = 0.05, text_latency: float = 0.0005,
+               rpm: float = 0, error_rate: float = 0.0, seed: int = 0,
+               first_token_latency: float = 0.3, token_latency: float = 0.01,
+               reply_tokens: int = 40) -> FastAPI:
+    """Build the fake API; rpm=0 disables rate limiting"""
+    app = FastAPI()
+    embeddings = HashingEmbeddings(dim)
+    chat_model = FakeChatModel(reply_tokens=reply_tokens)
+    rng = random.Random(seed)
+    stats = {"requests": 0, "rate_limited": 0, "errors": 0, "texts": 0, "chat_requests": 0}
+    # Token bucket allowing up to a second's worth of requests in a burst
+    bucket = {"tokens": max(1.0, rpm / 60), "updated": time.monotonic()}
+
+    def _error(status: int, message: str, retry_after: Optional[float] = None) -> JSONResponse:
+        headers = {"retry-after": f"{retry_after:.3f}"} if retry_after is not None else None
+        body = {"error": {"message": message, "type": "requests", "code": str(status)}}
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    def _refuse() -> Optional[JSONResponse]:
+        """Apply the rate limit and random failures to a request"""
+        stats["requests"] += 1
+        if rpm > 0:
+            now = time.monotonic()
+            rate = rpm / 60
+            bucket["tokens"] = min(max(1.0, rate), bucket["tokens"] + (now - bucket["updated"]) * rate)
+            bucket["updated"] = now
+            if bucket["tokens"] < 1:
+                stats["rate_limited"] += 1
+                return _error(429, "Rate limit reached for requests", (1 - bucket["tokens"]) / rate)
+            bucket["tokens"] -= 1
+
+        if error_rate and rng.random() < error_rate:
+            stats["errors"] += 1
+            if rng.random() < 0.5:
+                return _error(429, "Rate limit reached for requests")
+            return _error(500, "The server had an error while processing your request")
+        return None
+
+    @app.post("/v1/embeddings")
+    async def create_embeddings(request: EmbeddingRequest):
+        refused = _refuse()
+        if refused is not None:
+            return refused
+
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        await asyncio.sleep(latency + text_latency * len(texts))
+        stats["texts"] += len(texts)
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = embeddings._embed(text)
+            if request.encoding_format == "base64":
+                vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(text) // 4 + 1 for text in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def create_chat_completion(request: ChatCompletionRequest):
+        refused = _refuse()
+        if refused is not None:
+            return refused
+        stats["chat_requests"] += 1
+
+        prompt = "\n".join(str(message.get("content") or "") for message in request.messages)
+        tokens = chat_model._tokens([HumanMessage(content=prompt)])
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": len(prompt) // 4 + 1,
+            "completion_tokens": len(tokens),
+            "total_tokens": len(prompt) // 4 + 1 + len(tokens),
+        }
+
+        if not request.stream:
+            await asyncio.sleep(first_token_latency + token_latency * max(0, len(tokens) - 1))
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": request.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        async def events() -> AsyncIterator[str]:
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+                body = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": request.model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(body)}\n\n"
+
+            await asyncio.sleep(first_token_latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(token_latency)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, Any]:
+        return dict(stats)
+
+    app.state.stats = stats
+    return app
+
+
+class FakeOpenAIServer:
+    """Runs the fake API on a free local port in a background thread"""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 0):
+        self.app = app
+        self.host = host
+        if port == 0:
+            with socket.socket() as sock:
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+        self.port = port
+        self._server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.app.state.stats)
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per request")
+    parser.add_argument("--text-latency", type=float, default=0.0005, help="Extra seconds per input text")
+    parser.add_argument("--rpm", type=float, default=0, help="Requests per minute before 429s, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail at random")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Seconds before a chat reply starts")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per further reply token")
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    args = parser.parse_args()
+    app = create_app(
+        args.dim, args.latency, args.text_latency, args.rpm, args.error_rate,
+        first_token_latency=args.first_token_latency, token_latency=args.token_latency,
+        reply_tokens=args.reply_tokens
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Offline stand-ins for the OpenAI models used by the benchmarks"""
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import asyncio
+import hashlib
+import re
+import time
+
+import numpy as np
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.messages import AIMessageChunk
+from langchain.schema.output import ChatGenerationChunk
+
+_WORD_RE = re.compile(r"[a-z]{3,}")
+_REFERENCE_WORDS = {"it", "its", "this", "that", "these", "those", "they", "them", "their"}
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local embeddings built from hashed words
+
+    Only alphabetic words are hashed, so like a dense embedding model the
+    vectors capture topic words but are blind to codes such as "AB-1234".
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LatencyEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that sleep like a remote API: a fixed cost per call plus a cost per text"""
+
+    def __init__(self, dim: int = 256, call_latency: float = 0.05, text_latency: float = 0.0005):
+        super().__init__(dim)
+        self.call_latency = call_latency
+        self.text_latency = text_latency
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.call_latency + self.text_latency * len(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.call_latency + self.text_latency * len(texts))
+        return HashingEmbeddings.embed_documents(self, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model with a configurable time to first token and per-token delay
+
+    The reply echoes the last words of the prompt, so answers vary with the
+    question but are the same on every run. Condense-question prompts get the
+    follow-up back unchanged, or expanded with the previous question if it
+    contains a reference word such as "it".
+    """
+
+    first_token_latency: float = 0.3
+    token_latency: float = 0.01
+    reply_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = str(messages[-1].content) if messages else ""
+        if "Standalone question:" in prompt:
+            return [word + " " for word in self._rewrite(prompt).split()]
+        words = prompt.split()
+        seed = words[-20:] or ["answer"]
+        return [seed[i % len(seed)] + " " for i in range(self.reply_tokens)]
+
+    def _rewrite(self, prompt: str) -> str:
+        """Answer a condense-question prompt like a rewriting model would"""
+        question = prompt.split("Follow Up Input:")[-1].split("Standalone question:")[0].strip()
+        words = set(re.findall(r"[a-z']+", question.lower()))
+        if words & _REFERENCE_WORDS:
+            # Resolve the reference using the topic of the previous question
+            previous = prompt.split("Human:")[-1].split("\n")[0].strip().rstrip("?")
+            return f"{question.rstrip('?')} in the context of: {previous}?"
+        return question
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        parts = [chunk.message.content async for chunk in self._astream(messages, stop, run_manager, **kwargs)]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(parts)))])
@@ -0,0 +1,271 @@
+"""
+Drive /api/upload and /api/chat with concurrent virtual users
+
+The FastAPI app runs in-process behind httpx's ASGI transport, with OpenAI
+replaced by the deterministic stand-ins in benchmarks/fakes.py, so the test
+needs no network and no API key. Each virtual user uploads its own synthetic
+text file, waits for ingestion to finish, then asks a series of questions.
+
+Reports p50/p95/p99 latency per endpoint, throughput, and the time spent in
+each pipeline stage (parsing, splitting, embedding, vector_search, and the
+llm_condense and llm_answer LLM calls).
+Data is written to a temporary directory that is removed afterwards.
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --users 20 --turns 5 --output run.json
+    python -m benchmarks.load_test --users 20 --turns 5 --compare run.json --threshold 0.2
+
+With --compare, the run fails (exit code 1) if any endpoint's p95 latency or
+the overall throughput is worse than the baseline by more than the threshold.
+"""
+from typing import Any, Dict, List
+from collections import defaultdict
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+WORDS = ("policy refund customer invoice shipment warehouse contract renewal account "
+         "balance payment schedule discount product support ticket delivery warranty "
+         "supplier pricing quarter report forecast budget audit compliance").split()
+
+
+def _configure_environment(data_dir: str, disable_caches: bool) -> None:
+    """Point all on-disk state at a scratch directory before the app is imported"""
+    os.environ["UPLOAD_DIR"] = os.path.join(data_dir, "uploads")
+    os.environ["VECTOR_DB_PATH"] = os.path.join(data_dir, "chroma_db")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(data_dir, "embedding_cache.sqlite3")
+    os.environ["SESSION_DB_PATH"] = os.path.join(data_dir, "sessions.sqlite3")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    if disable_caches:
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+class StageRecorder:
+    """Collects stage durations reported through app.utils.timing"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[name].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {**_percentiles(samples), "total_s": float(sum(samples))}
+                for name, samples in sorted(self.samples.items())
+            }
+
+
+def _document(rng: random.Random, paragraphs: int) -> str:
+    lines = []
+    for _ in range(paragraphs):
+        sentences = [" ".join(rng.choices(WORDS, k=14)).capitalize() + "." for _ in range(6)]
+        lines.append(" ".join(sentences))
+    return "\n\n".join(lines)
+
+
+async def _virtual_user(user_id: int, app: Any, args: argparse.Namespace,
+                        latencies: Dict[str, List[float]], errors: Dict[str, int]) -> None:
+    import httpx
+
+    rng = random.Random(args.seed * 1000 + user_id)
+    api = "/api"
+
+    async def timed(endpoint: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            return response
+        except Exception:
+            errors[endpoint] += 1
+            return None
+        finally:
+            latencies[endpoint].append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        body = _document(rng, args.paragraphs).encode("utf-8")
+        files = [("files", (f"user_{user_id}.txt", body, "text/plain"))]
+        response = await timed("upload", client.post(f"{api}/upload", files=files))
+        if response is None:
+            return
+
+        # Ingestion runs in the background; time until the job completes
+        job_id = response.json()["job_id"]
+        start = time.perf_counter()
+        while True:
+            status = (await client.get(f"{api}/upload/{job_id}")).json()
+            if status["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(args.poll_interval)
+        latencies["ingestion"].append(time.perf_counter() - start)
+        if status["status"] == "failed":
+            errors["ingestion"] += 1
+            return
+
+        for _ in range(args.turns):
+            question = "What does the document say about " + " and ".join(rng.sample(WORDS, 2)) + "?"
+            if args.stream:
+                await _stream_chat(client, f"{api}/chat/stream", question, latencies, errors)
+            else:
+                await timed("chat", client.post(f"{api}/chat", json={"text": question}))
+
+
+async def _stream_chat(client: Any, url: str, question: str,
+                       latencies: Dict[str, List[float]], errors: Dict[str, int]) -> None:
+    # The ASGI transport buffers the whole body, so only total latency is measured here
+    start = time.perf_counter()
+    try:
+        async with client.stream("POST", url, json={"text": question}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("event: error"):
+                    errors["chat_stream"] += 1
+    except Exception:
+        errors["chat_stream"] += 1
+    latencies["chat_stream"].append(time.perf_counter() - start)
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported here so the environment above is in place before settings load
+    from main import app
+    from app.services.container import services
+    from app.utils.timing import add_stage_listener, remove_stage_listener
+    from benchmarks.fakes import LatencyEmbeddings, FakeChatModel
+
+    rag_service = services.rag_service
+    rag_service.embeddings = rag_service._build_embeddings(LatencyEmbeddings(
+        dim=args.embedding_dim,
+        call_latency=args.embedding_call_latency,
+        text_latency=args.embedding_text_latency
+    ))
+    rag_service.llm = FakeChatModel(
+        first_token_latency=args.llm_first_token_latency,
+        token_latency=args.llm_token_latency,
+        reply_tokens=args.llm_reply_tokens
+    )
+
+    recorder = StageRecorder()
+    add_stage_listener(recorder)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            _virtual_user(user_id, app, args, latencies, errors) for user_id in range(args.users)
+        ))
+    finally:
+        elapsed = time.perf_counter() - start
+        remove_stage_listener(recorder)
+        services.shutdown()
+
+    requests = sum(len(latencies[name]) for name in ("upload", "chat", "chat_stream"))
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "elapsed_s": elapsed,
+        "requests": requests,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "endpoints": {name: _percentiles(samples) for name, samples in sorted(latencies.items())},
+        "errors": dict(errors),
+        "stages": recorder.summary(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """List the metrics that regressed by more than threshold relative to the baseline"""
+    regressions = []
+    for name, stats in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name, {}).get("p95_ms")
+        after = stats.get("p95_ms")
+        if before and after and after > before * (1 + threshold):
+            regressions.append(f"{name} p95 {before:.1f} ms -> {after:.1f} ms")
+    before = baseline.get("throughput_rps")
+    after = results["throughput_rps"]
+    if before and after < before * (1 - threshold):
+        regressions.append(f"throughput {before:.2f} -> {after:.2f} req/s")
+    return regressions
+
+
+def _print_report(results: Dict[str, Any]) -> None:
+    print(f"\n{results['requests']} requests in {results['elapsed_s']:.1f}s "
+          f"({results['throughput_rps']:.2f} req/s)")
+    print(f"\n{'endpoint':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results["endpoints"].items():
+        if stats["count"]:
+            print(f"{name:<26}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"\n{'stage':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for name, stats in results["stages"].items():
+        print(f"{name:<26}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['total_s']:>10.2f}")
+    if results["errors"]:
+        print(f"\nerrors: {results['errors']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users")
+    parser.add_argument("--turns", type=int, default=3, help="Chat requests per user")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs in each uploaded file")
+    parser.add_argument("--stream", action="store_true", help="Use /api/chat/stream instead of /api/chat")
+    parser.add_argument("--disable-caches", action="store_true", help="Turn off the embedding and answer caches")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--embedding-call-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--embedding-text-latency", type=float, default=0.0005, help="Extra seconds per embedded text")
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.3)
+    parser.add_argument("--llm-token-latency", type=float, default=0.01)
+    parser.add_argument("--llm-reply-tokens", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        _configure_environment(data_dir, args.disable_caches)
+        results = asyncio.run(_run(args))
+
+    _print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
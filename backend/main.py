@@ -1,11 +1,15 @@
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import logging
 import os
 
 from app.core.config import settings
+from app.core.metrics import metrics, instrument_app
+from app.core.admission import add_admission_control
+from app.utils.setup_utils import initialize_directories
 from app.api.endpoints import files, chat
-from app.services.session_manager import session_manager
+from app.services.container import services
 
 # Configure logging
 logging.basicConfig(
@@ -19,6 +23,10 @@ app = FastAPI(
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
 )
 
+# Bound concurrent chat and upload work, queueing chat ahead of uploads; added before CORS
+# so CORS headers are set on its 429 and 503 responses
+add_admission_control(app)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +36,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record request latency for /metrics, including requests turned away by admission control
+if settings.METRICS_ENABLED:
+    instrument_app(
+        app,
+        threshold_seconds=settings.SLOW_REQUEST_PROFILE_SECONDS,
+        interval_seconds=settings.SLOW_REQUEST_PROFILE_INTERVAL_SECONDS
+    )
+
 # Include routers
 app.include_router(
     files.router,
@@ -49,6 +65,26 @@ async def root():
 async def healthcheck():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 503 until the services have been created at startup"""
+    readiness = services.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Expose metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def startup_event():
+    initialize_directories()
+    services.start(warm_up=settings.STARTUP_WARM_UP, janitor=settings.JANITOR_ENABLED)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    services.shutdown()
+
 if __name__ == "__main__":
     # For development purposes only
     import uvicorn
@@ -0,0 +1,34 @@
+import os
+import sys
+
+# Run from the backend directory or the repository root alike
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import pytest
+
+
+@pytest.fixture
+def rag_service(tmp_path, monkeypatch):
+    """Build a RagService over the given embeddings that keeps everything under tmp_path"""
+    from app.core.config import settings
+    from app.services import rag_service as rag_module
+    from app.services.vectorstore_registry import VectorStoreRegistry
+
+    monkeypatch.setattr(settings, "VECTOR_DB_PATH", str(tmp_path / "vectors"))
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "EMBEDDING_MAX_RETRIES", 0)
+    registry = VectorStoreRegistry(str(tmp_path / "vectors"), max_collections=4, max_chains=4,
+                                   idle_seconds=600, backend="flat")
+    monkeypatch.setattr(rag_module, "vectorstore_registry", registry)
+    services = []
+
+    def build(embeddings):
+        service = rag_module.RagService(embeddings)
+        services.append(service)
+        return service
+
+    yield build
+    for service in services:
+        service.shutdown()
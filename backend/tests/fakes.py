@@ -0,0 +1,38 @@
+"""Local stand-ins used by the tests"""
+from typing import List
+
+from langchain.schema.embeddings import Embeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic embeddings that record every text sent to them"""
+
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    @staticmethod
+    def vector(text: str) -> List[float]:
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class FailingEmbeddings(CountingEmbeddings):
+    """CountingEmbeddings whose calls fail while `failing` is set, as when the provider rate limits"""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = False
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.failing:
+            raise RuntimeError("Rate limited")
+        return super().embed_documents(texts)
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.core.admission import CHAT, INGESTION, AdmissionController, AdmissionMiddleware, AdmissionRejected
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = dict(max_concurrent=1, max_ingestion=1, session_limit=4, max_queue=8,
+                   queue_timeouts={CHAT: 10.0, INGESTION: 30.0})
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_session_over_its_limit_gets_429():
+    async def run():
+        admission = controller(max_concurrent=4, session_limit=1)
+        permit = await admission.acquire(CHAT, "session")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(CHAT, "session")
+        # Other sessions, and requests without one, are unaffected
+        other = await admission.acquire(CHAT, "other")
+        anonymous = await admission.acquire(CHAT, None)
+        for held in (permit, other, anonymous):
+            held.release()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+
+
+def test_full_queue_rejects_with_503():
+    async def run():
+        admission = controller(max_queue=1)
+        permit = await admission.acquire(INGESTION, "a")
+        queued = asyncio.ensure_future(admission.acquire(INGESTION, "b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire(INGESTION, "c")
+        permit.release()
+        (await queued).release()
+        return rejected.value
+
+    assert asyncio.run(run()).status_code == 503
+
+
+def test_chat_sheds_the_newest_queued_upload():
+    async def run():
+        admission = controller(max_queue=2)
+        permit = await admission.acquire(INGESTION, "a")
+        older = asyncio.ensure_future(admission.acquire(INGESTION, "b"))
+        newer = asyncio.ensure_future(admission.acquire(INGESTION, "c"))
+        await asyncio.sleep(0)
+        chat = asyncio.ensure_future(admission.acquire(CHAT, "d"))
+        with pytest.raises(AdmissionRejected) as shed:
+            await newer
+        assert not older.done()
+
+        # Chat goes ahead of the upload that was queued first
+        permit.release()
+        chat_permit = await chat
+        assert not older.done()
+        chat_permit.release()
+        (await older).release()
+        assert admission.active == 0 and admission.queued == 0
+        return shed.value
+
+    assert asyncio.run(run()).status_code == 503
+
+
+def test_upload_holds_its_slot_until_ingestion_finishes():
+    async def run():
+        admission = controller()
+        permit = await admission.acquire(INGESTION, "a")
+        ingestion = asyncio.get_running_loop().create_future()
+        permit.hold_until(ingestion)
+        permit.release()
+        assert admission.active == 1
+        ingestion.set_result(None)
+        await asyncio.sleep(0)
+        return admission.active
+
+    assert asyncio.run(run()) == 0
+
+
+@pytest.mark.parametrize("module", ["main", "app.main"])
+def test_both_entry_points_use_admission_control(module):
+    app = __import__(module, fromlist=["app"]).app
+    assert AdmissionMiddleware in [middleware.cls for middleware in app.user_middleware]
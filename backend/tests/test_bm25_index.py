@@ -0,0 +1,124 @@
+from typing import Dict, List
+
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+from app.core.config import settings
+from app.services.bm25_index import BM25Index
+from app.services.dedup import ChunkDeduplicator
+from app.services.retrievers import HybridRetriever
+from app.services.vector_stores import FlatVectorStore
+from tests.fakes import CountingEmbeddings
+
+CHUNKS = {
+    "code": "Product AB-1234 ships in a blue box",
+    "returns": "Returns are accepted within thirty days",
+    "shipping": "Standard shipping takes five working days",
+}
+
+
+class FixedEmbeddings(Embeddings):
+    """Embeddings looked up from a table, so the vector ranking is known"""
+
+    def __init__(self, vectors: Dict[str, List[float]]):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text]
+
+
+def test_hybrid_retrieval_fuses_vector_and_bm25_rankings(tmp_path):
+    embeddings = FixedEmbeddings({
+        CHUNKS["code"]: [0.0, 0.0, 1.0],
+        CHUNKS["returns"]: [0.0, 1.0, 0.2],
+        CHUNKS["shipping"]: [1.0, 0.0, 0.0],
+        # The vectors miss the product code entirely
+        "When does AB-1234 arrive?": [1.0, 0.3, 0.0],
+    })
+    ids = list(CHUNKS)
+    metadatas = [{"chunk_id": chunk_id} for chunk_id in ids]
+    vectorstore = FlatVectorStore(str(tmp_path / "flat"), embeddings)
+    vectorstore.add_texts(list(CHUNKS.values()), metadatas, ids=ids)
+    lexical_index = BM25Index(str(tmp_path / "bm25"))
+    lexical_index.add(ids, list(CHUNKS.values()), metadatas)
+
+    retriever = HybridRetriever(vectorstore=vectorstore, get_lexical_index=lambda: lexical_index, k=2, fetch_k=3)
+    documents = retriever.get_relevant_documents("When does AB-1234 arrive?")
+
+    # The vectors rank "code" last; BM25's match on the product code lifts it above their first choice
+    assert [doc.metadata["chunk_id"] for doc in documents] == ["code", "shipping"]
+
+
+def test_hybrid_retriever_sees_uploaded_chunks(rag_service, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_MODE", "hybrid")
+    service = rag_service(CountingEmbeddings())
+    path = tmp_path / "catalog.txt"
+    path.write_text("\n\n".join(CHUNKS.values()))
+    service.ingest_file(str(path), ".txt", "docs", file_hash="catalog")
+
+    documents = service.get_retriever("docs").get_relevant_documents("AB-1234")
+
+    assert any("AB-1234" in doc.page_content for doc in documents)
+
+
+def test_saves_from_two_processes_are_merged(tmp_path):
+    directory = str(tmp_path / "bm25")
+    first, second = BM25Index.load(directory), BM25Index.load(directory)
+    first.add(["a"], ["alpha apples"], [{"n": 1}])
+    first.save()
+    second.add(["b"], ["beta bananas"], [{"n": 2}])
+    second.delete(["a"])
+    second.save()
+
+    merged = BM25Index.load(directory)
+    assert merged.chunk_ids == ["a", "b"]
+    assert merged.get_documents(merged.search("bananas", 5)) == [Document(page_content="beta bananas", metadata={"n": 2})]
+    assert merged.search("apples", 5) == []
+    # The first index picks up the second's save before its next search
+    assert first.get_documents(first.search("bananas", 5))[0].metadata == {"n": 2}
+
+
+def test_metadata_updates_are_saved(tmp_path):
+    directory = str(tmp_path / "bm25")
+    index = BM25Index.load(directory)
+    index.add(["a", "b"], ["alpha apples", "beta bananas"], [{"file_hash": "old"}, {"file_hash": "old"}])
+    index.save()
+    index.update_metadatas(["a"], [{"file_hash": "new"}])
+    index.add(["c"], ["gamma grapes"], [{"file_hash": "new"}])
+    index.save()
+
+    reloaded = BM25Index.load(directory)
+    assert reloaded.metadatas == [{"file_hash": "new"}, {"file_hash": "old"}, {"file_hash": "new"}]
+    assert reloaded.get_documents(reloaded.search("grapes", 5))[0].page_content == "gamma grapes"
+
+
+def test_replaced_file_updates_bm25_metadata(rag_service, tmp_path):
+    from app.services import rag_service as rag_module
+
+    service = rag_service(CountingEmbeddings())
+    kept = ("Warranty claims need the serial number printed under the battery cover. " * 12).strip()
+    old_path, new_path = tmp_path / "v1.txt", tmp_path / "v2.txt"
+    old_path.write_text(kept + "\n\n" + "Repairs take ten days. " * 30)
+    new_path.write_text(kept + "\n\n" + "Repairs take two days. " * 30)
+    stats = service.ingest_file(str(old_path), ".txt", "docs", file_hash="v1")
+
+    service.replace_file(str(new_path), ".txt", "docs", {"hash": "v1", "chunk_ids": stats["chunk_ids"], "name": "v1.txt"},
+                         [], file_hash="v2")
+
+    index = rag_module.vectorstore_registry.get_lexical_index("docs")
+    (document,) = index.get_documents(index.search("warranty serial", 1))
+    assert document.metadata["file_hash"] == "v2"
+
+
+def test_dedup_saves_from_two_processes_are_merged(tmp_path):
+    directory = str(tmp_path / "dedup")
+    first, second = ChunkDeduplicator.load(directory), ChunkDeduplicator.load(directory)
+    first.add(["alpha apples and more apples"], ["a"])
+    first.save()
+    second.add(["beta bananas and more bananas"], ["b"])
+    second.save()
+
+    assert sorted(ChunkDeduplicator.load(directory).chunk_ids) == ["a", "b"]
@@ -0,0 +1,36 @@
+import pytest
+
+from app.core.config import settings
+from app.core.metrics import condense_outcomes
+from tests.fakes import CountingEmbeddings
+
+HISTORY = [("What is the refund policy?", "Products can be returned within thirty days.")]
+STANDALONE = "How long does standard shipping take to Canada?"
+FOLLOW_UPS = ["Does it apply to sale items?", "what about gift cards", "And exchanges?", "Why?"]
+
+
+@pytest.mark.parametrize("mode", ["always", "heuristic", "speculative"])
+def test_first_question_is_never_rewritten(rag_service, monkeypatch, mode):
+    monkeypatch.setattr(settings, "CONDENSE_MODE", mode)
+    service = rag_service(CountingEmbeddings())
+
+    assert service._condense_strategy("Does it apply to sale items?", []) is None
+
+
+def test_always_rewrites_follow_ups(rag_service):
+    service = rag_service(CountingEmbeddings())
+
+    assert settings.CONDENSE_MODE == "always"
+    assert [service._condense_strategy(q, HISTORY) for q in [STANDALONE] + FOLLOW_UPS] == ["rewrite"] * 5
+
+
+@pytest.mark.parametrize("mode, follow_up_strategy", [("heuristic", "rewrite"), ("speculative", "speculative")])
+def test_heuristic_skips_standalone_questions(rag_service, monkeypatch, mode, follow_up_strategy):
+    monkeypatch.setattr(settings, "CONDENSE_MODE", mode)
+    service = rag_service(CountingEmbeddings())
+    skipped = condense_outcomes.value(outcome="skipped")
+
+    assert service._condense_strategy(STANDALONE, HISTORY) is None
+    assert condense_outcomes.value(outcome="skipped") == skipped + 1
+    # Pronouns, follow-up openings and very short questions still need the history
+    assert [service._condense_strategy(q, HISTORY) for q in FOLLOW_UPS] == [follow_up_strategy] * 4
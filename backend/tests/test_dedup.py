@@ -0,0 +1,60 @@
+import pytest
+from langchain.schema import Document
+
+from app.services.dedup import ChunkDeduplicator
+from tests.fakes import FailingEmbeddings
+
+PROSE = ("The refund policy allows customers to return any product within thirty days of delivery "
+         "provided that the original receipt is shown and the packaging is undamaged and complete. ") * 3
+HEADER = "Table: sales.csv\nColumns: region (text), month (text), units (integer), revenue (number)\nregion | month | units | revenue\n"
+
+
+def table_block(rows, row_start):
+    lines = [f"{region} | {month} | {units} | {revenue}" for region, month, units, revenue in rows]
+    return Document(page_content=HEADER + "\n".join(lines), metadata={"row_start": row_start, "row_end": row_start + len(rows) - 1})
+
+
+def test_drops_exact_and_near_duplicate_prose():
+    dedup = ChunkDeduplicator()
+    edited = PROSE.replace("undamaged", "intact", 1)
+
+    unique, duplicate_of, _ = dedup.filter([
+        Document(page_content=PROSE, metadata={"chunk_id": "a"}),
+        Document(page_content=PROSE.upper(), metadata={"chunk_id": "b"}),
+        Document(page_content=edited, metadata={"chunk_id": "c"}),
+    ])
+
+    assert [doc.metadata["chunk_id"] for doc in unique] == ["a"]
+    assert duplicate_of == ["a", "a"]
+
+
+def test_keeps_table_blocks_that_differ_in_a_few_values():
+    rows = [("north", "jan", 120, 3400.5), ("south", "jan", 80, 2100.0), ("east", "jan", 95, 2700.25)]
+    changed = [("north", "jan", 130, 3400.5)] + rows[1:]
+    first, second = table_block(rows, 1), table_block(changed, 4)
+    # As prose, one changed value is close enough to count as a near duplicate
+    as_prose = [Document(page_content=doc.page_content) for doc in (first, second)]
+    assert len(ChunkDeduplicator().filter(as_prose)[0]) == 1
+
+    unique, duplicate_of, _ = ChunkDeduplicator().filter([first, second, table_block(rows, 7)])
+
+    # Rows with distinct values stay; an identical block is still an exact duplicate
+    assert unique == [first, second]
+    assert len(duplicate_of) == 1
+
+
+def test_chunks_that_failed_to_embed_are_stored_on_retry(rag_service, tmp_path):
+    embeddings = FailingEmbeddings()
+    service = rag_service(embeddings)
+    path = tmp_path / "policy.txt"
+    path.write_text(PROSE + "\n\n" + PROSE.replace("refund", "exchange").replace("thirty", "sixty"))
+
+    embeddings.failing = True
+    with pytest.raises(Exception):
+        service.ingest_file(str(path), ".txt", "docs", file_hash="policy")
+    embeddings.failing = False
+    stats = service.ingest_file(str(path), ".txt", "docs", file_hash="policy")
+
+    assert stats["chunks"] > 0 and stats["duplicate_chunks"] == 0
+    stored = service.get_vectorstore("docs").get_chunks(include=["documents"])
+    assert sorted(stored["ids"]) == sorted(stats["chunk_ids"])
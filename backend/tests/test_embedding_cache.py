@@ -0,0 +1,108 @@
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+from app.services import embedding_cache
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from tests.fakes import CountingEmbeddings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Make each timestamp later than the last so LRU order doesn't depend on clock resolution"""
+    ticks = itertools.count(1_000_000)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(ticks)))
+
+
+def open_cache(tmp_path, **kwargs) -> EmbeddingCache:
+    return EmbeddingCache(str(tmp_path / "cache.sqlite3"), model_name="fake-model", **kwargs)
+
+
+def test_only_misses_reach_the_provider(tmp_path):
+    fake = CountingEmbeddings()
+    cache = open_cache(tmp_path)
+    embeddings = CachedEmbeddings(fake, cache)
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "c"])
+
+    assert fake.calls == [["a", "b"], ["c"]]
+    assert first == [fake.vector("a"), fake.vector("b"), fake.vector("a")]
+    assert second == [fake.vector("b"), fake.vector("c")]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 4)
+    assert stats["entries"] == 3
+
+
+def test_query_uses_cached_document_vector(tmp_path):
+    fake = CountingEmbeddings()
+    embeddings = CachedEmbeddings(fake, open_cache(tmp_path))
+
+    embeddings.embed_documents(["question"])
+    assert embeddings.embed_query("question") == fake.vector("question")
+    assert len(fake.calls) == 1
+
+
+def test_keys_include_the_model(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(["text"], [[1.0, 2.0]])
+    cache.close()
+
+    other = EmbeddingCache(str(tmp_path / "cache.sqlite3"), model_name="other-model")
+    assert other.get_many(["text"]) == [None]
+
+
+def test_evicts_least_recently_used_to_capacity(tmp_path, clock):
+    cache = open_cache(tmp_path, max_entries=10)
+    texts = [f"text {i}" for i in range(10)]
+    cache.put_many(texts, [[float(i)] for i in range(10)])
+    # Reading the oldest entry makes it recently used
+    cache.get_many(["text 0"])
+
+    cache.put_many(["text 10"], [[10.0]])
+
+    # Over capacity, so down to 90% by dropping the least recently used
+    assert cache.stats()["entries"] == 9
+    assert cache.stats()["evictions"] == 2
+    found = cache.get_many(texts + ["text 10"])
+    assert [text for text, vector in zip(texts + ["text 10"], found) if vector is None] == ["text 1", "text 2"]
+
+
+def test_vectors_persist_across_reopen(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(["kept"], [[0.5, 0.25]])
+    cache.close()
+
+    reopened = open_cache(tmp_path)
+    assert reopened.get_many(["kept", "missing"]) == [[0.5, 0.25], None]
+    assert reopened.stats()["entries"] == 1
+
+
+def test_async_query_does_not_block_the_event_loop(tmp_path):
+    fake = CountingEmbeddings()
+    cache = open_cache(tmp_path)
+    embeddings = CachedEmbeddings(fake, cache)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        # An ingestion writing to the cache holds its lock
+        cache._lock.acquire()
+        threading.Timer(0.2, cache._lock.release).start()
+        task = asyncio.ensure_future(ticker())
+        vector = await embeddings.aembed_query("question")
+        task.cancel()
+        return vector, ticks
+
+    vector, ticks = asyncio.run(run())
+
+    assert vector == fake.vector("question")
+    assert ticks >= 5
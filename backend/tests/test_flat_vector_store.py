@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from app.services.vector_stores import FlatVectorStore
+from tests.fakes import CountingEmbeddings
+
+
+def vector(chunk_id):
+    return np.random.default_rng(zlib.crc32(chunk_id.encode())).normal(size=16).tolist()
+
+
+def add(store, *chunk_ids):
+    store.add_chunks(list(chunk_ids), [vector(c) for c in chunk_ids], [f"text {c}" for c in chunk_ids],
+                     [{"source": c} for c in chunk_ids])
+
+
+def nearest(store, chunk_id):
+    (doc, distance), = store.similarity_search_by_vector_with_score(vector(chunk_id), k=1)
+    return doc.metadata["source"], round(distance, 4)
+
+
+def open_store(directory):
+    return FlatVectorStore.load(str(directory), CountingEmbeddings())
+
+
+def test_stores_sharing_a_directory_see_each_others_writes(tmp_path):
+    a, b = open_store(tmp_path), open_store(tmp_path)
+    add(a, "A1")
+    add(b, "B1")
+    add(a, "A2")
+
+    # Each chunk keeps its own vector, whichever store wrote the rows before it
+    for store in (a, b):
+        assert [nearest(store, c) for c in ("A1", "B1", "A2")] == [("A1", 0.0), ("B1", 0.0), ("A2", 0.0)]
+
+    b.delete(["A1"])
+    b.update_metadatas(["A2"], [{"source": "A2", "edited": True}])
+    assert sorted(a.get_chunks(include=["metadatas"])["ids"]) == ["A2", "B1"]
+    assert a.get_chunks(ids=["A2"], include=["metadatas"])["metadatas"] == [{"source": "A2", "edited": True}]
+    assert a.count() == 2
+
+
+def test_compaction_by_another_store_is_picked_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(FlatVectorStore, "COMPACT_MIN_DELETED", 1)
+    a, b = open_store(tmp_path), open_store(tmp_path)
+    add(a, "A1", "A2", "A3")
+    assert b.count() == 3
+
+    a.delete(["A1", "A2"])
+    add(a, "A4")
+
+    assert sorted(b.get_chunks()["ids"]) == ["A3", "A4"]
+    assert [nearest(b, c) for c in ("A3", "A4")] == [("A3", 0.0), ("A4", 0.0)]
+
+
+def test_leftovers_of_an_interrupted_write_are_cut_off(tmp_path):
+    store = open_store(tmp_path)
+    add(store, "A1")
+    # A writer that stopped after its vectors and part of its record
+    with open(tmp_path / FlatVectorStore.VECTORS_FILE, "ab") as f:
+        f.write(np.zeros(16, dtype=np.float32).tobytes())
+    with open(tmp_path / FlatVectorStore.RECORDS_FILE, "ab") as f:
+        f.write(b'{"id": "lost", "te')
+
+    reopened = open_store(tmp_path)
+    add(reopened, "A2")
+
+    assert [nearest(open_store(tmp_path), c) for c in ("A1", "A2")] == [("A1", 0.0), ("A2", 0.0)]
+
+
+def _add_many(directory, prefix, start):
+    store = open_store(directory)
+    start.wait()
+    for i in range(150):
+        add(store, f"{prefix}{i}a", f"{prefix}{i}b")
+        nearest(store, f"{prefix}{i}a")
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_processes_appending_at_once_keep_rows_aligned(tmp_path):
+    open_store(tmp_path)
+    context = multiprocessing.get_context("fork")
+    start = context.Barrier(2)
+    workers = [context.Process(target=_add_many, args=(str(tmp_path), prefix, start)) for prefix in "AB"]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+    assert [worker.exitcode for worker in workers] == [0, 0]
+
+    store = open_store(tmp_path)
+    chunk_ids = store.get_chunks()["ids"]
+    assert len(chunk_ids) == 600
+    assert os.path.getsize(tmp_path / FlatVectorStore.VECTORS_FILE) == 600 * 16 * 4
+    assert all(nearest(store, c) == (c, 0.0) for c in chunk_ids)
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.session import UserSession
+from app.services import history_manager as history_module
+from app.services.history_manager import HistoryManager
+from app.services.session_manager import SessionManager
+from app.services.session_store import MemorySessionStore
+
+
+def converse(session, turns, start=0, words=3):
+    """Add question/answer turns with increasing timestamps"""
+    for turn in range(start, start + turns):
+        for i, role in enumerate(("user", "assistant")):
+            message = session.add_chat_message(role, f"{role} {turn} " + "word " * words)
+            message["timestamp"] = f"2026-01-01T00:{turn:02d}:{i:02d}"
+
+
+def contents(messages):
+    return [message["content"].split(" word")[0] for message in messages]
+
+
+def test_history_is_the_last_turns_of_the_window():
+    session = UserSession()
+    converse(session, 5)
+
+    window, summary = HistoryManager(window_turns=2, token_budget=1000, summary_enabled=False).get_history(session)
+
+    assert contents(window) == ["user 3", "assistant 3", "user 4", "assistant 4"]
+    assert summary == ""
+
+
+def test_history_is_trimmed_to_the_token_budget_but_keeps_the_last_turn():
+    session = UserSession()
+    # About 32 tokens per message
+    converse(session, 3, words=24)
+
+    trimmed, _ = HistoryManager(window_turns=3, token_budget=100, summary_enabled=False).get_history(session)
+    over_budget, _ = HistoryManager(window_turns=3, token_budget=10, summary_enabled=False).get_history(session)
+
+    assert contents(trimmed) == ["assistant 1", "user 2", "assistant 2"]
+    assert contents(over_budget) == ["user 2", "assistant 2"]
+
+
+@pytest.fixture
+def session_manager(monkeypatch):
+    manager = SessionManager(MemorySessionStore(ttl_seconds=100))
+    monkeypatch.setattr(history_module, "services", SimpleNamespace(session_manager=manager))
+    return manager
+
+
+def test_turns_leaving_the_window_are_folded_into_the_summary_once(session_manager):
+    calls = []
+
+    def summarize_history(summary, messages):
+        calls.append(contents(messages))
+        return " ".join(filter(None, [summary] + contents(messages)))
+
+    rag_service = SimpleNamespace(summarize_history=summarize_history)
+    history = HistoryManager(window_turns=2, token_budget=1000, summary_enabled=True)
+    session = UserSession()
+    session_manager.save_session(session)
+
+    converse(session, 2)
+    history._update_summary(session, rag_service)
+    assert calls == []
+
+    converse(session, 1, start=2)
+    history._update_summary(session, rag_service)
+    converse(session, 1, start=3)
+    history._update_summary(session, rag_service)
+
+    # Each turn is summarized once, on top of the summary so far
+    assert calls == [["user 0", "assistant 0"], ["user 1", "assistant 1"]]
+    window, summary = history.get_history(session)
+    assert summary == "user 0 assistant 0 user 1 assistant 1"
+    assert contents(window) == ["user 2", "assistant 2", "user 3", "assistant 3"]
+    assert session.summarized_until == "2026-01-01T00:01:01"
+
+
+def test_no_summary_work_when_disabled(session_manager):
+    rag_service = SimpleNamespace(summarize_history=pytest.fail)
+    history = HistoryManager(window_turns=1, token_budget=1000, summary_enabled=False)
+    session = UserSession()
+    converse(session, 3)
+
+    history.schedule_summary(session, rag_service)
+
+    assert history._executor is None
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import os
+import time
+
+from langchain.schema import Document
+
+from app.core.config import settings
+from app.models.session import UserSession
+from app.services import janitor as janitor_module
+from app.services import rag_service as rag_module
+from app.services.ingestion import IngestionManager
+from app.services.janitor import Janitor
+from app.services.session_manager import SessionManager
+from app.services.session_store import MemorySessionStore
+from tests.fakes import CountingEmbeddings
+
+
+def test_janitor_leaves_sessions_within_the_grace_period_to_other_workers(rag_service, tmp_path, monkeypatch):
+    service = rag_service(CountingEmbeddings())
+    store = MemorySessionStore(ttl_seconds=100)
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(janitor_module, "vectorstore_registry", rag_module.vectorstore_registry)
+    # No local jobs: another worker may be ingesting for either session
+    monkeypatch.setattr(janitor_module, "services", SimpleNamespace(
+        session_manager=SessionManager(store),
+        ingestion_manager=IngestionManager(parse_workers=1, embed_workers=1),
+        rag_service=service
+    ))
+
+    sessions = {}
+    for name, expired_for in (("recent", 600), ("old", 7200)):
+        session = UserSession()
+        session.collection_name = f"collection_{session.session_id}"
+        path = upload_dir / f"{name}.txt"
+        path.write_text(name)
+        os.utime(path, (time.time() - 7200, time.time() - 7200))
+        session.add_file(f"{name}.txt", str(path), "txt", len(name))
+        session.last_active = datetime.now() - timedelta(seconds=100 + expired_for)
+        store.save(session)
+        service.create_or_update_vectorstore([Document(page_content=name)], session.collection_name)
+        sessions[name] = session
+
+    result = Janitor(interval_seconds=3600, grace_seconds=3600).run_once()
+
+    assert result["expired_sessions"] == 1
+    assert result["collections"] == 1
+    assert result["compaction_bytes"] == 0
+    assert [s.session_id for s in store.expired_sessions()] == [sessions["recent"].session_id]
+    assert rag_module.vectorstore_registry.collection_names() == [sessions["recent"].collection_name]
+    assert sorted(os.listdir(upload_dir)) == ["recent.txt"]
@@ -0,0 +1,30 @@
+import time
+
+from app.services.vectorstore_registry import ObjectCache
+
+
+def test_evicts_least_recently_used_past_max_size():
+    cache = ObjectCache("test", max_size=2, idle_seconds=3600)
+    for key in ("a", "b", "c"):
+        cache.get_or_create(key, lambda key=key: key.upper())
+
+    built = []
+    cache.get_or_create("a", lambda: built.append("a") or "A")
+    assert built == ["a"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_pinned_entry_survives_eviction():
+    cache = ObjectCache("test", max_size=1, idle_seconds=3600)
+    pinned = object()
+    with cache.pin("index"):
+        assert cache.get_or_create("index", lambda: pinned) is pinned
+        cache.get_or_create("other", object)
+        # Idle eviction skips it too
+        cache.idle_seconds = 0
+        time.sleep(0.01)
+        cache.get_or_create("another", object)
+        assert cache.get_or_create("index", object) is pinned
+
+    cache.get_or_create("last", object)
+    assert cache.get_or_create("index", object) is not pinned
@@ -0,0 +1,48 @@
+import time
+
+from langchain.schema import Document
+
+from app.services.reranker import MMRReranker
+from tests.fakes import CountingEmbeddings
+
+
+class FakeVectorStore:
+    """Serves stored vectors by chunk ID, taking `latency` seconds per read"""
+
+    def __init__(self, vectors, latency=0.0):
+        self.vectors = vectors
+        self.latency = latency
+
+    def get_chunks(self, ids, include):
+        time.sleep(self.latency)
+        known = [chunk_id for chunk_id in ids if chunk_id in self.vectors]
+        return {"ids": known, "embeddings": [self.vectors[chunk_id] for chunk_id in known]}
+
+
+def documents():
+    return [Document(page_content=f"chunk {i}", metadata={"chunk_id": str(i)}) for i in range(4)]
+
+
+VECTORS = {"0": [1.0, 0.0], "1": [1.0, 0.0], "2": [0.0, 1.0], "3": [0.7, 0.7]}
+
+
+def test_drops_duplicates_within_budget():
+    reranker = MMRReranker(FakeVectorStore(VECTORS), CountingEmbeddings(), lambda_mult=0.9, rank_weight=1.0)
+
+    ranked, complete = reranker.rerank("question", documents(), 3, time.monotonic() + 10)
+
+    assert complete
+    # "1" duplicates "0"
+    assert [doc.metadata["chunk_id"] for doc in ranked] == ["0", "2", "3"]
+
+
+def test_slow_vector_read_keeps_retrieval_order():
+    embeddings = CountingEmbeddings()
+    reranker = MMRReranker(FakeVectorStore(VECTORS, latency=0.05), embeddings, rank_weight=0.5)
+
+    ranked, complete = reranker.rerank("question", documents(), 3, time.monotonic() + 0.01)
+
+    assert not complete
+    assert [doc.metadata["chunk_id"] for doc in ranked] == ["0", "1", "2"]
+    # The question isn't embedded once the budget is spent
+    assert embeddings.calls == []
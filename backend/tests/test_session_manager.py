@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import time
+
+import pytest
+
+from app.models.session import UserSession
+from app.services.session_manager import SessionManager
+from app.services.session_store import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield MemorySessionStore(ttl_seconds=100)
+        return
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=100, batch_size=50, flush_interval=60)
+    yield store
+    store.close()
+
+
+def test_reading_a_session_keeps_it_alive(store):
+    manager = SessionManager(store)
+    session = UserSession()
+    session.last_active = datetime.now() - timedelta(seconds=90)
+    store.save(session)
+    cookie = manager.serializer.dumps(session.session_id)
+
+    loaded = manager.get_session(SimpleNamespace(cookies={manager.cookie_name: cookie}))
+
+    assert loaded.session_id == session.session_id
+    assert loaded.last_active > datetime.now() - timedelta(seconds=5)
+    # The janitor sees the new time, not the one from 90 seconds ago
+    assert [s.session_id for s in store.active_sessions()] == [session.session_id]
+    assert store.active_sessions()[0].last_active > datetime.now() - timedelta(seconds=5)
+
+
+def test_sqlite_reads_dont_wait_for_a_flush(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), ttl_seconds=100, batch_size=50, flush_interval=60)
+    session = UserSession()
+    store.save(session)
+    store.append_message(session, {"role": "user", "content": "hello"})
+    try:
+        # Stand in for the flusher thread being in the middle of a slow batch
+        with store._flush_lock:
+            reader = ThreadPoolExecutor(max_workers=1)
+            loaded = reader.submit(store.load, session.session_id).result(timeout=5)
+            assert loaded.session_id == session.session_id
+            history = reader.submit(loaded.get_recent_history, 10)
+            # Reading the history waits for this worker's buffered messages to be written
+            time.sleep(0.2)
+            assert not history.done()
+        assert [m["content"] for m in history.result(timeout=5)] == ["hello"]
+        reader.shutdown()
+    finally:
+        store.close()
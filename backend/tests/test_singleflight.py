@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core.metrics import single_flight_calls
+from app.utils.singleflight import AsyncSingleFlight, SingleFlight
+from tests.fakes import CountingEmbeddings
+
+
+def wait_for_coalesced(kind: str, count: int) -> None:
+    """Wait until count callers are waiting on a call in flight"""
+    deadline = time.monotonic() + 5
+    while single_flight_calls.value(kind=kind, outcome="coalesced") < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test_shared")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flight.do, "key", work) for _ in range(4)]
+        wait_for_coalesced("test_shared", 3)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [1]
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert {result for result, _ in results} == {"result"}
+    # Nothing is kept once the call finishes
+    assert flight.do("key", lambda: "again") == ("again", False)
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight("test_errors")
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, "key", lambda: "not run")
+        wait_for_coalesced("test_errors", 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+
+def test_disabled_runs_every_call():
+    flight = SingleFlight("test", enabled=False)
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.do("key", lambda: 2) == (2, False)
+
+
+def test_async_calls_share_one_execution_and_survive_cancellation():
+    flight = AsyncSingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        third = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        # The leader's client goes away; the others still get the answer
+        first.cancel()
+        return await asyncio.gather(second, third), first.cancelled()
+
+    results, cancelled = asyncio.run(run())
+
+    assert cancelled
+    assert calls == [1]
+    assert results == [("answer", True), ("answer", True)]
+
+
+def test_chat_turn_is_recorded_once_when_the_first_caller_goes_away(rag_service, monkeypatch):
+    service = rag_service(CountingEmbeddings())
+    recorded = []
+
+    async def run():
+        release = asyncio.Event()
+
+        async def aquery(*args):
+            await release.wait()
+            return "answer", []
+
+        monkeypatch.setattr(service, "aquery", aquery)
+        ask = lambda caller: service.aquery_coalesced(
+            "question", "docs", [], on_answer=lambda answer, sources: recorded.append((caller, answer))
+        )
+        first = asyncio.ensure_future(ask("first"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(ask("second"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await second
+
+    assert asyncio.run(run()) == ("answer", [], True)
+    assert recorded == [("first", "answer")]
@@ -10,6 +10,14 @@ export async function uploadFiles(files) {
   return res.json()
 }
 
+export async function getUploadStatus(jobId) {
+  const res = await fetch(`/api/upload/${jobId}`, {
+    credentials: 'include' // Include cookies for session tracking
+  })
+  if (!res.ok) throw new Error(await res.text())
+  return res.json()
+}
+
 export async function sendMessage(text, options = {}) {
   const res = await fetch('/api/chat', {
     method: 'POST',
@@ -1,5 +1,5 @@
 import React, { useState } from 'react'
-import { uploadFiles } from '../api'
+import { uploadFiles, getUploadStatus } from '../api'
 
 const ACCEPT = [
   '.pdf',
@@ -9,6 +9,18 @@ const ACCEPT = [
   '.xlsx'
 ].join(',')
 
+const POLL_INTERVAL_MS = 1000
+
+async function waitForJob(jobId, onProgress) {
+  for (;;) {
+    const job = await getUploadStatus(jobId)
+    if (job.status === 'completed' || job.status === 'failed') return job
+    const done = job.files.filter((f) => f.status === 'completed').length
+    onProgress(`Processing... ${done}/${job.files.length} files done`)
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS))
+  }
+}
+
 export default function FileUploader({ darkMode }) {
   const [files, setFiles] = useState([])
   const [status, setStatus] = useState(null)
@@ -32,6 +44,12 @@ export default function FileUploader({ darkMode }) {
       const res = await uploadFiles(files)
       setStatus(res.message || 'Files uploaded successfully')
       setFiles([])
+      if (res.job_id) {
+        const job = await waitForJob(res.job_id, setStatus)
+        setStatus(job.status === 'completed'
+          ? 'Files processed successfully'
+          : `Processing failed: ${job.error}`)
+      }
     } catch (err) {
       setStatus(err?.message || 'Upload failed')
     } finally {